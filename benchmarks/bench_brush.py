@@ -0,0 +1,37 @@
+# opico draw - brush microbenchmark
+# compares how many segments per second the round (line + ellipses) and dab brushes draw
+# usage: python benchmarks/bench_brush.py
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_common import make_points
+from opicodraw_engine import DrawingEngine
+
+# time drawing the points in batches of batch_size, returns segments per second
+def bench(brush, pen_width, points, batch_size=8, repeats=3):
+    best = None
+    for _ in range(repeats):
+        engine = DrawingEngine(600, 300, brush=brush)
+        start = time.perf_counter()
+        engine.begin_stroke(points[0][0], points[0][1], pen_width, "#000000", 1)
+        for i in range(1, len(points), batch_size):
+            engine.add_points(points[i:i + batch_size])
+        engine.end_stroke()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (len(points) - 1) / best
+
+def main():
+    points = make_points(2000, 600, 300)
+    print(f"{'pen width':>9}  {'round seg/s':>12}  {'dab seg/s':>12}  {'speedup':>8}")
+    for pen_width in (2, 4, 8, 16, 25):
+        round_rate = bench("round", pen_width, points)
+        dab_rate = bench("dab", pen_width, points)
+        print(f"{pen_width:9d}  {round_rate:12.0f}  {dab_rate:12.0f}  {dab_rate / round_rate:7.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+# opico draw - helpers shared by the benchmarks
+
+import math
+
+# a wobbly stroke made of short segments across a width x height canvas, like mouse samples after smoothing
+# phase moves it around so strokes on several layers do not overlap exactly
+def make_points(count, width, height, phase=0.0):
+    return [
+        (width / 2 + math.cos(i / 30 + phase) * (width / 3) + math.sin(i / 3) * 4,
+         height / 2 + math.sin(i / 25 + phase) * (height / 3) + math.cos(i / 4) * 4)
+        for i in range(count)
+    ]
@@ -0,0 +1,88 @@
+# opico draw - layer compositing benchmark
+# times drawing on one layer of a stack while the canvas is refreshed after every batch, and
+# flattening for an export, for more and more layers. with the cached composite both should stay
+# about flat, the naive column flattens every layer on each refresh for comparison
+# usage: python benchmarks/bench_layers.py
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PIL import Image
+
+from bench_common import make_points
+from opicodraw_engine import DrawingEngine
+
+WIDTH, HEIGHT = 600, 300
+
+# draw a stroke, refreshing the area each batch changed like update_canvas does
+# naive flattens every layer of that area instead of using the cached composite
+def draw(engine, points, naive=False, batch_size=8):
+    engine.begin_stroke(points[0][0], points[0][1], 6, "#000000", 1)
+    for i in range(1, len(points), batch_size):
+        polyline = engine.add_points(points[i:i + batch_size])
+        if not polyline:
+            continue
+        xs = [p[0] for p in polyline]
+        ys = [p[1] for p in polyline]
+        box = (
+            max(0, int(min(xs)) - 4), max(0, int(min(ys)) - 4),
+            min(WIDTH, int(max(xs)) + 5), min(HEIGHT, int(max(ys)) + 5)
+        )
+        if naive:
+            # what render_region does, on every layer flattened just for this box
+            s = engine.scale_factor
+            margin = 3 * s + 1
+            layers = engine.layers.layers
+            source = layers[0].clip((box[0] * s - margin, box[1] * s - margin, box[2] * s + margin, box[3] * s + margin))
+            area = layers[0].crop(source)
+            for layer in layers[1:]:
+                area.alpha_composite(layer.crop(source))
+            area.resize(
+                (box[2] - box[0], box[3] - box[1]), Image.LANCZOS,
+                box=(box[0] * s - source[0], box[1] * s - source[1], box[2] * s - source[0], box[3] * s - source[1])
+            )
+        else:
+            engine.render_region(box)
+    engine.end_stroke()
+
+# an engine with layer_count layers that each have a stroke, drawing on the middle one
+def make_engine(layer_count):
+    engine = DrawingEngine(WIDTH, HEIGHT)
+    for layer in range(layer_count):
+        if layer:
+            engine.add_layer()
+        draw(engine, make_points(400, WIDTH, HEIGHT, phase=layer))
+    engine.select_layer(layer_count // 2)
+    engine.render_region((0, 0, WIDTH, HEIGHT))
+    return engine
+
+# best time of a few runs of fn(engine) on fresh engines, in milliseconds
+def bench(layer_count, fn, repeats=3):
+    best = None
+    for _ in range(repeats):
+        engine = make_engine(layer_count)
+        start = time.perf_counter()
+        fn(engine)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+def flatten(engine):
+    for _ in range(5):
+        engine.revision += 1  # skip the flatten cache, the composite is still reused
+        engine.flatten()
+
+def main():
+    points = make_points(1000, WIDTH, HEIGHT)
+    print(f"{'layers':>6}  {'stroke ms':>10}  {'naive ms':>10}  {'flatten ms':>11}")
+    for layer_count in (1, 2, 4, 8, 16):
+        stroke = bench(layer_count, lambda engine: draw(engine, points))
+        naive = bench(layer_count, lambda engine: draw(engine, points, naive=True))
+        flat = bench(layer_count, flatten) / 5
+        print(f"{layer_count:6d}  {stroke:10.1f}  {naive:10.1f}  {flat:11.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+# opico draw - end to end drawing benchmark
+# replays synthetic strokes through OpicoDrawApp (press, drag, release, undo, redo, copy to clipboard)
+# with stub tk, tray, hotkey, pyautogui and clipboard objects so it runs headless on any os.
+# every case runs in its own process so the peak memory is its own
+# usage: python benchmarks/bench_pipeline.py [--quick] [--output results.json]
+#        [--baseline benchmarks/pipeline_baseline.json] [--save-baseline] [--tolerance 0.3]
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "pipeline_baseline.json")
+
+# mouse samples that arrive between two frames (a 1000 hz mouse at 120 fps)
+EVENTS_PER_FRAME = 8
+
+# roughly how many input events every case replays
+EVENTS_PER_CASE = 3000
+
+CANVAS_SIZES = [(600, 300), (1280, 720), (1920, 1080)]
+PEN_WIDTHS = [2, 8, 25]
+SCENARIOS = ["scribble", "lines", "dots", "hatching"]
+
+# metric -> (better, relative tolerance) used when comparing with the baseline
+METRICS = {
+    "events_per_sec": ("higher", 0.30),
+    "frame_ms_p95": ("lower", 0.30),
+    "release_ms_p95": ("lower", 0.30),
+    "undo_ms_p95": ("lower", 0.30),
+    "export_ms": ("lower", 0.30),
+    "export_ui_ms": ("lower", 0.30),
+    "peak_rss_mb": ("lower", 0.15),
+}
+
+# stand-ins for the modules and tk objects that need a display, a tray or windows
+class StubPhotoImage:
+    count = 0
+
+    def __init__(self, image=None, size=None, **kwargs):
+        StubPhotoImage.count += 1
+        self.name = f"photo{StubPhotoImage.count}"
+        if hasattr(image, "tobytes"):
+            # a real photo image copies the pixels into tk
+            self.size = image.size
+            image.tobytes()
+        else:
+            self.size = size or (16, 16)
+
+    def width(self):
+        return self.size[0]
+
+    def height(self):
+        return self.size[1]
+
+    def __str__(self):
+        return self.name
+
+class StubWidget:
+    def __init__(self, *args, **kwargs):
+        self.tk = self
+        self.items = {}
+        self.next_item = 0
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+    def winfo_exists(self):
+        return True
+
+    def call(self, *args):
+        return None
+
+    def create_item(self, *args, tags=None, **kwargs):
+        self.next_item += 1
+        self.items[self.next_item] = tags
+        return self.next_item
+
+    create_line = create_oval = create_image = create_item
+
+    def delete(self, tag):
+        if tag == "all":
+            self.items.clear()
+        else:
+            self.items = {item: tags for item, tags in self.items.items() if tags != tag}
+
+class StubRoot:
+    def __init__(self, pointer=(0, 0)):
+        self.timers = {}
+        self.next_timer = 0
+        self.pointer = pointer  # where the mouse is, the drawing window opens around it
+
+    def after(self, ms, func=None, *args):
+        self.next_timer += 1
+        self.timers[self.next_timer] = (func, args)
+        return self.next_timer
+
+    def after_idle(self, func, *args):
+        return self.after(0, func, *args)
+
+    def after_cancel(self, timer_id):
+        self.timers.pop(timer_id, None)
+
+    # run the timers that are queued now, like one turn of the tk event loop
+    def run_timers(self):
+        timers, self.timers = self.timers, {}
+        for func, args in timers.values():
+            func(*args)
+
+    def update(self):
+        self.run_timers()
+
+    def winfo_pointerxy(self):
+        return self.pointer
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+class StubClipboard(types.ModuleType):
+    CF_DIB = 8
+
+    def __init__(self):
+        super().__init__("win32clipboard")
+        self.data = None
+
+    def OpenClipboard(self):
+        pass
+
+    def EmptyClipboard(self):
+        pass
+
+    def CloseClipboard(self):
+        pass
+
+    def SetClipboardData(self, format, data):
+        self.data = data
+
+# put the stubs in place and import the app, returns (opicodraw module, clipboard stub)
+def import_app(canvas_size):
+    clipboard = StubClipboard()
+    pyautogui = types.ModuleType("pyautogui")
+    pyautogui.position = lambda: (canvas_size[0], canvas_size[1])
+    keyboard = types.ModuleType("keyboard")
+    keyboard.add_hotkey = lambda *args, **kwargs: 1
+    keyboard.remove_hotkey = lambda *args, **kwargs: None
+    pystray = types.ModuleType("pystray")
+    pystray.Icon = StubWidget
+    pystray.Menu = lambda *items: items
+    pystray.MenuItem = lambda *args, **kwargs: args
+    sys.modules.update({"win32clipboard": clipboard, "pyautogui": pyautogui, "keyboard": keyboard, "pystray": pystray})
+
+    import tkinter
+    import opicodraw
+    tkinter.Toplevel = StubWidget
+    tkinter.Canvas = StubWidget
+    opicodraw.ImageTk.PhotoImage = StubPhotoImage
+    return opicodraw, clipboard
+
+# mouse event with a position
+class Event:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+# strokes for a scenario as lists of (x, y) samples, a single sample is a dot
+def make_strokes(scenario, width, height, pen_width, seed=1):
+    rng = random.Random(seed)
+    strokes = []
+    if scenario == "scribble":
+        while sum(len(s) for s in strokes) < EVENTS_PER_CASE:
+            x, y, angle = rng.uniform(0, width), rng.uniform(0, height), rng.uniform(0, math.tau)
+            stroke = []
+            for _ in range(150):
+                angle += rng.uniform(-0.5, 0.5)
+                x = min(width - 1, max(0, x + math.cos(angle) * 4))
+                y = min(height - 1, max(0, y + math.sin(angle) * 4))
+                stroke.append((int(x), int(y)))
+            strokes.append(stroke)
+    elif scenario == "lines":
+        while sum(len(s) for s in strokes) < EVENTS_PER_CASE:
+            x0, y0 = rng.uniform(0, width * 0.2), rng.uniform(0, height)
+            x1, y1 = rng.uniform(width * 0.8, width), rng.uniform(0, height)
+            steps = max(2, int(math.hypot(x1 - x0, y1 - y0) / 3))
+            strokes.append([(int(x0 + (x1 - x0) * i / steps), int(y0 + (y1 - y0) * i / steps)) for i in range(steps + 1)])
+    elif scenario == "dots":
+        strokes = [[(rng.randrange(width), rng.randrange(height))] for _ in range(EVENTS_PER_CASE // 3)]
+    elif scenario == "hatching":
+        spacing = max(2, pen_width)
+        length = min(width, height) // 3
+        x0, y0 = (width - length) // 2, (height - length) // 2
+        offset = 0
+        while sum(len(s) for s in strokes) < EVENTS_PER_CASE:
+            start = offset % (2 * length)
+            strokes.append([(x0 + start + i - length, y0 + i) for i in range(0, length, 2)])
+            offset += spacing
+    return strokes
+
+# nearest rank percentile of a list of numbers
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[max(1, math.ceil(fraction * len(values))) - 1]
+
+# peak resident memory of this process in mb, or none where it can not be read
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+# replay one case through a fresh app and return its metrics
+def run_case(case):
+    scenario, width, height, pen_width = case
+    opicodraw, clipboard = import_app((width, height))
+
+    with tempfile.TemporaryDirectory() as home:
+        os.environ["APPDATA"] = home
+        os.environ["USERPROFILE"] = home
+        os.makedirs(os.path.join(home, "opicodraw"))
+        with open(os.path.join(home, "opicodraw", "config.json"), "w") as file:
+            json.dump({"window_width": width, "window_height": height, "pen_width": pen_width, "smoothing_factor": 4}, file)
+
+        root = StubRoot((width, height))
+        with contextlib.redirect_stdout(io.StringIO()):
+            app = opicodraw.OpicoDrawApp(root)
+            app.show_window()
+            root.run_timers()
+
+            strokes = make_strokes(scenario, width, height, pen_width)
+            frame_times, release_times = [], []
+            events = 0
+            busy = 0.0
+            for stroke in strokes:
+                start = time.perf_counter()
+                app.on_button_press(Event(*stroke[0]))
+                busy += time.perf_counter() - start
+                events += 1
+                for i in range(1, len(stroke), EVENTS_PER_FRAME):
+                    start = time.perf_counter()
+                    for x, y in stroke[i:i + EVENTS_PER_FRAME]:
+                        app.on_mouse_drag(Event(x, y))
+                    root.run_timers()
+                    elapsed = time.perf_counter() - start
+                    frame_times.append(elapsed * 1000)
+                    busy += elapsed
+                    events += len(stroke[i:i + EVENTS_PER_FRAME])
+                start = time.perf_counter()
+                app.on_button_release(Event(*stroke[-1]))
+                elapsed = time.perf_counter() - start
+                release_times.append(elapsed * 1000)
+                busy += elapsed
+                events += 1
+
+            undo_times, redo_times = [], []
+            for _ in range(min(20, len(strokes))):
+                start = time.perf_counter()
+                app.undo()
+                undo_times.append((time.perf_counter() - start) * 1000)
+            for _ in range(len(undo_times)):
+                start = time.perf_counter()
+                app.redo()
+                redo_times.append((time.perf_counter() - start) * 1000)
+
+            # copy to the clipboard: the time on the ui thread and the time until the data is there
+            clipboard.data = None
+            start = time.perf_counter()
+            app.save_as_png()
+            export_ui = time.perf_counter() - start
+            while clipboard.data is None:
+                root.run_timers()
+                time.sleep(0.0005)
+            export = time.perf_counter() - start
+
+            app.export_worker.shutdown()
+            history_peak_mb = app.engine.journal.peak_history_bytes / (1024 * 1024)
+
+    return {
+        "scenario": scenario,
+        "canvas": [width, height],
+        "pen_width": pen_width,
+        "strokes": len(strokes),
+        "events": events,
+        "events_per_sec": events / busy,
+        "frame_ms_p50": percentile(frame_times, 0.50),
+        "frame_ms_p95": percentile(frame_times, 0.95),
+        "frame_ms_p99": percentile(frame_times, 0.99),
+        "release_ms_p50": percentile(release_times, 0.50),
+        "release_ms_p95": percentile(release_times, 0.95),
+        "release_ms_p99": percentile(release_times, 0.99),
+        "undo_ms_p50": percentile(undo_times, 0.50),
+        "undo_ms_p95": percentile(undo_times, 0.95),
+        "redo_ms_p95": percentile(redo_times, 0.95),
+        "export_ui_ms": export_ui * 1000,
+        "export_ms": export * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+        "history_peak_mb": history_peak_mb,
+    }
+
+def case_name(case):
+    scenario, width, height, pen_width = case
+    return f"{scenario}-{width}x{height}-pen{pen_width}"
+
+# compare results with a baseline, returns the number of regressions
+def compare(results, baseline, tolerance=None):
+    regressions = 0
+    print(f"\n{'case':<32} {'metric':<16} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, metrics in results["cases"].items():
+        old = baseline.get("cases", {}).get(name)
+        if old is None:
+            continue
+        for metric, (better, metric_tolerance) in METRICS.items():
+            before, now = old.get(metric), metrics.get(metric)
+            if not before or now is None:
+                continue
+            change = (now - before) / before
+            limit = tolerance if tolerance is not None else metric_tolerance
+            worse = change < -limit if better == "higher" else change > limit
+            regressions += worse
+            if worse or abs(change) > limit:
+                status = "regressed" if worse else "improved"
+                print(f"{name:<32} {metric:<16} {before:10.2f} {now:10.2f} {change:+7.0%}  {status}")
+    print(f"{regressions} regression(s) beyond tolerance")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="replay synthetic strokes through opico draw and time them")
+    parser.add_argument("--quick", action="store_true", help="only the smallest canvas and one pen width")
+    parser.add_argument("--output", default="pipeline_results.json", help="where to write the results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to the baseline file even if it exists")
+    parser.add_argument("--tolerance", type=float, help="relative tolerance for every metric, overrides the defaults")
+    args = parser.parse_args()
+
+    sizes = CANVAS_SIZES[:1] if args.quick else CANVAS_SIZES
+    widths = [8] if args.quick else PEN_WIDTHS
+    cases = [(scenario, w, h, pen) for (w, h) in sizes for pen in widths for scenario in SCENARIOS]
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "events_per_frame": EVENTS_PER_FRAME,
+        },
+        "cases": {},
+    }
+    print(f"{'case':<32} {'events/s':>9} {'frame p95':>10} {'release p95':>12} {'undo p95':>9} {'export':>8} {'rss mb':>7}")
+    # one process per case so every case starts clean and gets its own peak memory
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for case, metrics in zip(cases, pool.imap(run_case, cases)):
+            results["cases"][case_name(case)] = metrics
+            rss = metrics["peak_rss_mb"]
+            print(
+                f"{case_name(case):<32} {metrics['events_per_sec']:9.0f} {metrics['frame_ms_p95']:8.2f}ms "
+                f"{metrics['release_ms_p95']:10.2f}ms {metrics['undo_ms_p95']:7.2f}ms {metrics['export_ms']:6.1f}ms "
+                f"{rss if rss is not None else float('nan'):7.1f}"
+            )
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"results written to {args.output}")
+
+    # timings only compare on the machine they were taken on, so the first run saves its own baseline
+    regressions = 0
+    if args.save_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"baseline written to {args.baseline}, later runs compare against it")
+    else:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# opico draw - zoom and pan benchmark
+# times redrawing a whole window over a big canvas at every zoom step, from the view pyramid as a
+# draft while the view moves and filtered once it settles, against resampling the supersampled
+# layers for every frame. then times a drag across the canvas and how long a stroke takes to show
+# usage: python benchmarks/bench_viewport.py [--canvas 4000x3000] [--window 1280x720]
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PIL import Image
+
+from opicodraw_engine import DrawingEngine
+
+# random walks over the whole canvas, like a page of notes
+def draw_strokes(engine, count=40, seed=1):
+    rng = random.Random(seed)
+    for _ in range(count):
+        points = [(rng.uniform(0, engine.width), rng.uniform(0, engine.height))]
+        for _ in range(200):
+            points.append((points[-1][0] + rng.uniform(-30, 30), points[-1][1] + rng.uniform(-30, 30)))
+        engine.begin_stroke(points[0][0], points[0][1], 8, "#204080", 1)
+        engine.add_points(points[1:])
+        engine.end_stroke()
+
+# what a window costs without the pyramid: the visible part of the layers resampled to the window
+def render_naive(engine, window, scroll_x, scroll_y, zoom):
+    s = engine.scale_factor
+    view = engine.layers.view()
+    box = view.clip((scroll_x * s / zoom, scroll_y * s / zoom, (scroll_x + window[0]) * s / zoom, (scroll_y + window[1]) * s / zoom))
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return None
+    size = (max(1, round((box[2] - box[0]) * zoom / s)), max(1, round((box[3] - box[1]) * zoom / s)))
+    return view.crop(box).resize(size, Image.LANCZOS)
+
+# scroll that centers the canvas in the window at a zoom
+def centered(engine, window, zoom):
+    return round(engine.width * zoom / 2 - window[0] / 2), round(engine.height * zoom / 2 - window[1] / 2)
+
+# median time of fn() over a few runs, in milliseconds
+def median_ms(fn, repeats=5):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return times[len(times) // 2]
+
+def size_arg(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--canvas", type=size_arg, default=(4000, 3000))
+    parser.add_argument("--window", type=size_arg, default=(1280, 720))
+    args = parser.parse_args()
+    window = args.window
+    box = (0, 0) + window
+
+    engine = DrawingEngine(*args.canvas)
+    start = time.perf_counter()
+    draw_strokes(engine)
+    print(f"{args.canvas[0]}x{args.canvas[1]} canvas, {window[0]}x{window[1]} window, "
+          f"strokes drawn in {time.perf_counter() - start:.1f} s")
+
+    print(f"{'zoom':>7}  {'first ms':>9}  {'draft ms':>9}  {'settled ms':>10}  {'naive ms':>9}")
+    for step in range(-16, 17, 2):
+        zoom = 2 ** (step / 4)
+        scroll_x, scroll_y = centered(engine, window, zoom)
+        # the first frame at a zoom also makes the stale parts of its level
+        first = median_ms(lambda: engine.render_view(box, scroll_x, scroll_y, zoom), repeats=1)
+        draft = median_ms(lambda: engine.render_view(box, scroll_x + 7, scroll_y + 5, zoom, True))
+        settled = median_ms(lambda: engine.render_view(box, scroll_x + 7, scroll_y + 5, zoom))
+        naive = median_ms(lambda: render_naive(engine, window, scroll_x, scroll_y, zoom), repeats=1)
+        print(f"{zoom:7.3f}  {first:9.1f}  {draft:9.1f}  {settled:10.1f}  {naive:9.1f}")
+
+    # a drag across the canvas at 100 %, one frame per 8 pixels
+    scroll_x, scroll_y = centered(engine, window, 1)
+    frames = []
+    for i in range(120):
+        start = time.perf_counter()
+        engine.render_view(box, scroll_x + i * 8, scroll_y + i * 4, 1, True)
+        frames.append((time.perf_counter() - start) * 1000)
+    frames.sort()
+    print(f"pan at 100 %: median {frames[len(frames) // 2]:.1f} ms, worst {frames[-1]:.1f} ms per frame")
+
+    # a stroke in the middle of the window and its refresh, like releasing the mouse
+    def stroke():
+        cx, cy = (scroll_x + window[0] / 2), (scroll_y + window[1] / 2)
+        engine.begin_stroke(cx, cy, 8, "#000000", 1)
+        engine.add_points([(cx + math.cos(i / 10) * 200, cy + math.sin(i / 7) * 150) for i in range(200)])
+        bbox = engine.end_stroke()
+        engine.render_view((int(bbox[0]) - scroll_x, int(bbox[1]) - scroll_y, int(bbox[2]) - scroll_x + 1,
+                            int(bbox[3]) - scroll_y + 1), scroll_x, scroll_y, 1)
+    print(f"stroke and refresh at 100 %: {median_ms(stroke):.1f} ms")
+    print(f"layers: {engine.layers.allocated_bytes() / (1024 * 1024):.1f} mb, "
+          f"view pyramid: {engine.pyramid.allocated_bytes() / (1024 * 1024):.1f} mb")
+
+if __name__ == "__main__":
+    main()
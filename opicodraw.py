@@ -3,34 +3,195 @@
 # made by ol1fer
 # github: https://github.com/ol1fer/opicodraw
 
+import sys
+import time
+from opicodraw_perf import (
+    HandlerStats, ProfileSession, SpanTracer, StartupProfiler, print_summary, release_memory, resident_memory_bytes
+)
+
+# --profile-startup prints how long each phase of startup and each import took
+startup_profiler = StartupProfiler(enabled="--profile-startup" in sys.argv)
+startup_profiler.begin("imports")
+
+# call counts and timing histograms of the tk event handlers
+handler_stats = HandlerStats()
+
+# pyautogui, pystray, win32clipboard and the tkinter dialogs are imported where they are used,
+# they are slow to load or rarely needed and opico draw starts with windows
 import tkinter as tk
-from tkinter import colorchooser, filedialog, messagebox
-from PIL import Image, ImageDraw, ImageTk
-import pystray
-from pystray import MenuItem as item
+from PIL import Image, ImageTk
 import keyboard
-import pyautogui
 import threading
-import win32clipboard
-from io import BytesIO
 import os
-import sys
 import json
+import math
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+from opicodraw_engine import (
+    FILL_TOLERANCE, DrawingEngine, ExportWorker, StrokeLog, load_background, prescale_background
+)
+from opicodraw_timelapse import TIMELAPSE_FRAMES
 
 import ctypes  # import ctypes for modifying window styles
 
 if sys.platform == 'win32':
     from ctypes import windll
 
+startup_profiler.end()
+
+# most points in one live preview line before a new one is started, keeps coords() cheap
+PREVIEW_CHUNK_POINTS = 512
+
+# longest time a finished stroke waits before the autosave writes it to disk
+AUTOSAVE_FLUSH_MS = 1000
+
+# how long after the last settings change config.json is written
+CONFIG_SAVE_DELAY_MS = 500
+
+# zoom goes in steps of a quarter of a doubling, from 1/16 to 16 times
+ZOOM_STEPS_PER_DOUBLING = 4
+MIN_ZOOM_STEP = -16
+MAX_ZOOM_STEP = 16
+
+# how far one notch of the mouse wheel scrolls, in window pixels
+SCROLL_STEP = 60
+
+# frames are drawn without filtering while the view moves, and filtered once it stood still this long
+VIEW_SETTLE_MS = 150
+
+# the window around the canvas when it is zoomed out or smaller than the window
+OUTSIDE_COLOR = "#a0a0a0"
+
+# folder the config, traces and autosave live in: %appdata%\opicodraw on windows, the xdg config folder elsewhere
+def config_directory():
+    base = os.getenv("APPDATA") or os.getenv("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(base, "opicodraw")
+
+# folder drawings are saved to by default, the pictures folder in the user's home on any os
+def pictures_directory():
+    home = os.getenv("USERPROFILE") or os.path.expanduser("~")
+    return os.path.join(home, "Pictures")
+
+# the image on the clipboard as a background for a canvas of size, runs on the import thread
+# a screenshot comes as an image, files copied in explorer as a list of names
+def clipboard_background(size):
+    from PIL import ImageGrab
+
+    grabbed = ImageGrab.grabclipboard()
+    if isinstance(grabbed, list) and grabbed:
+        return load_background(grabbed[0], size)
+    if not isinstance(grabbed, Image.Image):
+        raise ValueError("there is no image on the clipboard")
+    return prescale_background(grabbed, size)
+
+# config.json, written a moment after the last change on a background thread so changes in a row
+# are written once and the ui does not wait for the disk. the file is replaced atomically, a crash
+# leaves the old or the new one. changes made to it by something else are noticed with a stat
+class ConfigStore:
+    def __init__(self, path, root, delay_ms=CONFIG_SAVE_DELAY_MS):
+        self.path = path
+        self.root = root
+        self.delay_ms = delay_ms
+        self.pending = None  # values waiting to be written
+        self.after_id = None
+        self.stamp = None  # (mtime, size) of the file as it was last read or written
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="opicodraw-config")
+
+    # get the (mtime, size) of the file, none if it is missing
+    def file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    # read the config, none if the file is missing or empty, raises ValueError if it is not valid json
+    def load(self):
+        stamp = self.file_stamp()
+        with self.lock:
+            self.stamp = stamp
+        if stamp is None or stamp[1] == 0:
+            return None
+        with open(self.path, "r") as file:
+            return json.load(file)
+
+    # write values once no other change came in for delay_ms
+    def save(self, values):
+        self.pending = values
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+        self.after_id = self.root.after(self.delay_ms, self.flush)
+
+    # write the pending values now, wait blocks until they are on disk
+    def flush(self, wait=False):
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+        if self.pending is None:
+            return
+        data, self.pending = json.dumps(self.pending), None
+        future = self.executor.submit(self.write, data)
+        if wait:
+            future.result()
+
+    # write to a temporary file and move it over the config, runs on the background thread
+    def write(self, data):
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"could not save config: {e}")
+            return
+        with self.lock:
+            self.stamp = self.file_stamp()
+
+    # the config if the file changed since it was last read or written, else none
+    # costs one stat when nothing changed, unsaved changes of our own win over the file
+    def reload_if_changed(self):
+        if self.pending is not None:
+            return None
+        stamp = self.file_stamp()
+        with self.lock:
+            if stamp is None or stamp == self.stamp:
+                return None
+        try:
+            return self.load()
+        except (ValueError, OSError) as e:
+            print(f"config.json changed but could not be read, keeping the current settings: {e}")
+            return None
+
+    # write anything pending and stop the background thread
+    def close(self):
+        self.flush(wait=True)
+        self.executor.shutdown(wait=True)
+
 class OpicoDrawApp:
     # initialize the application
     def __init__(self, root):
         self.root = root
-        self.config_path = os.path.join(os.getenv("APPDATA"), "opicodraw")
+        self.config_path = config_directory()
         self.config_file = os.path.join(self.config_path, "config.json")
+        self.config_store = ConfigStore(self.config_file, root)
+        startup_profiler.begin("config load")
         self.load_config()
 
+        # latency of the main user flows, written to a rolling trace file in the config folder
+        self.tracer = SpanTracer(os.path.join(self.config_path, "trace.jsonl"))
+
+        # cprofile sessions started from the tray or with OPICODRAW_PROFILE, saved in the config folder
+        self.profile_session = ProfileSession(os.path.join(self.config_path, "profiles"))
+        if os.getenv("OPICODRAW_PROFILE"):
+            self.profile_session.start()
+
+        startup_profiler.begin("icon load")
         self.icon_image = self.load_icon("opicodraw.ico")
+        startup_profiler.end()
 
         self.drawing_window = None
         self.settings_window = None
@@ -38,23 +199,51 @@ class OpicoDrawApp:
         self.is_window_open = False
         self.hotkey_id = None  # track hotkey id
 
-        self.undo_stack = []
-        self.redo_stack = []
-        self.max_history = 128
+        self.engine = None
+        self.hibernated_drawing = None  # the compressed last drawing while the window is closed
+        self.export_worker = ExportWorker()
+        self.import_worker = None  # decodes images opened to draw on, made on first use
+
+        # strokes are logged to disk as they are drawn so a crash does not lose the drawing
+        self.autosave = StrokeLog(os.path.join(self.config_path, "autosave.journal"))
+        self.autosave_after_id = None
+        self.recovery_checked = False
+        self.photo_image = None
+        self.background_photo = None
+        self.dirty_rect = None
+
+        # the window shows the canvas scaled by zoom, with (scroll_x, scroll_y) in zoomed pixels at its top left
+        self.zoom_step, self.zoom = 0, 1
+        self.scroll_x = self.scroll_y = 0
+        self.view_changed = False  # the whole window is redrawn on the next update
+        self.view_after_id = None
+        self.settle_after_id = None
+        self.pan_anchor = None
+        self.pending_motion = []
+        self.motion_after_id = None
 
         # set default if not loaded from config
         if not hasattr(self, 'render_canvas_brushstroke'):
             self.render_canvas_brushstroke = True
 
-        # initialize tray_icon_updater_id
-        self.tray_icon_updater_id = None
+        # count timer wakeups when asked to, to check that an idle instance does no periodic work
+        self.wakeups = 0
+        if os.getenv("OPICODRAW_IDLE_STATS"):
+            self.start_wakeup_stats()
 
-        # create the tray icon before starting the update loop
+        # create the tray icon
+        startup_profiler.begin("tray creation")
         self.create_tray_icon()
 
         # apply the hotkey
+        startup_profiler.begin("hotkey")
         self.apply_hotkey()
 
+        # build the drawing window now so the hotkey only has to show it
+        startup_profiler.begin("drawing window")
+        self.build_drawing_window()
+        startup_profiler.end()
+
     # load the icon image
     def load_icon(self, icon_filename):
         try:
@@ -83,7 +272,7 @@ class OpicoDrawApp:
 
     # load configuration settings
     def load_config(self):
-        default_pictures_folder = os.path.join(os.getenv('USERPROFILE'), 'Pictures')
+        default_pictures_folder = pictures_directory()
         if not os.path.exists(self.config_path):
             os.makedirs(self.config_path)
 
@@ -97,36 +286,77 @@ class OpicoDrawApp:
         self.hotkey = "alt+shift+q"
         self.last_save_dir = default_pictures_folder
         self.render_canvas_brushstroke = True
+        self.render_fps = 120
+        self.max_motion_batch = 256
+        self.brush = "round"
+        self.raster_mode = "supersample"
+        self.history_budget_mb = 64
+        self.keep_last_drawing = False
+        self.fill_tolerance = FILL_TOLERANCE
+        self.canvas_width = 0  # 0 draws on a canvas the size of the window
+        self.canvas_height = 0
+        self.timelapse_frames = TIMELAPSE_FRAMES
+        self.timelapse_max_size_kb = 0  # 0 for no limit
+
+        try:
+            config = self.config_store.load()
+        except (ValueError, OSError):
+            from tkinter import messagebox
+
+            # config file exists but is invalid
+            messagebox.showerror(
+                "invalid config file",
+                f"the configuration file at '{self.config_file}' is invalid or corrupt.\n\n"
+                "please fix or delete the file so that it can be recreated on the next startup of the application.\n"
+                "we recommend taking a backup of the file before deleting.\n\n"
+                "for this session, default settings have been loaded.\n"
+                "opening the settings menu and clicking 'apply' will also overwrite the config file with the current (default) settings."
+            )
+            # load default settings (already set)
+            return
 
-        if not os.path.exists(self.config_file) or os.stat(self.config_file).st_size == 0:
+        if config is None:
             # config file is missing or empty, create one with default settings
             self.save_config()
         else:
-            try:
-                with open(self.config_file, "r") as file:
-                    config = json.load(file)
-                    self.window_width = config.get("window_width", self.window_width)
-                    self.window_height = config.get("window_height", self.window_height)
-                    self.pen_width = config.get("pen_width", self.pen_width)
-                    self.smoothing_factor = config.get("smoothing_factor", self.smoothing_factor)
-                    self.pen_color = config.get("pen_color", self.pen_color)
-                    self.auto_copy_on_close = config.get("auto_copy_on_close", self.auto_copy_on_close)
-                    self.hotkey = config.get("hotkey", self.hotkey)
-                    self.last_save_dir = config.get("last_save_dir", self.last_save_dir)
-                    self.render_canvas_brushstroke = config.get("render_canvas_brushstroke", True)
-            except (json.JSONDecodeError, FileNotFoundError):
-                # config file exists but is invalid
-                messagebox.showerror(
-                    "invalid config file",
-                    f"the configuration file at '{self.config_file}' is invalid or corrupt.\n\n"
-                    "please fix or delete the file so that it can be recreated on the next startup of the application.\n"
-                    "we recommend taking a backup of the file before deleting.\n\n"
-                    "for this session, default settings have been loaded.\n"
-                    "opening the settings menu and clicking 'apply' will also overwrite the config file with the current (default) settings."
-                )
-                # load default settings (already set)
-
-    # save configuration settings
+            self.apply_config(config)
+
+    # set the settings found in a loaded config, missing ones keep their current value
+    def apply_config(self, config):
+        self.window_width = config.get("window_width", self.window_width)
+        self.window_height = config.get("window_height", self.window_height)
+        self.pen_width = config.get("pen_width", self.pen_width)
+        self.smoothing_factor = config.get("smoothing_factor", self.smoothing_factor)
+        self.pen_color = config.get("pen_color", self.pen_color)
+        self.auto_copy_on_close = config.get("auto_copy_on_close", self.auto_copy_on_close)
+        self.hotkey = config.get("hotkey", self.hotkey)
+        self.last_save_dir = config.get("last_save_dir", self.last_save_dir)
+        self.render_canvas_brushstroke = config.get("render_canvas_brushstroke", self.render_canvas_brushstroke)
+        self.render_fps = config.get("render_fps", self.render_fps)
+        self.max_motion_batch = config.get("max_motion_batch", self.max_motion_batch)
+        self.brush = config.get("brush", self.brush)
+        self.raster_mode = config.get("raster_mode", self.raster_mode)
+        self.history_budget_mb = config.get("history_budget_mb", self.history_budget_mb)
+        self.keep_last_drawing = config.get("keep_last_drawing", self.keep_last_drawing)
+        self.fill_tolerance = config.get("fill_tolerance", self.fill_tolerance)
+        self.canvas_width = config.get("canvas_width", self.canvas_width)
+        self.canvas_height = config.get("canvas_height", self.canvas_height)
+        self.timelapse_frames = config.get("timelapse_frames", self.timelapse_frames)
+        self.timelapse_max_size_kb = config.get("timelapse_max_size_kb", self.timelapse_max_size_kb)
+
+    # pick up changes made to config.json outside the app, costs one stat when there are none
+    def reload_config(self):
+        config = self.config_store.reload_if_changed()
+        if config is None:
+            return
+        hotkey = self.hotkey
+        self.apply_config(config)
+        if self.hotkey != hotkey:
+            self.apply_hotkey()
+            self.update_tray_icon()
+        print("config.json changed, settings reloaded")
+
+    # save configuration settings, the file is written shortly after on a background thread
     def save_config(self):
         config = {
             "window_width": self.window_width,
@@ -137,32 +367,72 @@ class OpicoDrawApp:
             "auto_copy_on_close": self.auto_copy_on_close,
             "hotkey": self.hotkey,
             "last_save_dir": self.last_save_dir,
-            "render_canvas_brushstroke": self.render_canvas_brushstroke
+            "render_canvas_brushstroke": self.render_canvas_brushstroke,
+            "render_fps": self.render_fps,
+            "max_motion_batch": self.max_motion_batch,
+            "brush": self.brush,
+            "raster_mode": self.raster_mode,
+            "history_budget_mb": self.history_budget_mb,
+            "keep_last_drawing": self.keep_last_drawing,
+            "fill_tolerance": self.fill_tolerance,
+            "canvas_width": self.canvas_width,
+            "canvas_height": self.canvas_height,
+            "timelapse_frames": self.timelapse_frames,
+            "timelapse_max_size_kb": self.timelapse_max_size_kb
         }
-        with open(self.config_file, "w") as file:
-            json.dump(config, file)
+        self.config_store.save(config)
 
     # create the tray icon
     def create_tray_icon(self):
+        import pystray
+        from pystray import MenuItem as item
+
         tray_icon_image = self.load_tray_icon("opicodraw.ico")
 
         self.icon = pystray.Icon("OpicoDraw", tray_icon_image, title="opico draw", menu=pystray.Menu(
-            item("open opico draw", self.on_systray_open_drawing),
+            item(self.tray_drawing_label, self.on_systray_open_drawing),
             item("settings", self.on_systray_open_settings),
+            item(self.tray_profiling_label, self.on_systray_toggle_profiling),
             item("exit", self.on_systray_exit)
         ))
 
         # start the icon without blocking
         threading.Thread(target=self.icon.run, daemon=True).start()
 
-        # start the periodic tray icon updater after ensuring the icon is initialized
-        self.root.after(100, self.update_tray_icon)
+    # label of the tray item that opens or closes the drawing window
+    def tray_drawing_label(self, menu_item):
+        action = "close" if self.is_window_open else "open"
+        return f"{action} opico draw ({self.hotkey})"
+
+    # label of the tray item that starts or stops profiling
+    def tray_profiling_label(self, menu_item):
+        return "stop profiling and save" if self.profile_session.running else "start profiling"
 
-    # update the tray icon periodically
+    # refresh the tray menu, call this when something it shows has changed
     def update_tray_icon(self):
         if self.icon is not None:
             self.icon.update_menu()
-        self.tray_icon_updater_id = self.root.after(100, self.update_tray_icon)
+
+    # wrap tkinter timers so every callback they run is counted, and report the count once a minute
+    def start_wakeup_stats(self):
+        original_after = tk.Misc.after
+
+        def counted_after(widget, ms, func=None, *args):
+            if func is None:
+                return original_after(widget, ms)
+
+            def wakeup(*call_args):
+                self.wakeups += 1
+                return func(*call_args)
+            return original_after(widget, ms, wakeup, *args)
+
+        def report():
+            print(f"timer wakeups in the last minute: {self.wakeups}")
+            self.wakeups = 0
+            original_after(self.root, 60000, report)
+
+        tk.Misc.after = counted_after
+        original_after(self.root, 60000, report)
 
     # open the drawing window from the system tray
     def on_systray_open_drawing(self):
@@ -172,6 +442,25 @@ class OpicoDrawApp:
     def on_systray_open_settings(self):
         self.root.after(0, self.show_settings)
 
+    # start or stop profiling from the system tray
+    def on_systray_toggle_profiling(self):
+        self.root.after(0, self.toggle_profiling)
+
+    # start a cprofile session, or stop the running one and save it with the handler timings
+    def toggle_profiling(self):
+        if not self.profile_session.running:
+            handler_stats.reset()
+            self.profile_session.start()
+            print("profiling started")
+        else:
+            path = self.profile_session.stop(extra={
+                "handlers": handler_stats.summary(),
+                "latency": self.tracer.summary(),
+                "memory": self.memory_stats() if self.engine is not None else None,
+            })
+            print(f"profile saved to {path}")
+        self.update_tray_icon()
+
     # exit the application from the system tray
     def on_systray_exit(self):
         self.root.after(0, self.exit_app)
@@ -186,149 +475,430 @@ class OpicoDrawApp:
                 self.hotkey_id = None
 
         # register the hotkey with keyboard module to toggle window
-        self.hotkey_id = keyboard.add_hotkey(self.hotkey, lambda: self.root.after(0, self.toggle_window))
+        self.hotkey_id = keyboard.add_hotkey(self.hotkey, self.on_hotkey)
+
+    # the hotkey was pressed, this runs on the keyboard thread
+    def on_hotkey(self):
+        if not self.is_window_open:
+            self.tracer.start("hotkey_to_visible")
+        self.root.after(0, self.toggle_window)
 
     # toggle the drawing window
     def toggle_window(self):
-        if self.drawing_window is None or not self.drawing_window.winfo_exists():
+        if not self.is_window_open:
             self.show_window()
         else:
             self.close_window()
 
-    # show the drawing window
-    def show_window(self):
-        mouse_x, mouse_y = pyautogui.position()
-        x_position = mouse_x - self.window_width // 2
-        y_position = mouse_y - self.window_height // 2
-
-        if self.drawing_window is None or not self.drawing_window.winfo_exists():
-            self.drawing_window = tk.Toplevel()
-            self.drawing_window.title("opico draw")
-            self.drawing_window.geometry(f"{self.window_width}x{self.window_height}+{x_position}+{y_position}")
-            self.drawing_window.configure(bg="white")
-            self.drawing_window.protocol("WM_DELETE_WINDOW", self.close_window)
-            self.drawing_window.resizable(False, False)
-            self.drawing_window.attributes("-topmost", True)
-            self.drawing_window.focus_force()
-
-            # delay setting the icon to prevent flashing
-            self.drawing_window.after(50, lambda: self.drawing_window.iconphoto(False, self.icon_image))
-
-            # remove maximize and minimize buttons, leaving only the close button
-            self.drawing_window.after(500, lambda: remove_maximize_minimize(self.drawing_window))
-
-            self.canvas = tk.Canvas(
-                self.drawing_window,
-                width=self.window_width,
-                height=self.window_height,
-                bg="white",
-                cursor="cross"
-            )
-            self.canvas.pack()
-
-            self.create_image()
-
-            self.last_x, self.last_y = None, None
-            self.points = []
-            self.is_drawing = False
-
-            self.canvas.bind("<ButtonPress-1>", self.on_button_press)
-            self.canvas.bind("<B1-Motion>", self.on_mouse_drag)
-            self.canvas.bind("<ButtonRelease-1>", self.on_button_release)  # corrected binding
+    # build the drawing window hidden so showing it later only has to move and map it
+    def build_drawing_window(self):
+        self.drawing_window = tk.Toplevel()
+        self.drawing_window.withdraw()
+        self.eraser = False
+        self.drawing_window.title("opico draw")
+        self.drawing_window.geometry(f"{self.window_width}x{self.window_height}")
+        self.drawing_window.configure(bg="white")
+        self.drawing_window.protocol("WM_DELETE_WINDOW", self.close_window)
+        self.drawing_window.resizable(False, False)
+        self.drawing_window.iconphoto(False, self.icon_image)
+        self.window_styled = False
+
+        self.canvas = tk.Canvas(
+            self.drawing_window,
+            width=self.window_width,
+            height=self.window_height,
+            bg=OUTSIDE_COLOR,
+            cursor="cross"
+        )
+        self.canvas.pack()
 
-            # key bindings
-            self.drawing_window.bind("<Control-c>", self.save_as_png)
-            self.drawing_window.bind("<Control-C>", self.save_as_png)  # uppercase binding
+        self.photo_image = None
+        self.create_image()
+        self.update_canvas()
 
-            self.drawing_window.bind("<Control-s>", self.save_as_file)
-            self.drawing_window.bind("<Control-S>", self.save_as_file)  # uppercase binding
+        self.last_x, self.last_y = None, None
+        self.preview_item = None
+        self.pending_motion = []
+        self.motion_after_id = None
+        self.is_drawing = False
 
-            self.drawing_window.bind("<Control-Alt-s>", self.save_as_file)
-            self.drawing_window.bind("<Control-Alt-S>", self.save_as_file)  # uppercase binding
+        self.canvas.bind("<ButtonPress-1>", self.on_button_press)
+        self.canvas.bind("<Shift-ButtonPress-1>", self.on_fill_click)
+        self.canvas.bind("<B1-Motion>", self.on_mouse_drag)
+        self.canvas.bind("<ButtonRelease-1>", self.on_button_release)  # corrected binding
+        self.canvas.bind("<Expose>", self.on_canvas_expose)
+
+        # the middle mouse button drags the view, the wheel scrolls it and zooms with control
+        self.canvas.bind("<ButtonPress-2>", self.on_pan_press)
+        self.canvas.bind("<B2-Motion>", self.on_pan_drag)
+        self.canvas.bind("<ButtonRelease-2>", self.on_pan_release)
+        self.canvas.bind("<MouseWheel>", lambda event: self.scroll_view(0, event.delta))
+        self.canvas.bind("<Shift-MouseWheel>", lambda event: self.scroll_view(event.delta, 0))
+        self.canvas.bind("<Control-MouseWheel>", lambda event: self.zoom_at(1 if event.delta > 0 else -1, event.x, event.y))
+
+        # key bindings
+        self.drawing_window.bind("<Control-c>", self.save_as_png)
+        self.drawing_window.bind("<Control-C>", self.save_as_png)  # uppercase binding
+
+        self.drawing_window.bind("<Control-s>", self.save_as_file)
+        self.drawing_window.bind("<Control-S>", self.save_as_file)  # uppercase binding
+
+        self.drawing_window.bind("<Control-Alt-s>", self.save_as_file)
+        self.drawing_window.bind("<Control-Alt-S>", self.save_as_file)  # uppercase binding
+
+        self.drawing_window.bind("<Control-Shift-Key-S>", self.save_as_file)
+
+        # save a timelapse of the drawing
+        self.drawing_window.bind("<Control-t>", self.save_timelapse)
+        self.drawing_window.bind("<Control-T>", self.save_timelapse)  # for caps lock
+
+        self.drawing_window.bind("<Control-n>", self.clear_canvas)      # added binding
+        self.drawing_window.bind("<Control-N>", self.clear_canvas)      # added binding
+
+        # open a picture or paste a screenshot to draw on
+        self.drawing_window.bind("<Control-o>", self.open_background)
+        self.drawing_window.bind("<Control-O>", self.open_background)  # for caps lock
+        self.drawing_window.bind("<Control-v>", self.paste_background)
+        self.drawing_window.bind("<Control-V>", self.paste_background)  # for caps lock
+
+        self.drawing_window.bind("<Button-3>", self.toggle_mini_settings)
+
+        # key bindings for undo and redo
+        self.drawing_window.bind("<Control-z>", self.undo)
+        self.drawing_window.bind("<Control-Z>", self.undo)  # for caps lock
+        self.drawing_window.bind("<Control-y>", self.redo)
+        self.drawing_window.bind("<Control-Y>", self.redo)  # for caps lock
+        self.drawing_window.bind("<Control-Shift-Key-Z>", self.redo)
+        self.drawing_window.bind("<Control-Shift-Key-z>", self.redo)  # for caps lock
+
+        # key bindings for layers and the eraser
+        self.drawing_window.bind("<Control-l>", self.add_layer)
+        self.drawing_window.bind("<Control-L>", self.add_layer)  # for caps lock
+        self.drawing_window.bind("<Prior>", lambda event: self.select_layer(1))
+        self.drawing_window.bind("<Next>", lambda event: self.select_layer(-1))
+        self.drawing_window.bind("<e>", self.toggle_eraser)
+        self.drawing_window.bind("<E>", self.toggle_eraser)  # for caps lock
+
+        # key bindings for zooming around the middle of the window
+        self.drawing_window.bind("<Control-plus>", lambda event: self.zoom_at(1))
+        self.drawing_window.bind("<Control-equal>", lambda event: self.zoom_at(1))
+        self.drawing_window.bind("<Control-minus>", lambda event: self.zoom_at(-1))
+        self.drawing_window.bind("<Control-Key-0>", self.reset_view)
 
-            self.drawing_window.bind("<Control-Shift-Key-S>", self.save_as_file)
+    # show the drawing window
+    def show_window(self):
+        if self.is_window_open:
+            # instead of moving the window, close it
+            self.close_window()
+            return
+        self.tracer.start("hotkey_to_visible", restart=False)
+        self.reload_config()
 
-            self.drawing_window.bind("<Control-n>", self.clear_canvas)      # added binding
-            self.drawing_window.bind("<Control-N>", self.clear_canvas)      # added binding
+        if self.drawing_window is None or not self.drawing_window.winfo_exists():
+            self.build_drawing_window()
 
-            self.drawing_window.bind("<Button-3>", self.toggle_mini_settings)
+        # the drawing was released when the window closed, or the canvas size changed in the settings while it was hidden
+        if self.engine is None or (self.engine.width, self.engine.height) != self.canvas_size():
+            self.canvas.config(width=self.window_width, height=self.window_height)
+            self.create_image()
+            self.update_canvas()
 
-            # key bindings for undo and redo
-            self.drawing_window.bind("<Control-z>", self.undo)
-            self.drawing_window.bind("<Control-Z>", self.undo)  # for caps lock
-            self.drawing_window.bind("<Control-y>", self.redo)
-            self.drawing_window.bind("<Control-Y>", self.redo)  # for caps lock
-            self.drawing_window.bind("<Control-Shift-Key-Z>", self.redo)
-            self.drawing_window.bind("<Control-Shift-Key-z>", self.redo)  # for caps lock
+        # tk knows where the mouse is, so the first hotkey press does not wait for pyautogui to load
+        mouse_x, mouse_y = self.root.winfo_pointerxy()
+        x_position = mouse_x - self.window_width // 2
+        y_position = mouse_y - self.window_height // 2
+        self.drawing_window.geometry(f"{self.window_width}x{self.window_height}+{x_position}+{y_position}")
+        self.drawing_window.deiconify()
+        self.drawing_window.attributes("-topmost", True)
+        self.drawing_window.focus_force()
+        self.is_window_open = True
+        self.update_tray_icon()
+
+        # remove maximize and minimize buttons, leaving only the close button
+        if not self.window_styled:
+            self.window_styled = True
+            self.drawing_window.after(500, lambda: remove_maximize_minimize(self.drawing_window))
 
-            self.is_window_open = True
-        else:
-            # instead of moving the window, close it
-            self.close_window()
+        # the autosave of a session that crashed is only looked at the first time the window opens
+        if not self.recovery_checked:
+            self.recovery_checked = True
+            self.offer_recovery()
+
+    # offer to bring back the drawing of a session that did not close cleanly, then start autosaving
+    def offer_recovery(self):
+        journal = StrokeLog.recover(self.autosave.path)
+        if journal is not None:
+            from tkinter import messagebox
+
+            if messagebox.askyesno(
+                "recover drawing",
+                "opico draw did not close properly last time.\n\nrecover the drawing you were working on?",
+                parent=self.drawing_window
+            ):
+                self.engine.load_journal(journal.to_bytes())
+                self.mark_dirty((0, 0) + self.canvas_size())
+                self.update_canvas()
+            else:
+                journal = None
+        self.autosave.start(self.engine.journal if journal is not None else None)
+
+    # write the queued autosave records within AUTOSAVE_FLUSH_MS, no timer runs while there is nothing to write
+    def schedule_autosave(self):
+        if self.autosave.has_pending and self.autosave_after_id is None:
+            self.autosave_after_id = self.root.after(AUTOSAVE_FLUSH_MS, self.flush_autosave)
+
+    # hand the queued autosave records to the writer thread
+    def flush_autosave(self):
+        self.autosave_after_id = None
+        self.autosave.flush()
+
+    # the canvas got mapped, log how long showing took once it has been drawn
+    def on_canvas_expose(self, event=None):
+        if self.tracer.is_running("hotkey_to_visible"):
+            self.canvas.after_idle(self.report_show_time)
+
+    # log the time from the hotkey to the first paint of the drawing window
+    def report_show_time(self):
+        duration = self.tracer.finish("hotkey_to_visible")
+        if duration is not None:
+            print(f"hotkey to first paint: {duration:.1f} ms")
 
     # create the drawing image
+    @handler_stats.timed
     def create_image(self):
-        self.scale_factor = 4
-        self.image = Image.new("RGBA", (self.window_width * self.scale_factor, self.window_height * self.scale_factor), (255, 255, 255, 0))
-        self.draw = ImageDraw.Draw(self.image)
+        if self.engine is None:
+            # undo history is capped by memory instead of steps, older steps are compressed and
+            # spilled to a scratch file in the config folder before they are dropped
+            self.engine = DrawingEngine(
+                *self.canvas_size(), max_history=None, brush=self.brush, raster_mode=self.raster_mode,
+                history_budget=self.history_budget_mb * 1024 * 1024, spill_dir=self.config_path
+            )
+            # bring back the drawing kept when the window was last closed
+            if self.hibernated_drawing is not None and not self.engine.resume(self.hibernated_drawing):
+                width, height = self.hibernated_drawing[:2]
+                print(
+                    f"the last drawing was {width}x{height}, the canvas is now {self.engine.width}x{self.engine.height}, "
+                    "its strokes were drawn again and the background fitted in"
+                )
+            self.hibernated_drawing = None
+        else:
+            # this also clears the stroke journal and its undo history
+            self.engine.resize(*self.canvas_size())
+            self.autosave.record_clear()
 
-        # clear the undo and redo stacks
-        self.undo_stack.clear()
-        self.redo_stack.clear()
+        # start at 100 % and draw the whole window again, the view pyramid is empty or just restored
+        self.zoom_step, self.zoom, self.scroll_x, self.scroll_y = self.view_for(0, 0, 0)
+        self.dirty_rect = None
+        self.view_changed = True
+        self.update_title()
 
         # update the canvas to reflect the new image
         if self.is_window_open:
             self.update_canvas()
 
-    # update the canvas with the current image
-    def update_canvas(self):
-        # resize the image to match the canvas size
-        resized_image = self.image.resize((self.window_width, self.window_height), Image.LANCZOS)
-        # convert to PhotoImage for tkinter
-        self.photo_image = ImageTk.PhotoImage(resized_image)
-        # clear the canvas and display the updated image
-        self.canvas.delete("all")
-        self.canvas.create_image(0, 0, image=self.photo_image, anchor=tk.NW)
+    # show the active layer and the eraser in the window title
+    def update_title(self):
+        title = "opico draw"
+        if len(self.engine.layers) > 1:
+            title += f" - layer {self.engine.layers.active + 1}/{len(self.engine.layers)}"
+        if self.eraser:
+            title += " - eraser"
+        self.drawing_window.title(title)
+
+    # add an empty layer on top of the others and draw on it
+    def add_layer(self, event=None):
+        if not self.engine.in_stroke:
+            self.engine.add_layer()
+            self.update_title()
+
+    # draw on the layer above or below the active one
+    def select_layer(self, step):
+        if not self.engine.in_stroke:
+            self.engine.select_layer(self.engine.layers.active + step)
+            self.update_title()
+
+    # switch between drawing and erasing, the eraser clears the active layer back to transparent
+    def toggle_eraser(self, event=None):
+        self.eraser = not self.eraser
+        self.update_title()
+
+    # the size of the drawing in canvas pixels, the window size unless canvas_width and canvas_height are set
+    def canvas_size(self):
+        return self.canvas_width or self.window_width, self.canvas_height or self.window_height
+
+    # the point under a mouse event in canvas pixels
+    def canvas_point(self, event):
+        return (event.x + self.scroll_x) / self.zoom, (event.y + self.scroll_y) / self.zoom
+
+    # a point in canvas pixels in window pixels
+    def window_point(self, x, y):
+        return x * self.zoom - self.scroll_x, y * self.zoom - self.scroll_y
+
+    # the zoom step, zoom and scroll a view would end up with, a canvas that fits the window on
+    # an axis is centered on it, a bigger one can not be scrolled past its edges
+    def view_for(self, zoom_step, scroll_x, scroll_y):
+        zoom_step = max(MIN_ZOOM_STEP, min(MAX_ZOOM_STEP, zoom_step))
+        zoom = 2 ** (zoom_step / ZOOM_STEPS_PER_DOUBLING)
+        scroll = []
+        windows = (self.window_width, self.window_height)
+        for offset, canvas_size, window_size in zip((scroll_x, scroll_y), self.canvas_size(), windows):
+            size = round(canvas_size * zoom)
+            if size <= window_size:
+                scroll.append(-((window_size - size) // 2))
+            else:
+                scroll.append(max(0, min(size - window_size, offset)))
+        return zoom_step, zoom, scroll[0], scroll[1]
 
-    # save the current state for undo functionality
-    def save_undo_state(self):
-        # remove oldest history if we exceed max history size
-        if len(self.undo_stack) >= self.max_history:
-            self.undo_stack.pop(0)
+    # zoom and scroll the view, the window is redrawn on the next frame so a burst of wheel
+    # or drag events costs one redraw. the view stays put while a stroke is drawn
+    def set_view(self, zoom_step, scroll_x, scroll_y):
+        if self.engine is None or self.engine.in_stroke:
+            return
+        view = self.view_for(zoom_step, scroll_x, scroll_y)
+        if view == (self.zoom_step, self.zoom, self.scroll_x, self.scroll_y):
+            return
+        self.zoom_step, self.zoom, self.scroll_x, self.scroll_y = view
+        self.view_changed = True
+        if self.view_after_id is None:
+            self.view_after_id = self.root.after(self.frame_interval_ms(), self.refresh_view)
+
+    # redraw the window for the new view, a draft until the view stops moving
+    # the filtered frame waits for a stroke started meanwhile, redrawing would drop its preview
+    @handler_stats.timed
+    def refresh_view(self, draft=True):
+        self.view_after_id = None
+        if self.settle_after_id is not None:
+            self.root.after_cancel(self.settle_after_id)
+            self.settle_after_id = None
+        if not draft and self.engine.in_stroke:
+            self.settle_after_id = self.root.after(VIEW_SETTLE_MS, self.refresh_view, False)
+            return
+        self.view_changed = True
+        self.update_canvas(draft)
+        if draft:
+            self.settle_after_id = self.root.after(VIEW_SETTLE_MS, self.refresh_view, False)
+
+    # zoom in (step > 0) or out keeping the canvas point under (x, y) in window pixels in place,
+    # the middle of the window by default
+    def zoom_at(self, step, x=None, y=None):
+        x = self.window_width / 2 if x is None else x
+        y = self.window_height / 2 if y is None else y
+        zoom_step = max(MIN_ZOOM_STEP, min(MAX_ZOOM_STEP, self.zoom_step + step))
+        factor = 2 ** ((zoom_step - self.zoom_step) / ZOOM_STEPS_PER_DOUBLING)
+        self.set_view(zoom_step, round((self.scroll_x + x) * factor - x), round((self.scroll_y + y) * factor - y))
+
+    # scroll the view by mouse wheel deltas, one notch is 120
+    def scroll_view(self, delta_x, delta_y):
+        dx, dy = round(delta_x * SCROLL_STEP / 120), round(delta_y * SCROLL_STEP / 120)
+        self.set_view(self.zoom_step, self.scroll_x - dx, self.scroll_y - dy)
+
+    # show the canvas at its size again
+    def reset_view(self, event=None):
+        self.set_view(0, 0, 0)
+
+    # start dragging the view with the middle mouse button
+    def on_pan_press(self, event):
+        self.pan_anchor = (event.x, event.y)
+
+    # move the view with the mouse while the middle button is held
+    @handler_stats.timed
+    def on_pan_drag(self, event):
+        if self.pan_anchor is None:
+            return
+        dx, dy = event.x - self.pan_anchor[0], event.y - self.pan_anchor[1]
+        self.pan_anchor = (event.x, event.y)
+        self.set_view(self.zoom_step, self.scroll_x - dx, self.scroll_y - dy)
+
+    # stop dragging the view
+    def on_pan_release(self, event):
+        self.pan_anchor = None
+
+    # remember that an area of the canvas (in canvas pixels) needs to be redrawn
+    def mark_dirty(self, bbox):
+        if self.dirty_rect is None:
+            self.dirty_rect = tuple(bbox)
+        else:
+            self.dirty_rect = (
+                min(self.dirty_rect[0], bbox[0]), min(self.dirty_rect[1], bbox[1]),
+                max(self.dirty_rect[2], bbox[2]), max(self.dirty_rect[3], bbox[3])
+            )
 
-        # save a copy of the current image
-        self.undo_stack.append(self.image.copy())
+    # update the canvas with the parts of the image that changed
+    # draft is passed on to render_view when the whole window is redrawn
+    @handler_stats.timed
+    def update_canvas(self, draft=False):
+        size = (self.window_width, self.window_height)
+
+        # create the long-lived photo image the first time or when the window size changed
+        if self.photo_image is None or (self.photo_image.width(), self.photo_image.height()) != size:
+            self.photo_image = ImageTk.PhotoImage("RGBA", size)
+            self.canvas.delete("all")
+            # the white page under the drawing, the photo image only holds the ink
+            self.canvas.create_rectangle(0, 0, 0, 0, fill="white", width=0, tags="page")
+            self.canvas.create_image(0, 0, anchor=tk.NW, tags="background")
+            self.canvas.create_image(0, 0, image=self.photo_image, anchor=tk.NW, tags="backing")
+            self.view_changed = True
+
+        # the live stroke preview is part of the image now
+        self.canvas.delete("preview")
+
+        if self.view_changed:
+            self.view_changed = False
+            x0, y0, (x1, y1) = 0, 0, size
+            width, height = self.canvas_size()
+            self.canvas.coords(
+                "page", -self.scroll_x, -self.scroll_y,
+                round(width * self.zoom) - self.scroll_x, round(height * self.zoom) - self.scroll_y
+            )
+            # the background image only changes with the view, strokes never redraw it
+            background = self.engine.render_background((0, 0) + size, self.scroll_x, self.scroll_y, self.zoom, draft)
+            self.background_photo = ImageTk.PhotoImage(background) if background is not None else None
+            self.canvas.itemconfigure("background", image=self.background_photo or "")
+        elif self.dirty_rect is None:
+            return
+        else:
+            draft = False
+            # the area in window pixels, grown by the reach of the lanczos filter and clipped to the window
+            margin = 3
+            x0 = max(0, math.floor((self.dirty_rect[0] - margin) * self.zoom) - self.scroll_x)
+            y0 = max(0, math.floor((self.dirty_rect[1] - margin) * self.zoom) - self.scroll_y)
+            x1 = min(size[0], math.ceil((self.dirty_rect[2] + margin + 1) * self.zoom) - self.scroll_x)
+            y1 = min(size[1], math.ceil((self.dirty_rect[3] + margin + 1) * self.zoom) - self.scroll_y)
+        self.dirty_rect = None
+        if x0 >= x1 or y0 >= y1:
+            return
 
-        # clear the redo stack since we're starting a new action
-        self.redo_stack.clear()
+        # resample only the changed area from the view pyramid and copy it into the photo image in place
+        region = self.engine.render_view((x0, y0, x1, y1), self.scroll_x, self.scroll_y, self.zoom, draft)
+        patch = ImageTk.PhotoImage(region)
+        self.canvas.tk.call(str(self.photo_image), "copy", str(patch), "-to", x0, y0, "-compositingrule", "set")
 
     # undo the last action
+    @handler_stats.timed
     def undo(self, event=None):
-        if self.undo_stack:
-            # push the current state onto the redo stack
-            self.redo_stack.append(self.image.copy())
-
-            # pop the last state from the undo stack and restore it
-            self.image = self.undo_stack.pop()
-            self.draw = ImageDraw.Draw(self.image)
+        bbox = self.engine.undo()
+        if bbox is not None:
+            self.autosave.record_undo(self.engine.journal)
+            self.schedule_autosave()
 
-            # update the canvas
+            # update the canvas where the undone strokes were
+            self.mark_dirty(bbox)
             self.update_canvas()
 
     # redo the last undone action
+    @handler_stats.timed
     def redo(self, event=None):
-        if self.redo_stack:
-            # push the current state onto the undo stack
-            self.undo_stack.append(self.image.copy())
-
-            # pop the last state from the redo stack and restore it
-            self.image = self.redo_stack.pop()
-            self.draw = ImageDraw.Draw(self.image)
+        bbox = self.engine.redo()
+        if bbox is not None:
+            self.autosave.record_redo(self.engine.journal)
+            self.schedule_autosave()
 
-            # update the canvas
+            # update the canvas where the redone stroke is
+            self.mark_dirty(bbox)
             self.update_canvas()
 
     # handle mouse button press event
+    @handler_stats.timed
     def on_button_press(self, event):
         if self.mini_settings_window is not None:
             self.mini_settings_window.destroy()
@@ -338,119 +908,147 @@ class OpicoDrawApp:
             # Set focus back to the drawing window
             self.drawing_window.focus_force()
 
-        # save the current state for undo
-        self.save_undo_state()
+        # start the stroke in the engine
+        self.tracer.start("press_to_ink")
+        self.stroke_width, self.stroke_color = self.pen_width, self.pen_color
+        self.engine.begin_stroke(
+            *self.canvas_point(event), self.stroke_width, self.stroke_color, self.smoothing_factor, erase=self.eraser
+        )
+        if self.eraser:
+            # the preview can not show what is under the erased ink, white is close enough
+            self.stroke_color = "#ffffff"
+        self.preview_item = None
+        self.preview_coords = []
 
         self.last_x, self.last_y = event.x, event.y
-        self.points = [(self.last_x, self.last_y)]
         self.is_drawing = False
 
 
-    # handle mouse drag event
+    # fill the area under the cursor with the pen color on shift + click
+    @handler_stats.timed
+    def on_fill_click(self, event):
+        if self.engine.in_stroke:
+            return
+        bbox = self.engine.fill(*self.canvas_point(event), self.pen_color, self.fill_tolerance)
+        if bbox is not None:
+            self.autosave.record_stroke(self.engine.journal)
+            self.schedule_autosave()
+            self.mark_dirty(bbox)
+            self.update_canvas()
+
+    # handle mouse drag event, samples are queued and drawn once per frame
+    @handler_stats.timed
     def on_mouse_drag(self, event):
+        if not self.engine.in_stroke:
+            return
         self.is_drawing = True
-        x, y = event.x, event.y
-        self.points.append((x, y))
-
-        if len(self.points) >= self.smoothing_factor:
-            avg_x = sum(p[0] for p in self.points) / len(self.points)
-            avg_y = sum(p[1] for p in self.points) / len(self.points)
+        self.pending_motion.append(self.canvas_point(event))
+        if self.motion_after_id is None:
+            self.motion_after_id = self.root.after(self.frame_interval_ms(), self.flush_motion)
+
+    # get the time between two batches of motion samples
+    def frame_interval_ms(self):
+        return max(1, round(1000 / max(1, self.render_fps)))
+
+    # draw the queued motion samples as a single polyline
+    @handler_stats.timed
+    def flush_motion(self, drain=False):
+        # a direct call replaces the scheduled tick
+        if self.motion_after_id is not None:
+            self.root.after_cancel(self.motion_after_id)
+            self.motion_after_id = None
+        if not self.engine.in_stroke:
+            self.pending_motion.clear()
+            return
 
-            self.canvas.create_line(
-                self.last_x, self.last_y, avg_x, avg_y,
-                fill=self.pen_color, width=self.pen_width, capstyle=tk.ROUND, smooth=True
+        while self.pending_motion:
+            batch = self.pending_motion[:max(1, self.max_motion_batch)]
+            del self.pending_motion[:len(batch)]
+            self.extend_preview(self.engine.add_points(batch))
+            self.tracer.finish("press_to_ink")
+
+            if not drain:
+                break
+
+        # leave the rest of a large backlog for the next frame
+        if self.pending_motion:
+            self.motion_after_id = self.root.after(self.frame_interval_ms(), self.flush_motion)
+
+    # extend the live preview line of the stroke in progress, the polyline is in canvas pixels
+    def extend_preview(self, polyline):
+        if self.preview_item is None or len(self.preview_coords) >= PREVIEW_CHUNK_POINTS * 2:
+            # start a new line where the previous one ended
+            self.preview_coords = [c for point in polyline for c in self.window_point(*point)]
+            self.preview_item = self.canvas.create_line(
+                *self.preview_coords,
+                fill=self.stroke_color, width=self.stroke_width * self.zoom, capstyle=tk.ROUND, joinstyle=tk.ROUND,
+                tags="preview"
             )
-
-            x1 = int(self.last_x * self.scale_factor)
-            y1 = int(self.last_y * self.scale_factor)
-            x2 = int(avg_x * self.scale_factor)
-            y2 = int(avg_y * self.scale_factor)
-            width = int(self.pen_width * self.scale_factor)
-            line_coords = (x1, y1, x2, y2)
-            self.draw_line_with_round_ends(line_coords, fill=self.pen_color, width=width)
-
-            self.last_x, self.last_y = avg_x, avg_y
-            self.points.pop(0)
         else:
-            self.canvas.create_line(
-                self.last_x, self.last_y, x, y,
-                fill=self.pen_color, width=self.pen_width, capstyle=tk.ROUND, smooth=True
-            )
-
-            x1 = int(self.last_x * self.scale_factor)
-            y1 = int(self.last_y * self.scale_factor)
-            x2 = int(x * self.scale_factor)
-            y2 = int(y * self.scale_factor)
-            width = int(self.pen_width * self.scale_factor)
-            line_coords = (x1, y1, x2, y2)
-            self.draw_line_with_round_ends(line_coords, fill=self.pen_color, width=width)
-
-            self.last_x, self.last_y = x, y
+            self.preview_coords.extend(c for point in polyline[1:] for c in self.window_point(*point))
+            self.canvas.coords(self.preview_item, *self.preview_coords)
 
     # handle mouse button release event
+    @handler_stats.timed
     def on_button_release(self, event):
+        self.tracer.start("release_to_refresh")
+
+        # draw whatever motion is still queued before finishing the stroke
+        self.flush_motion(drain=True)
+
         if not self.is_drawing:
             if self.last_x is None or self.last_y is None:
                 return  # nothing to do if last_x or last_y is none
-            x, y = self.last_x, self.last_y
+            x, y, radius = self.last_x, self.last_y, self.stroke_width * self.zoom / 2
             self.canvas.create_oval(
-                x - self.pen_width / 2, y - self.pen_width / 2,
-                x + self.pen_width / 2, y + self.pen_width / 2,
-                fill=self.pen_color, outline=self.pen_color
+                x - radius, y - radius,
+                x + radius, y + radius,
+                fill=self.stroke_color, outline=self.stroke_color, tags="preview"
             )
+            self.tracer.finish("press_to_ink")
 
-            x1 = int(x * self.scale_factor)
-            y1 = int(y * self.scale_factor)
-            width = int(self.pen_width * self.scale_factor)
-            radius = width / 2
-            bbox = (x1 - radius, y1 - radius, x1 + radius, y1 + radius)
-            self.draw.ellipse(bbox, fill=self.pen_color)
+        # finish the stroke, a stroke that never moved is drawn as a dot
+        bbox = self.engine.end_stroke()
+        if bbox is not None:
+            self.mark_dirty(bbox)
+            self.autosave.record_stroke(self.engine.journal)
+            self.schedule_autosave()
 
         self.last_x, self.last_y = None, None
-        self.points = []
+        self.preview_item = None
         self.is_drawing = False
 
         # conditionally update the canvas
         if self.render_canvas_brushstroke:
             self.update_canvas()
-
-    # draw a line with round ends on the image
-    def draw_line_with_round_ends(self, coords, fill, width):
-        x1, y1, x2, y2 = coords
-        self.draw.line(coords, fill=fill, width=width)
-        radius = width / 2
-        bbox1 = (x1 - radius, y1 - radius, x1 + radius, y1 + radius)
-        bbox2 = (x2 - radius, y2 - radius, x2 + radius, y2 + radius)
-        self.draw.ellipse(bbox1, fill=fill)
-        self.draw.ellipse(bbox2, fill=fill)
+            self.tracer.finish("release_to_refresh")
+        else:
+            self.tracer.cancel("release_to_refresh")
 
     # save the drawing as a png to the clipboard
+    # flattening and encoding happen on the export thread, only the clipboard is set on this one
+    @handler_stats.timed
     def save_as_png(self, event=None):
-        resized_image = self.image.resize((self.window_width, self.window_height), Image.LANCZOS)
-
-        background = Image.new('RGB', resized_image.size, (255, 255, 255))
-
-        if resized_image.mode == 'RGBA':
-            background.paste(resized_image, mask=resized_image.split()[3])
-        else:
-            background.paste(resized_image)
-
-        image_to_save = background
+        self.export_worker.submit(
+            self.engine, "BMP", lambda bmp_data: self.root.after(0, self.set_clipboard_bitmap, bmp_data)
+        )
 
-        output = BytesIO()
-        image_to_save.save(output, format="BMP")
-        bmp_data = output.getvalue()
-        output.close()
+    # put an encoded bmp on the clipboard
+    def set_clipboard_bitmap(self, bmp_data):
+        import win32clipboard
 
         win32clipboard.OpenClipboard()
         win32clipboard.EmptyClipboard()
         win32clipboard.SetClipboardData(win32clipboard.CF_DIB, bmp_data[14:])
         win32clipboard.CloseClipboard()
+        self.tracer.finish("close_to_clipboard")
 
     # save the drawing as a file
     def save_as_file(self, event=None):
+        from tkinter import filedialog
+
         # get the initial directory
-        default_pictures_folder = os.path.join(os.getenv('USERPROFILE'), 'Pictures')
+        default_pictures_folder = pictures_directory()
         if os.path.exists(self.last_save_dir):
             initial_dir = self.last_save_dir
         else:
@@ -469,22 +1067,93 @@ class OpicoDrawApp:
         )
 
         if file_path:
-            # save the image to the file
-            resized_image = self.image.resize((self.window_width, self.window_height), Image.LANCZOS)
+            # save the image to the file on the export thread
+            self.export_worker.submit(self.engine, "PNG", lambda png_data: self.write_file(file_path, png_data))
 
-            background = Image.new('RGB', resized_image.size, (255, 255, 255))
+            # update the last save directory
+            self.last_save_dir = os.path.dirname(file_path)
+            self.save_config()
 
-            if resized_image.mode == 'RGBA':
-                background.paste(resized_image, mask=resized_image.split()[3])
-            else:
-                background.paste(resized_image)
+    # write exported bytes to a file
+    def write_file(self, file_path, data):
+        with open(file_path, "wb") as f:
+            f.write(data)
 
-            background.save(file_path, 'PNG')
+    # save an animation of how the drawing was made, it is rendered on the export thread
+    def save_timelapse(self, event=None):
+        from tkinter import filedialog
 
-            # update the last save directory
+        file_path = filedialog.asksaveasfilename(
+            parent=self.drawing_window,
+            defaultextension='.gif',
+            filetypes=[('GIF files', '*.gif'), ('Animated PNG files', '*.png'), ('WebP files', '*.webp')],
+            initialdir=self.last_save_dir if os.path.exists(self.last_save_dir) else None,
+            title='save timelapse as'
+        )
+        if file_path:
+            future = self.export_worker.submit_timelapse(
+                file_path, self.engine, frames=self.timelapse_frames,
+                max_bytes=self.timelapse_max_size_kb * 1024 if self.timelapse_max_size_kb else None
+            )
+            future.add_done_callback(lambda done: self.root.after(0, self.timelapse_saved, done, file_path))
             self.last_save_dir = os.path.dirname(file_path)
             self.save_config()
 
+    # report a finished timelapse, or why it could not be saved
+    def timelapse_saved(self, done, file_path):
+        try:
+            frames = done.result()
+        except (OSError, ValueError) as error:
+            from tkinter import messagebox
+
+            messagebox.showerror("could not save the timelapse", str(error), parent=self.drawing_window)
+            return
+        print(f"timelapse saved to {file_path}: {frames} frames, {os.path.getsize(file_path) / 1024:.0f} kb")
+
+    # open a picture to draw on, it is shown under the drawing and copied with it
+    def open_background(self, event=None):
+        from tkinter import filedialog
+
+        file_path = filedialog.askopenfilename(
+            parent=self.drawing_window,
+            filetypes=[('Images', '*.png *.jpg *.jpeg *.bmp *.gif *.webp *.tif *.tiff'), ('All files', '*.*')],
+            initialdir=self.last_save_dir if os.path.exists(self.last_save_dir) else None,
+            title='open an image to draw on'
+        )
+        if file_path:
+            self.import_background(load_background, file_path)
+
+    # draw on the screenshot or image file on the clipboard
+    def paste_background(self, event=None):
+        self.import_background(clipboard_background)
+
+    # decode a background image at the canvas size on the import thread, a camera photo takes a
+    # moment even at a reduced size and the window keeps drawing meanwhile
+    def import_background(self, decode, *args):
+        if self.import_worker is None:
+            self.import_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="opicodraw-import")
+        size = self.canvas_size()
+        future = self.import_worker.submit(decode, *args, size)
+        future.add_done_callback(lambda done: self.root.after(0, self.show_background, done, size))
+
+    # put a decoded background image under the drawing, or say why it could not be opened
+    def show_background(self, done, size):
+        try:
+            image = done.result()
+        except (OSError, ValueError, Image.DecompressionBombError) as error:
+            from tkinter import messagebox
+
+            messagebox.showerror("could not open the image", str(error), parent=self.drawing_window)
+            return
+        # the window was closed or the canvas resized while it was decoding
+        if self.engine is None or (self.engine.width, self.engine.height) != size:
+            return
+        self.engine.set_background(image)
+        self.view_changed = True
+        # a stroke in progress redraws the window when it ends
+        if self.is_window_open and not self.engine.in_stroke:
+            self.update_canvas()
+
     # toggle the mini settings window
     def toggle_mini_settings(self, event):
         if self.mini_settings_window is not None:
@@ -575,18 +1244,123 @@ class OpicoDrawApp:
 
     # close the drawing window
     def close_window(self):
+        if self.motion_after_id is not None:
+            self.root.after_cancel(self.motion_after_id)
+            self.motion_after_id = None
+        for after_id in (self.view_after_id, self.settle_after_id):
+            if after_id is not None:
+                self.root.after_cancel(after_id)
+        self.view_after_id = self.settle_after_id = None
         if self.auto_copy_on_close:
+            self.tracer.start("close_to_clipboard")
             self.save_as_png()
+        # memory and timing stats only while profiling, the profile's json dump keeps them too
+        if self.profile_session.running:
+            if self.engine is not None:
+                print(", ".join(f"{name}: {size / (1024 * 1024):.1f} mb" for name, size in self.memory_stats().items()))
+            latency = self.tracer.summary()
+            if latency:
+                print("latency since startup:")
+                print_summary(latency)
+            print("event handlers since profiling started:")
+            handler_stats.print_summary()
+        self.tracer.flush()
         if self.drawing_window:
-            self.drawing_window.destroy()
-            self.drawing_window = None
+            # hide the window instead of destroying it and let go of the drawing until it opens again
+            self.drawing_window.withdraw()
             self.is_window_open = False
+            self.update_tray_icon()
+            self.pending_motion = []
+            self.preview_item = None
+            self.canvas.delete("preview")
+            self.release_drawing()
         if self.mini_settings_window:
             self.mini_settings_window.destroy()
             self.mini_settings_window = None
             # Re-enable topmost on the main drawing window
             self.drawing_window.attributes("-topmost", True)
 
+    # bytes held by the undo history, its spill file, the layers and the view pyramid
+    def memory_stats(self):
+        return {
+            "undo history peak memory": self.engine.journal.peak_history_bytes,
+            "spilled to disk": self.engine.journal.spilled_bytes,
+            f"layers ({len(self.engine.layers)})": self.engine.layers.allocated_bytes(),
+            "view pyramid": self.engine.pyramid.allocated_bytes(),
+        }
+
+    # drop the drawing buffers, the undo history and the canvas image while the window is hidden
+    # with keep_last_drawing the drawing is kept compressed and comes back on the next open
+    def release_drawing(self):
+        if self.engine is None:
+            return
+        memory_before = resident_memory_bytes()
+        self.hibernated_drawing = self.engine.hibernate() if self.keep_last_drawing else None
+        if self.hibernated_drawing is None:
+            # the drawing is gone, there is nothing left to recover
+            self.autosave.record_clear()
+        else:
+            self.autosave.flush()
+        self.engine.close()
+        self.engine = None
+        self.dirty_rect = None
+        if self.photo_image is not None:
+            self.canvas.delete("all")
+            self.photo_image = None
+            self.background_photo = None
+
+        # the copy to the clipboard may still hold the drawing, report once it is done
+        self.export_worker.when_idle(lambda: self.root.after(0, self.report_idle_memory, memory_before))
+
+    # give freed memory back to the os and print resident memory before and after closing
+    def report_idle_memory(self, memory_before):
+        release_memory()
+        memory_after = resident_memory_bytes()
+        if memory_before is not None and memory_after is not None:
+            kept = f", last drawing kept in {self.hibernated_bytes() / 1024:.0f} kb" if self.hibernated_drawing else ""
+            print(
+                f"resident memory: {memory_before / (1024 * 1024):.1f} mb before closing, "
+                f"{memory_after / (1024 * 1024):.1f} mb after{kept}"
+            )
+
+    # size of the compressed last drawing
+    def hibernated_bytes(self):
+        width, height, journal, tiles, background = self.hibernated_drawing
+        size = len(journal) + sum(tile.resident_bytes for tile in tiles.values())
+        return size + (background.resident_bytes if background is not None else 0)
+
+    # draw a long synthetic stroke in the drawing window and report how long each event takes
+    def run_preview_stress(self, total_events=6000, report_every=500):
+        if not self.is_window_open:
+            self.show_window()
+        cx, cy = self.window_width / 2, self.window_height / 2
+        events = [
+            types.SimpleNamespace(
+                x=int(cx + math.cos(i / 40) * (20 + i * (min(cx, cy) - 30) / total_events)),
+                y=int(cy + math.sin(i / 40) * (20 + i * (min(cx, cy) - 30) / total_events))
+            )
+            for i in range(total_events)
+        ]
+        self.on_button_press(events[0])
+        timings = []
+        print("points  avg event ms  max event ms  canvas items")
+
+        # feed one event per tick so the stroke can be watched as it grows
+        def step(i=1):
+            if i >= total_events or not self.is_window_open:
+                self.on_button_release(events[-1])
+                return
+            start = time.perf_counter()
+            self.on_mouse_drag(events[i])
+            self.flush_motion(drain=True)
+            timings.append((time.perf_counter() - start) * 1000)
+            if i % report_every == 0:
+                print(f"{i:6d}  {sum(timings) / len(timings):12.3f}  {max(timings):12.3f}  {len(self.canvas.find_all()):12d}")
+                timings.clear()
+            self.root.after(1, step, i + 1)
+
+        step()
+
     # exit the application
     def exit_app(self):
         # remove the hotkey if it exists
@@ -608,20 +1382,27 @@ class OpicoDrawApp:
             self.mini_settings_window.destroy()
             self.mini_settings_window = None
 
-        # cancel the periodic tray icon update if it exists
-        if self.tray_icon_updater_id is not None:
-            try:
-                self.root.after_cancel(self.tray_icon_updater_id)
-            except Exception:
-                pass
-            self.tray_icon_updater_id = None
-
         # stop the tray icon
         if self.icon:
             self.icon.visible = False
             self.icon.stop()
             self.icon = None
 
+        # a clean exit leaves nothing to recover
+        self.autosave.close(delete=True)
+        self.config_store.close()
+
+        # an image still decoding is not needed anymore
+        if self.import_worker is not None:
+            self.import_worker.shutdown(wait=False)
+
+        # let pending exports finish, then hand their results over before quitting
+        self.export_worker.shutdown(wait=True)
+        self.root.update()
+        self.tracer.flush()
+        if self.profile_session.running:
+            self.toggle_profiling()
+
         self.root.quit()
 
     # get the inverse color for text readability
@@ -632,6 +1413,9 @@ class OpicoDrawApp:
 
     # choose a new pen color
     def choose_color(self, event=None):
+        import pyautogui
+        from tkinter import colorchooser
+
         # get the current mouse position
         mouse_x, mouse_y = pyautogui.position()
         
@@ -663,6 +1447,7 @@ class OpicoDrawApp:
 
     # show the settings window
     def show_settings(self):
+        self.reload_config()
         if self.settings_window is not None and self.settings_window.winfo_exists():
             self.settings_window.deiconify()
             self.settings_window.lift()
@@ -670,7 +1455,7 @@ class OpicoDrawApp:
 
         self.settings_window = tk.Toplevel()
         self.settings_window.title("settings")
-        self.settings_window.geometry("322x510")  # reverted to original size
+        self.settings_window.geometry("322x545")  # reverted to original size
         self.settings_window.resizable(False, False)
         self.settings_window.protocol("WM_DELETE_WINDOW", self.hide_settings)
 
@@ -761,12 +1546,22 @@ class OpicoDrawApp:
         )
         self.render_canvas_checkbox.grid(row=1, column=0, columnspan=2, sticky=tk.W, pady=5)
 
+        # keep the last drawing when the window closes
+        self.keep_drawing_var = tk.BooleanVar(value=self.keep_last_drawing)
+        self.keep_drawing_checkbox = tk.Checkbutton(
+            advanced_frame,
+            text="keep drawing after closing",
+            variable=self.keep_drawing_var,
+            command=self.update_keep_drawing_setting
+        )
+        self.keep_drawing_checkbox.grid(row=2, column=0, columnspan=2, sticky=tk.W, pady=5)
+
         # hotkey settings
-        tk.Label(advanced_frame, text="hotkey to open opico draw:").grid(row=2, column=0, sticky=tk.W, pady=5, padx=(0, 10))
+        tk.Label(advanced_frame, text="hotkey to open opico draw:").grid(row=3, column=0, sticky=tk.W, pady=5, padx=(0, 10))
         self.hotkey_label = tk.Label(advanced_frame, text=self.hotkey, relief=tk.SUNKEN, width=15)
-        self.hotkey_label.grid(row=2, column=1, pady=5, sticky=tk.W)
+        self.hotkey_label.grid(row=3, column=1, pady=5, sticky=tk.W)
         set_hotkey_button = tk.Button(advanced_frame, text="set hotkey", command=self.record_hotkey)
-        set_hotkey_button.grid(row=3, column=0, columnspan=2, pady=5, sticky="ew")
+        set_hotkey_button.grid(row=4, column=0, columnspan=2, pady=5, sticky="ew")
 
         # apply button frame
         button_frame = tk.Frame(main_frame)
@@ -803,6 +1598,7 @@ class OpicoDrawApp:
         self.hotkey_label.config(text=self.hotkey)
         self.apply_hotkey()
         self.save_config()
+        self.update_tray_icon()
 
     # update the auto copy on close setting
     def update_auto_copy_setting(self):
@@ -814,6 +1610,11 @@ class OpicoDrawApp:
         self.render_canvas_brushstroke = self.render_canvas_var.get()
         self.save_config()
 
+    # update the keep drawing after closing setting
+    def update_keep_drawing_setting(self):
+        self.keep_last_drawing = self.keep_drawing_var.get()
+        self.save_config()
+
     # hide the settings window
     def hide_settings(self):
         if self.settings_window:
@@ -849,6 +1650,8 @@ class OpicoDrawApp:
                 self.create_image()
 
         except ValueError:
+            from tkinter import messagebox
+
             messagebox.showerror(
                 "invalid input",
                 "please enter valid integer values for width, height, pen size, and smoothing factor."
@@ -883,9 +1686,14 @@ def remove_maximize_minimize(window):
 
 # run the application
 if __name__ == "__main__":
+    startup_profiler.begin("tk root")
     root = tk.Tk()
     root.overrideredirect(True)
     root.geometry('0x0+0+0')
     root.withdraw()
+    startup_profiler.end()
     app = OpicoDrawApp(root)
+    root.after_idle(startup_profiler.report)
+    if "--stress-preview" in sys.argv:
+        root.after(500, app.run_preview_stress)
     root.mainloop()
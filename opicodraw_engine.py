@@ -0,0 +1,1940 @@
+# opico draw - drawing engine
+# the stroke journal and rasterizer behind the drawing window, only needs pillow
+# so it can run headless for profiling and batch tools
+# made by ol1fer
+# github: https://github.com/ol1fer/opicodraw
+
+from PIL import Image, ImageChops, ImageColor, ImageDraw, ImageOps
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+import functools
+import math
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from array import array
+
+# numpy is optional and slow to import, it is loaded when the analytic raster mode or the fill is first used
+np = None
+
+# import numpy on first use, returns none if it is not installed
+def load_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        np = numpy
+    return np
+
+# size of the square tiles keyframes are split into (in supersampled pixels)
+HISTORY_TILE_SIZE = 128
+
+# number of strokes between raster keyframes in the stroke journal
+KEYFRAME_INTERVAL = 16
+
+# zlib level of compressed history tiles, low levels are several times faster and pack ink nearly as well
+HISTORY_COMPRESSION_LEVEL = 1
+
+# how many times the history budget spilled history may take on disk before the oldest keyframes are dropped
+SPILL_BUDGET_FACTOR = 8
+
+# distance between brush dabs as a fraction of the brush width
+DAB_SPACING = 0.25
+
+# get the ink and antialiased mask of a round brush dab, width is in image pixels
+@functools.lru_cache(maxsize=64)
+def dab_sprite(width, color):
+    size = max(1, int(width))
+    big = Image.new("L", (size * 4, size * 4), 0)
+    ImageDraw.Draw(big).ellipse((0, 0, size * 4 - 1, size * 4 - 1), fill=255)
+    return Image.new("RGBA", (size, size), color), big.reduce(4)
+
+# group sorted indices into (first, last) runs of consecutive ones
+def consecutive_runs(indices):
+    runs = []
+    for index in indices:
+        if runs and runs[-1][1] == index - 1:
+            runs[-1][1] = index
+        else:
+            runs.append([index, index])
+    return runs
+
+# how much any premultiplied channel may differ from the pixel under the cursor for a fill to cover it
+FILL_TOLERANCE = 32
+
+# find the 4-connected area of a boolean mask around (x, y) by walking the horizontal runs of the
+# mask instead of single pixels, needs numpy. returns (x0, y0, area) with area a boolean array
+# covering the bounding box of the area
+def flood_region(mask, x, y):
+    height, width = mask.shape
+    if mask.all():
+        return 0, 0, mask
+    stride = width + 1
+
+    # the runs of every row in row major order as keys of row * stride + x, ends are exclusive.
+    # the rows are padded with false on both sides, so their changes alternate between starts
+    # and ends. the keys stay sorted, so the runs one row up or down that touch a run are a slice
+    padded = np.zeros((height, width + 2), bool)
+    padded[:, 1:-1] = mask
+    keys = np.flatnonzero(padded[:, 1:] != padded[:, :-1])
+    start_keys, end_keys = keys[0::2], keys[1::2]
+    rows = start_keys // stride
+    starts, ends = start_keys - rows * stride, end_keys - rows * stride
+    up_lo = np.searchsorted(end_keys, start_keys - stride, "right").tolist()
+    up_hi = np.searchsorted(start_keys, end_keys - stride, "left").tolist()
+    down_lo = np.searchsorted(end_keys, start_keys + stride, "right").tolist()
+    down_hi = np.searchsorted(start_keys, end_keys + stride, "left").tolist()
+
+    # walk the runs connected to the one under the point
+    seed = int(np.searchsorted(start_keys, y * stride + x, "right")) - 1
+    seen = bytearray(len(rows))
+    seen[seed] = 1
+    pending = [seed]
+    while pending:
+        run = pending.pop()
+        for other in range(up_lo[run], up_hi[run]):
+            if not seen[other]:
+                seen[other] = 1
+                pending.append(other)
+        for other in range(down_lo[run], down_hi[run]):
+            if not seen[other]:
+                seen[other] = 1
+                pending.append(other)
+
+    # paint the runs found, a +1 at every start and a -1 at every end summed along the rows
+    found = np.flatnonzero(np.frombuffer(seen, np.uint8))
+    everything = len(found) == len(rows)
+    rows, starts, ends = rows[found], starts[found], ends[found]
+    x0, y0 = int(starts.min()), int(rows.min())
+    x1, y1 = int(ends.max()), int(rows.max()) + 1
+    if everything:
+        # filling all of the mask, which is common on an empty layer
+        return x0, y0, mask[y0:y1, x0:x1]
+    # as alternating stretches of false and true along the box in row major order
+    width = x1 - x0
+    bounds = np.empty(2 * len(rows) + 2, np.int64)
+    bounds[0], bounds[-1] = 0, (y1 - y0) * width
+    bounds[1:-1:2] = (rows - y0) * width + starts - x0
+    bounds[2:-1:2] = (rows - y0) * width + ends - x0
+    values = np.arange(len(bounds) - 1) % 2 == 1
+    return x0, y0, np.repeat(values, np.diff(bounds)).reshape(y1 - y0, width)
+
+# which cells of s x s pixels of a boolean mask are true everywhere, the mask is cut to whole cells
+def matching_cells(mask, s):
+    height, width = mask.shape[0] // s, mask.shape[1] // s
+    # the rows first, they are contiguous
+    rows = mask[:height * s, :width * s].reshape(height, s, width * s)
+    cells = rows[:, 0].copy()
+    for offset in range(1, s):
+        cells &= rows[:, offset]
+    columns = cells[:, 0::s].copy()
+    for offset in range(1, s):
+        columns &= cells[:, offset::s]
+    return columns
+
+# which pixels of a box are not in a region flood_region found at (x, y), as a boolean array
+def outside_region(x, y, region, box):
+    x0, y0, x1, y1 = box
+    pixels = np.ones((y1 - y0, x1 - x0), bool)
+    left, top = max(x0, x), max(y0, y)
+    right, bottom = min(x1, x + region.shape[1]), min(y1, y + region.shape[0])
+    if left < right and top < bottom:
+        pixels[top - y0:bottom - y0, left - x0:right - x0] = ~region[top - y:bottom - y, left - x:right - x]
+    return pixels
+
+# size of the square tiles the backing store is split into (in image pixels)
+STORE_TILE_SIZE = 256
+
+# what made a journal entry. a fill keeps its seed point and the corners of the area it
+# changed as points, its tolerance as the smoothing factor and a width of 0
+TOOL_PEN = 0
+TOOL_ERASER = 1
+TOOL_FILL = 2
+
+# most layers a drawing can have, the journal keeps the layer of a stroke in a byte
+MAX_LAYERS = 256
+
+# color of pixels nothing has been drawn on, the eraser draws with it
+TRANSPARENT = (255, 255, 255, 0)
+
+# an rgba image split into tiles that are only allocated once something is drawn on them
+# tile_size none keeps a single dense image instead
+class TiledImage:
+    def __init__(self, width, height, tile_size=STORE_TILE_SIZE):
+        self.width = width
+        self.height = height
+        self.size = (width, height)
+        self.dense = tile_size is None
+        self.tile_size = max(width, height, 1) if self.dense else tile_size
+        self.layer = 0  # index in the LayerStack the image belongs to
+        self.dirty = None  # {(tx, ty): box in the tile} changed since they were last composited, none if not tracked
+        self.clear()
+
+    # remember that a clipped box (in image pixels) of a tile changed
+    def mark_dirty(self, tx, ty, box):
+        if self.dirty is None:
+            return
+        ts = self.tile_size
+        box = (box[0] - tx * ts, box[1] - ty * ts, box[2] - tx * ts, box[3] - ty * ts)
+        old = self.dirty.get((tx, ty))
+        if old is not None:
+            box = (min(old[0], box[0]), min(old[1], box[1]), max(old[2], box[2]), max(old[3], box[3]))
+        self.dirty[(tx, ty)] = box
+
+    # the part of a tile inside the image, in image pixels
+    def tile_bounds(self, tx, ty):
+        ts = self.tile_size
+        return self.clip((tx * ts, ty * ts, (tx + 1) * ts, (ty + 1) * ts))
+
+    # drop every tile, a dense image is wiped and kept
+    def clear(self):
+        image = self.tiles.get((0, 0)) if self.dense and hasattr(self, "tiles") else None
+        if self.dirty is not None:
+            for tx, ty in self.tiles:
+                self.mark_dirty(tx, ty, self.tile_bounds(tx, ty))
+        self.tiles = {}
+        if self.dense:
+            if image is None:
+                image = Image.new("RGBA", self.size, TRANSPARENT)
+            else:
+                image.paste(TRANSPARENT, (0, 0) + self.size)
+            self.tiles[(0, 0)] = image
+
+    # get a tile, allocating it if needed
+    def tile(self, tx, ty):
+        tile = self.tiles.get((tx, ty))
+        if tile is None:
+            tile = self.tiles[(tx, ty)] = Image.new("RGBA", (self.tile_size, self.tile_size), TRANSPARENT)
+        return tile
+
+    # clip a box to the image, rounding outwards to whole pixels
+    def clip(self, box):
+        return (
+            max(0, int(math.floor(box[0]))), max(0, int(math.floor(box[1]))),
+            min(self.width, int(math.ceil(box[2]))), min(self.height, int(math.ceil(box[3])))
+        )
+
+    # yield (tx, ty, intersection) for every tile position overlapping a clipped box
+    def tiles_in(self, box):
+        ts = self.tile_size
+        x0, y0, x1, y1 = box
+        for ty in range(y0 // ts, (y1 - 1) // ts + 1):
+            for tx in range(x0 // ts, (x1 - 1) // ts + 1):
+                yield tx, ty, (
+                    max(x0, tx * ts), max(y0, ty * ts),
+                    min(x1, (tx + 1) * ts), min(y1, (ty + 1) * ts)
+                )
+
+    # copy an area out of the image, missing tiles are transparent
+    def crop(self, box):
+        box = tuple(box)
+        if self.dense:
+            return self.tiles[(0, 0)].crop(box)
+        result = Image.new("RGBA", (box[2] - box[0], box[3] - box[1]), TRANSPARENT)
+        clipped = self.clip(box)
+        if clipped[0] >= clipped[2] or clipped[1] >= clipped[3]:
+            return result
+        ts = self.tile_size
+        for tx, ty, (ix0, iy0, ix1, iy1) in self.tiles_in(clipped):
+            tile = self.tiles.get((tx, ty))
+            if tile is not None:
+                part = tile.crop((ix0 - tx * ts, iy0 - ty * ts, ix1 - tx * ts, iy1 - ty * ts))
+                result.paste(part, (ix0 - box[0], iy0 - box[1]))
+        return result
+
+    # paste an image at xy or fill a box (x0, y0, x1, y1) with a color
+    def paste(self, im, box, mask=None):
+        is_image = isinstance(im, Image.Image)
+        if self.dense:
+            self.tiles[(0, 0)].paste(im, box, mask)
+            if is_image:
+                box = (box[0], box[1], box[0] + im.width, box[1] + im.height)
+            self.mark_dirty(0, 0, self.clip(box))
+            return
+        if is_image:
+            box = (box[0], box[1], box[0] + im.width, box[1] + im.height)
+        clipped = self.clip(box)
+        if clipped[0] >= clipped[2] or clipped[1] >= clipped[3]:
+            return
+        ts = self.tile_size
+        erase = not is_image and mask is None and len(im) == 4 and im[3] == 0
+        for tx, ty, (ix0, iy0, ix1, iy1) in self.tiles_in(clipped):
+            self.mark_dirty(tx, ty, (ix0, iy0, ix1, iy1))
+            tile = self.tiles.get((tx, ty))
+            local = (ix0 - tx * ts, iy0 - ty * ts, ix1 - tx * ts, iy1 - ty * ts)
+            if erase and (tile is None or local == (0, 0, ts, ts)):
+                # clearing a whole tile just drops it
+                self.tiles.pop((tx, ty), None)
+                continue
+            if not is_image and mask is None and local == (0, 0, ts, ts):
+                # filling a whole tile makes a new one instead of writing it twice
+                self.tiles[(tx, ty)] = Image.new("RGBA", (ts, ts), im)
+                continue
+            source = (ix0 - box[0], iy0 - box[1], ix1 - box[0], iy1 - box[1])
+            part = im.crop(source) if is_image else im
+            part_mask = mask.crop(source) if mask is not None else None
+            if tile is None and is_image and part_mask is None and not part.getbbox(alpha_only=True):
+                # pasting nothing onto a missing tile leaves it missing
+                continue
+            self.tile(tx, ty).paste(part, local if not is_image else local[:2], part_mask)
+
+    # draw items (segments, dabs) into an area, spans holds the box each item draws into
+    # fn(image, x, y, indices) is called for every tile an item reaches with the tile, the position
+    # of its top left corner and the indices of the items that reach it in order, so a tile only
+    # draws what lands on it. tiles that stay empty are not kept
+    def edit(self, box, fn, spans):
+        box = self.clip(box)
+        if self.dense:
+            fn(self.tiles[(0, 0)], 0, 0, range(len(spans)))
+            self.mark_dirty(0, 0, box)
+            return
+        if box[0] >= box[2] or box[1] >= box[3]:
+            return
+        reaching = {}
+        for index, span in enumerate(spans):
+            span = self.clip(span)
+            if span[0] < span[2] and span[1] < span[3]:
+                for tx, ty, _ in self.tiles_in(span):
+                    reaching.setdefault((tx, ty), []).append(index)
+        ts = self.tile_size
+        for tx, ty, part in self.tiles_in(box):
+            indices = reaching.get((tx, ty))
+            if indices is None:
+                continue
+            self.mark_dirty(tx, ty, part)
+            existed = (tx, ty) in self.tiles
+            tile = self.tile(tx, ty)
+            fn(tile, tx * ts, ty * ts, indices)
+            if not existed and not tile.getbbox(alpha_only=True):
+                del self.tiles[(tx, ty)]
+
+    # memory held by allocated tiles
+    def allocated_bytes(self):
+        return sum(tile.width * tile.height * 4 for tile in self.tiles.values())
+
+    # copy of the image that later drawing does not change
+    def copy(self):
+        image = TiledImage(self.width, self.height, None if self.dense else self.tile_size)
+        image.tiles = {key: tile.copy() for key, tile in self.tiles.items()}
+        return image
+
+# the layers of a drawing, drawn over each other in order, and a cached composite of them
+# the layers under and over the active one are kept flattened, so drawing on the active layer
+# recomposites three images wherever it changed, however many layers there are
+class LayerStack:
+    def __init__(self, width, height, tile_size=STORE_TILE_SIZE):
+        self.width = width
+        self.height = height
+        self.size = (width, height)
+        self.tile_size = tile_size
+        self.layers = []
+        self.reset()
+
+    # go back to one empty layer, the first layer is reused
+    def reset(self):
+        first = self.layers[0] if self.layers else self.new_layer()
+        first.clear()
+        self.layers = [first]
+        self.active = 0
+        self.composite = None  # TiledImage, only kept with more than one layer
+        self.below = self.above = None  # the layers under and over the active one flattened, none when stale
+        first.dirty.clear()
+
+    # number of layers
+    def __len__(self):
+        return len(self.layers)
+
+    # the layer strokes go to
+    @property
+    def active_layer(self):
+        return self.layers[self.active]
+
+    # make an empty layer that is not in the stack yet
+    def new_layer(self):
+        layer = TiledImage(self.width, self.height, self.tile_size)
+        layer.layer = len(self.layers)
+        layer.dirty = {}
+        return layer
+
+    # add an empty layer on top and make it the active one, returns its index
+    def add(self):
+        if len(self.layers) >= MAX_LAYERS:
+            return self.active
+        self.layers.append(self.new_layer())
+        self.select(len(self.layers) - 1)
+        return self.active
+
+    # add layers until there are at least count
+    def ensure(self, count):
+        while len(self.layers) < count:
+            self.layers.append(self.new_layer())
+            self.invalidate()
+
+    # make another layer the active one
+    def select(self, index):
+        index = max(0, min(len(self.layers) - 1, index))
+        if index != self.active:
+            self.active = index
+            self.invalidate()
+
+    # composite everything again on the next refresh
+    def invalidate(self):
+        self.below = self.above = None
+
+    # flatten a box of one tile position of the given layers, none if none of them has that tile
+    def stack_region(self, layers, key, box):
+        result = None
+        for layer in layers:
+            tile = layer.tiles.get(key)
+            if tile is None:
+                continue
+            if result is None:
+                result = tile.crop(box)
+            else:
+                result.alpha_composite(tile.crop(box))
+        return result
+
+    # store a flattened box of a tile, none makes it transparent
+    def put_region(self, image, key, box, region):
+        tile = image.tiles.get(key)
+        if region is not None:
+            (tile or image.tile(*key)).paste(region, box[:2])
+        elif tile is not None:
+            if box == (0, 0) + tile.size and not image.dense:
+                del image.tiles[key]
+            else:
+                tile.paste(TRANSPARENT, box)
+
+    # merge {key: box} dirty maps into the first one
+    def merge_dirty(self, into, dirty):
+        for key, box in dirty.items():
+            old = into.get(key)
+            if old is not None:
+                box = (min(old[0], box[0]), min(old[1], box[1]), max(old[2], box[2]), max(old[3], box[3]))
+            into[key] = box
+
+    # composite the boxes that changed since the last refresh
+    def refresh(self):
+        if len(self.layers) == 1:
+            self.layers[0].dirty.clear()
+            return
+        active = self.active_layer
+        groups = {}
+        if self.below is None:
+            # everything, after the active layer changed or layers were added
+            self.composite = TiledImage(self.width, self.height, self.tile_size)
+            self.below = TiledImage(self.width, self.height, self.tile_size)
+            self.above = TiledImage(self.width, self.height, self.tile_size)
+            for layer in self.layers:
+                for tx, ty in layer.tiles:
+                    groups[(tx, ty)] = (0, 0) + layer.tiles[(tx, ty)].size
+        else:
+            for layer in self.layers:
+                if layer is not active:
+                    self.merge_dirty(groups, layer.dirty)
+        stale = dict(groups)
+        self.merge_dirty(stale, active.dirty)
+        for layer in self.layers:
+            layer.dirty.clear()
+
+        # the flattened layers under and over the active one only change when those layers do
+        for key, box in groups.items():
+            self.put_region(self.below, key, box, self.stack_region(self.layers[:self.active], key, box))
+            self.put_region(self.above, key, box, self.stack_region(self.layers[self.active + 1:], key, box))
+        for key, box in stale.items():
+            self.put_region(self.composite, key, box, self.stack_region((self.below, active, self.above), key, box))
+
+    # the layers flattened, do not modify it
+    def view(self):
+        self.refresh()
+        return self.layers[0] if len(self.layers) == 1 else self.composite
+
+    # memory held by the layers and the composite caches
+    def allocated_bytes(self):
+        images = self.layers + [image for image in (self.composite, self.below, self.above) if image is not None]
+        return sum(image.allocated_bytes() for image in images)
+
+# the pyramid is halved until its smallest level is about this big on its longest side
+MIPMAP_MIN_SIZE = 256
+
+# the drawing at every power of two scale between the supersampled layers and a small thumbnail,
+# so any zoom is resampled from a level at most twice its size instead of from the full buffer.
+# the level at canvas size is downsampled with lanczos like render_region, the others are halved
+# with a box filter. changes only mark their tiles stale, they are made again when a view shows
+# them, so levels and areas that are never looked at cost nothing
+class MipmapPyramid:
+    def __init__(self, engine):
+        self.engine = engine
+        s = engine.scale_factor
+        self.scales = []
+        scale = s
+        while scale > 1:
+            self.scales.append(scale)
+            scale /= 2
+        self.scales.append(1)
+        while max(engine.width, engine.height) * self.scales[-1] > MIPMAP_MIN_SIZE:
+            self.scales.append(self.scales[-1] / 2)
+        # the first level is the composite of the layers itself
+        self.levels = [None] + [
+            TiledImage(math.ceil(engine.width * scale), math.ceil(engine.height * scale), engine.tile_size)
+            for scale in self.scales[1:]
+        ]
+        self.stale = [{} for _ in self.scales]  # {(tx, ty): box in level pixels} per level
+        self.canvas_level = self.scales.index(1)
+        self.backgrounds = []  # the background image from the canvas size level down, halved as views need them
+
+    # a level as an image, do not modify it
+    def level(self, index):
+        return self.engine.layers.view() if index == 0 else self.levels[index]
+
+    # the background image at a level below the canvas size one
+    def background_level(self, index):
+        index -= self.canvas_level
+        while len(self.backgrounds) <= index:
+            self.backgrounds.append(self.backgrounds[-1].reduce(2))
+        return self.backgrounds[index]
+
+    # show an image at canvas size under the drawing, none removes it
+    def set_background(self, image):
+        self.backgrounds = [] if image is None else [image]
+
+    # mark an area (in canvas pixels) stale on every level, grown by the reach of the lanczos filter
+    def mark_dirty(self, box):
+        box = (box[0] - 3, box[1] - 3, box[2] + 3, box[3] + 3)
+        for index in range(1, len(self.levels)):
+            level, scale, stale = self.levels[index], self.scales[index], self.stale[index]
+            clipped = level.clip([c * scale for c in box])
+            if clipped[0] >= clipped[2] or clipped[1] >= clipped[3]:
+                continue
+            for tx, ty, part in level.tiles_in(clipped):
+                old = stale.get((tx, ty))
+                if old is not None:
+                    part = (min(old[0], part[0]), min(old[1], part[1]), max(old[2], part[2]), max(old[3], part[3]))
+                stale[(tx, ty)] = part
+
+    # mark every level stale, after the layers were replaced
+    def invalidate(self):
+        self.mark_dirty((0, 0, self.engine.width, self.engine.height))
+
+    # make the stale tiles of a level inside a box (in level pixels) again, from the level above
+    def update(self, index, box):
+        if index == 0:
+            return
+        level, stale = self.levels[index], self.stale[index]
+        if not stale or box[0] >= box[2] or box[1] >= box[3]:
+            return
+        parts = [stale.pop((tx, ty)) for tx, ty, _ in level.tiles_in(box) if (tx, ty) in stale]
+        if not parts:
+            return
+        # one pass over all of them, the lanczos filter reads a margin around every area it makes
+        part = (min(p[0] for p in parts), min(p[1] for p in parts), max(p[2] for p in parts), max(p[3] for p in parts))
+        if self.scales[index] == 1:
+            region = self.engine.render_region(part)
+        else:
+            source = self.level(index - 1).clip([c * 2 for c in part])
+            self.update(index - 1, source)
+            region = self.level(index - 1).crop(source).reduce(2)
+        level.paste(region, part[:2])
+
+    # draw a box (in window pixels) of a window that shows the canvas scaled by zoom and scrolled
+    # so (scroll_x, scroll_y) in zoomed pixels is its top left corner, outside the canvas is transparent
+    # draft takes the nearest pixel instead of filtering, for frames while the view is moving
+    # background draws the background image instead of the drawing, none if there is none
+    def render(self, box, scroll_x, scroll_y, zoom, draft=False, background=False):
+        if background and not self.backgrounds:
+            return None
+        x0, y0, x1, y1 = box
+        # the part of the box the canvas covers
+        cx0, cy0 = max(x0, -scroll_x), max(y0, -scroll_y)
+        cx1 = min(x1, round(self.engine.width * zoom) - scroll_x)
+        cy1 = min(y1, round(self.engine.height * zoom) - scroll_y)
+        if cx0 >= cx1 or cy0 >= cy1:
+            return Image.new("RGBA", (x1 - x0, y1 - y0), TRANSPARENT)
+
+        # the smallest level that is not smaller than the view, the full buffer when zoomed in past it
+        # the background only has levels from the canvas size down
+        index = self.canvas_level if background else 0
+        while index + 1 < len(self.scales) and self.scales[index + 1] >= zoom:
+            index += 1
+        scale = self.scales[index] / zoom
+        level = self.background_level(index) if background else self.level(index)
+        update = (lambda index, box: None) if background else self.update
+        source = [
+            (cx0 + scroll_x) * scale, (cy0 + scroll_y) * scale,
+            min(level.width, (cx1 + scroll_x) * scale), min(level.height, (cy1 + scroll_y) * scale)
+        ]
+        if scale == 1 and all(c == int(c) for c in source):
+            # the level is at the zoom and lines up with the window pixels, a copy is enough
+            source = [int(c) for c in source]
+            update(index, source)
+            area = level.crop(source)
+        else:
+            # one level pixel more on every side for the filter, clip only needs a width and height
+            padded = TiledImage.clip(level, (source[0] - 1, source[1] - 1, source[2] + 1, source[3] + 1))
+            update(index, padded)
+            area = level.crop(padded).resize(
+                (cx1 - cx0, cy1 - cy0), Image.NEAREST if draft else Image.BILINEAR,
+                box=(source[0] - padded[0], source[1] - padded[1], source[2] - padded[0], source[3] - padded[1])
+            )
+        if (cx0, cy0, cx1, cy1) == tuple(box):
+            return area
+        frame = Image.new("RGBA", (x1 - x0, y1 - y0), TRANSPARENT)
+        frame.paste(area, (cx0 - x0, cy0 - y0))
+        return frame
+
+    # memory held by the levels made so far
+    def allocated_bytes(self):
+        # pillow keeps rgb images at 4 bytes a pixel too
+        return sum(level.allocated_bytes() for level in self.levels[1:]) + sum(
+            4 * image.width * image.height for image in self.backgrounds
+        )
+
+# turns raw pointer samples into smoothed line segments, one sample at a time
+class StrokeSmoother:
+    def __init__(self, x, y, smoothing_factor):
+        self.smoothing_factor = smoothing_factor
+        self.last_x, self.last_y = x, y
+        self.points = [(x, y)]
+
+    # add a raw sample and return the segment (x1, y1, x2, y2) to draw
+    def add(self, x, y):
+        self.points.append((x, y))
+
+        if len(self.points) >= self.smoothing_factor:
+            avg_x = sum(p[0] for p in self.points) / len(self.points)
+            avg_y = sum(p[1] for p in self.points) / len(self.points)
+            segment = (self.last_x, self.last_y, avg_x, avg_y)
+            self.last_x, self.last_y = avg_x, avg_y
+            self.points.pop(0)
+        else:
+            segment = (self.last_x, self.last_y, x, y)
+            self.last_x, self.last_y = x, y
+
+        return segment
+
+# an append-only scratch file that compressed history tiles are moved to, read back through mmap
+# the file is created on first use and deleted by the os once it is closed. space of data nothing
+# points to any more is reclaimed by compact
+class SpillFile:
+    def __init__(self, directory):
+        self.directory = directory
+        self.file = None
+        self.map = None
+        self.size = 0
+
+    # append data, returns its (offset, length)
+    def write(self, data):
+        if self.file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.file = tempfile.TemporaryFile(dir=self.directory, prefix="history-", suffix=".spill")
+        self.file.seek(self.size)
+        self.file.write(data)
+        offset, self.size = self.size, self.size + len(data)
+        return offset, len(data)
+
+    # read data back
+    def read(self, offset, length):
+        return self.mapping(offset + length)[offset:offset + length]
+
+    # the file mapped up to at least end, it is mapped again when it has grown past the mapping
+    def mapping(self, end):
+        if self.map is None or len(self.map) < end:
+            self.file.flush()
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map
+
+    # copy the data of the spilled PackedTiles in tiles to a new file and delete the old one with
+    # everything else in it, the tiles get their new offsets
+    def compact(self, tiles):
+        tiles = sorted(tiles, key=lambda tile: tile.offset)
+        if not tiles:
+            self.reset()
+            return
+        source, source_map = self.file, self.mapping(self.size)
+        self.file, self.map, self.size = None, None, 0
+        for tile in tiles:
+            tile.offset, tile.length = self.write(source_map[tile.offset:tile.offset + tile.length])
+        source_map.close()
+        source.close()
+
+    # drop everything written so far
+    def reset(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.seek(0)
+            self.file.truncate()
+        self.size = 0
+
+    # close and delete the file
+    def close(self):
+        self.reset()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+# a history tile compressed with zlib, kept in memory or moved to a spill file
+class PackedTile:
+    __slots__ = ("size", "mode", "data", "spill", "offset", "length")
+
+    def __init__(self, tile):
+        self.size = tile.size
+        self.mode = tile.mode
+        self.data = zlib.compress(tile.tobytes(), HISTORY_COMPRESSION_LEVEL)
+        self.spill = None
+        self.offset = self.length = 0
+
+    # memory held by the compressed bytes, none once they are on disk
+    @property
+    def resident_bytes(self):
+        return len(self.data) if self.data is not None else 0
+
+    # decompress the tile into a new image
+    def image(self):
+        data = self.data if self.spill is None else self.spill.read(self.offset, self.length)
+        return Image.frombytes(self.mode, self.size, zlib.decompress(data))
+
+    # move the compressed bytes to a spill file
+    def move_to(self, spill):
+        if self.spill is None:
+            self.offset, self.length = spill.write(self.data)
+            self.spill = spill
+            self.data = None
+
+# the drawing as a list of strokes, with raster keyframes to undo from
+# max_history caps how many strokes can be undone, history_budget caps the memory the keyframes hold:
+# past it the keyframes furthest from the cursor are compressed, then moved to a spill file in
+# spill_dir, and only then dropped. they are decompressed again when an undo reaches them
+class StrokeJournal:
+    def __init__(self, max_history=128, keyframe_interval=KEYFRAME_INTERVAL, tile_size=HISTORY_TILE_SIZE,
+                 history_budget=None, spill_dir=None, spill=None):
+        self.max_history = max_history  # none for no limit
+        self.keyframe_interval = keyframe_interval
+        self.tile_size = tile_size
+        self.history_budget = history_budget  # bytes, none for no limit
+        self.spill = spill or (SpillFile(spill_dir) if spill_dir is not None else None)
+        self.history_bytes = 0
+        self.peak_history_bytes = 0
+        self.spilled_bytes = 0
+        self.clear()
+
+    # drop all strokes and keyframes
+    def clear(self):
+        self.coords = array('f')  # x, y pairs of every stroke, in canvas pixels
+        self.offsets = array('I', [0])  # start of each stroke in coords, in points
+        self.widths = array('f')
+        self.colors = array('I')  # 0xrrggbb
+        self.smoothing = array('i')
+        self.layers = array('B')  # index of the layer each stroke is on
+        self.tools = array('B')  # TOOL_PEN, TOOL_ERASER or TOOL_FILL
+        self.cursor = 0  # number of strokes currently applied to the image
+        self.recording = None  # points of the stroke in progress
+        self.keyframes = {0: {}}  # stroke count -> {(layer, tx, ty): tile} with empty tiles left out
+        self.tiles_changed = True  # the keyframe tiles have to be recounted
+        self.touched = set()  # tiles changed since the last keyframe
+        if self.spill is not None:
+            self.spill.reset()
+        self.update_history_bytes()
+
+    # number of strokes in the journal, including undone ones
+    def __len__(self):
+        return len(self.widths)
+
+    # number of layers the strokes are on
+    def layer_count(self):
+        return max(self.layers) + 1 if self.layers else 1
+
+    # start recording a new stroke
+    def begin_stroke(self, x, y, width, color, smoothing_factor, layer=0, tool=TOOL_PEN):
+        self.recording = (array('f', (x, y)), width, int(color[1:], 16), smoothing_factor, layer, tool)
+
+    # add a raw sample to the stroke in progress
+    def add_point(self, x, y):
+        if self.recording is not None:
+            self.recording[0].extend((x, y))
+
+    # finish the stroke in progress, the LayerStack must already have it drawn
+    def end_stroke(self, stack):
+        if self.recording is None:
+            return
+        recording, self.recording = self.recording, None
+        self.append(*recording)
+
+        if self.cursor % self.keyframe_interval == 0:
+            self.save_keyframe(stack)
+            self.trim()
+
+        self.update_history_bytes()
+        self.enforce_budget()
+
+    # add a finished stroke after the applied ones, coords is a flat array of x, y and color is 0xrrggbb
+    # no keyframe is saved, so an image has to be re-rendered from the journal afterwards
+    def append(self, coords, width, color, smoothing_factor, layer=0, tool=TOOL_PEN):
+        # drawing after an undo throws away the undone strokes
+        self.truncate()
+
+        self.coords.extend(coords)
+        self.offsets.append(len(self.coords) // 2)
+        self.widths.append(width)
+        self.colors.append(color)
+        self.smoothing.append(smoothing_factor)
+        self.layers.append(layer)
+        self.tools.append(tool)
+        self.cursor += 1
+
+    # get the points, width, color, smoothing factor, layer and tool of a stroke
+    def stroke(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        flat = self.coords[start * 2:end * 2]
+        points = list(zip(flat[0::2], flat[1::2]))
+        return (
+            points, self.widths[index], f"#{self.colors[index]:06x}", self.smoothing[index],
+            self.layers[index], self.tools[index]
+        )
+
+    # remember that the tiles under bbox on a layer changed since the last keyframe
+    def touch(self, bbox, layer=0):
+        ts = self.tile_size
+        x0, y0 = max(0, int(bbox[0])), max(0, int(bbox[1]))
+        x1, y1 = int(bbox[2]), int(bbox[3])
+        for ty in range(y0 // ts, y1 // ts + 1):
+            for tx in range(x0 // ts, x1 // ts + 1):
+                self.touched.add((layer, tx, ty))
+
+    # get the area covered by strokes start to end (exclusive), in canvas pixels
+    def strokes_bbox(self, start, end):
+        flat = self.coords[self.offsets[start] * 2:self.offsets[end] * 2]
+        if not flat:
+            return None
+        radius = max(self.widths[start:end]) / 2 + 1
+        xs, ys = flat[0::2], flat[1::2]
+        return (min(xs) - radius, min(ys) - radius, max(xs) + radius, max(ys) + radius)
+
+    # undo the last stroke by replaying from the nearest keyframe
+    # render(stack, index) draws a single stroke onto its layer, returns the area of the undone stroke
+    # or none, the replayed strokes come out as they were
+    def undo(self, stack, render):
+        if self.cursor <= min(self.keyframes):
+            return None
+        current = max(k for k in self.keyframes if k <= self.cursor)
+        self.cursor -= 1
+        start = max(k for k in self.keyframes if k <= self.cursor)
+        self.restore_keyframe(stack, start, current)
+        for index in range(start, self.cursor):
+            render(stack, index)
+        self.update_history_bytes()
+        self.enforce_budget()
+        return self.strokes_bbox(self.cursor, self.cursor + 1)
+
+    # redo the next undone stroke, returns the changed area or none
+    def redo(self, stack, render):
+        if self.cursor >= len(self):
+            return None
+        render(stack, self.cursor)
+        self.cursor += 1
+        if self.cursor % self.keyframe_interval == 0 and self.cursor not in self.keyframes:
+            self.save_keyframe(stack)
+            self.update_history_bytes()
+            self.enforce_budget()
+        return self.strokes_bbox(self.cursor - 1, self.cursor)
+
+    # snapshot the changed tiles of every layer, sharing the unchanged ones with the previous keyframe
+    def save_keyframe(self, stack):
+        previous = max(k for k in self.keyframes if k < self.cursor)
+        tiles = dict(self.keyframes[previous])
+        for layer, tx, ty in self.touched:
+            box = self.tile_box(stack, tx, ty)
+            if box[0] >= box[2] or box[1] >= box[3]:
+                continue
+            tile = stack.layers[layer].crop(box)
+            if tile.getbbox(alpha_only=True):
+                tiles[(layer, tx, ty)] = tile
+            else:
+                tiles.pop((layer, tx, ty), None)
+        self.keyframes[self.cursor] = tiles
+        self.touched = set()
+        self.tiles_changed = True
+
+    # reset the layers to a keyframe while they hold keyframe current and the touched tiles on top
+    # only the touched tiles and the ones the two keyframes do not share are put back, so the rest
+    # of the layers stays clean for the composite. compressed tiles are decompressed straight onto
+    # the layers and stay compressed in the keyframe
+    def restore_keyframe(self, stack, index, current):
+        tiles, current = self.keyframes[index], self.keyframes[current]
+        keys = set(self.touched)
+        keys.update(key for key in tiles.keys() | current.keys() if tiles.get(key) is not current.get(key))
+        for layer, tx, ty in keys:
+            box = self.tile_box(stack, tx, ty)
+            tile = tiles.get((layer, tx, ty))
+            if tile is None:
+                stack.layers[layer].paste(TRANSPARENT, box)
+                continue
+            if isinstance(tile, PackedTile):
+                tile = tile.image()
+            stack.layers[layer].paste(tile, box)
+        self.touched = set()
+
+    # put {id(old tile): new tile} in place of the old tiles in every keyframe that shares them
+    def replace_tiles(self, replacements):
+        if not replacements:
+            return
+        self.tiles_changed = True
+        for tiles in self.keyframes.values():
+            for key, tile in tiles.items():
+                new = replacements.get(id(tile))
+                if new is not None:
+                    tiles[key] = new
+
+    # the keyframe the next undo restores, it is never dropped
+    def hot_keyframe(self):
+        return max(k for k in self.keyframes if k <= self.cursor)
+
+    # bring the keyframes back under the history budget and reclaim space in the spill file
+    def enforce_budget(self):
+        if self.history_budget is None:
+            return
+        if self.history_bytes > self.history_budget:
+            self.shrink_keyframes()
+        self.compact_spill()
+
+    # compress, spill and then drop keyframes until they fit the history budget, the ones furthest
+    # from the cursor go first and the hot keyframe last
+    def shrink_keyframes(self):
+        hot = self.hot_keyframe()
+        order = sorted(self.keyframes, key=lambda k: (k == hot, -abs(k - self.cursor)))
+
+        # compress
+        for k in order:
+            self.replace_tiles({
+                id(tile): PackedTile(tile) for tile in self.keyframes[k].values() if not isinstance(tile, PackedTile)
+            })
+            self.update_history_bytes()
+            if self.history_bytes <= self.history_budget:
+                return
+
+        # move to disk
+        if self.spill is not None:
+            for k in order:
+                for tile in self.keyframes[k].values():
+                    if isinstance(tile, PackedTile) and tile.spill is None:
+                        tile.move_to(self.spill)
+                        self.tiles_changed = True
+                self.update_history_bytes()
+                if self.history_bytes <= self.history_budget:
+                    break
+
+        # drop the oldest keyframes, the strokes before the new oldest one can no longer be undone
+        # with a spill file this only happens once it is full
+        spill_budget = self.history_budget * SPILL_BUDGET_FACTOR
+        while min(self.keyframes) < hot and (
+            self.spilled_bytes > spill_budget if self.spill is not None else self.history_bytes > self.history_budget
+        ):
+            del self.keyframes[min(self.keyframes)]
+            self.tiles_changed = True
+            self.update_history_bytes()
+
+    # rewrite the spill file once most of it is data of tiles no keyframe holds any more, left by
+    # dropped and truncated keyframes
+    def compact_spill(self):
+        if self.spill is None or self.spill.size - self.spilled_bytes <= max(self.spilled_bytes, self.history_budget):
+            return
+        spilled = {
+            id(tile): tile for keyframe in self.keyframes.values() for tile in keyframe.values()
+            if isinstance(tile, PackedTile) and tile.spill is self.spill
+        }
+        self.spill.compact(spilled.values())
+
+    # drop undone strokes and the keyframes after them
+    def truncate(self):
+        if self.cursor == len(self):
+            return
+        end = self.offsets[self.cursor]
+        del self.coords[end * 2:]
+        del self.offsets[self.cursor + 1:]
+        del self.widths[self.cursor:]
+        del self.colors[self.cursor:]
+        del self.smoothing[self.cursor:]
+        del self.layers[self.cursor:]
+        del self.tools[self.cursor:]
+        for k in [k for k in self.keyframes if k > self.cursor]:
+            del self.keyframes[k]
+            self.tiles_changed = True
+
+    # drop keyframes that are no longer needed to undo max_history strokes
+    # after an undo, or once the history budget dropped the old keyframes, the floor can be below
+    # the oldest keyframe left, then every one is needed
+    def trim(self):
+        if self.max_history is None:
+            return
+        floor = self.cursor - self.max_history
+        keep = max((k for k in self.keyframes if k <= max(floor, 0)), default=None)
+        if keep is None:
+            return
+        for k in [k for k in self.keyframes if k < keep]:
+            del self.keyframes[k]
+            self.tiles_changed = True
+
+    # get the pixel box of a tile, clipped to the image
+    def tile_box(self, image, tx, ty):
+        ts = self.tile_size
+        return (tx * ts, ty * ts, min((tx + 1) * ts, image.width), min((ty + 1) * ts, image.height))
+
+    # recount the memory held by the journal and its keyframes, and the bytes spilled to disk
+    # the tiles are only walked again after the keyframes changed
+    def update_history_bytes(self):
+        if self.tiles_changed:
+            tiles = {id(tile): tile for keyframe in self.keyframes.values() for tile in keyframe.values()}
+            self.tile_bytes = 0
+            self.spilled_bytes = 0
+            for tile in tiles.values():
+                if isinstance(tile, PackedTile):
+                    self.tile_bytes += tile.resident_bytes
+                    self.spilled_bytes += tile.length if tile.spill is not None else 0
+                else:
+                    self.tile_bytes += tile.width * tile.height * len(tile.getbands())
+            self.tiles_changed = False
+        self.history_bytes = self.tile_bytes
+        for arr in self.arrays():
+            self.history_bytes += arr.itemsize * len(arr)
+        self.peak_history_bytes = max(self.peak_history_bytes, self.history_bytes)
+
+    # the arrays the strokes are kept in, in the order they are serialized
+    def arrays(self):
+        return self.coords, self.offsets, self.widths, self.colors, self.smoothing, self.layers, self.tools
+
+    # serialize the strokes to bytes
+    def to_bytes(self):
+        header = struct.pack("<4sIII", b"OPJ2", len(self), len(self.coords), self.cursor)
+        return header + b"".join(arr.tobytes() for arr in self.arrays())
+
+    # load strokes serialized with to_bytes, the image has to be re-rendered afterwards
+    # journals from before layers (OPJ1) put every stroke on the first layer
+    @classmethod
+    def from_bytes(cls, data, **kwargs):
+        magic, count, coord_count, cursor = struct.unpack_from("<4sIII", data)
+        if magic not in (b"OPJ1", b"OPJ2"):
+            raise ValueError("not an opico draw stroke journal")
+        journal = cls(**kwargs)
+        pos = struct.calcsize("<4sIII")
+        lengths = (coord_count, count + 1, count, count, count, count, count)
+        for arr, length in zip(journal.arrays(), lengths):
+            del arr[:]
+            if magic == b"OPJ1" and arr.typecode == 'B':
+                arr.extend(bytes(length))
+                continue
+            size = arr.itemsize * length
+            arr.frombytes(data[pos:pos + size])
+            pos += size
+        journal.cursor = cursor
+        return journal
+
+# exif orientations that turn the image on its side
+EXIF_ORIENTATION = 0x0112
+SIDEWAYS_ORIENTATIONS = (5, 6, 7, 8)
+
+# the size an image of size ends up at when it is fit inside bounds, it is only ever made smaller
+def fit_size(size, bounds):
+    ratio = min(1, bounds[0] / size[0], bounds[1] / size[1])
+    return max(1, round(size[0] * ratio)), max(1, round(size[1] * ratio))
+
+# open an image file (a name or file object) as a background for a canvas of size, see prescale_background
+# jpegs are decoded straight at the smallest power of two reduction that is still big enough, so a
+# camera photo is never held at full size. this is slow, run it off the tk thread
+def load_background(fp, size):
+    with Image.open(fp) as image:
+        width, height = image.size
+        if image.getexif().get(EXIF_ORIENTATION) in SIDEWAYS_ORIENTATIONS:
+            width, height = height, width
+        fit = fit_size((width, height), size)
+        if fit != (width, height):
+            # draft wants the size before the image is turned
+            image.draft("RGB", fit if (width, height) == image.size else fit[::-1])
+        return prescale_background(image, size)
+
+# fit an image inside a canvas of size and center it on white, as the rgb image set_background takes
+# the image is shrunk by whole factors first, which is fast, then filtered once to the exact size
+def prescale_background(image, size):
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA", "L", "LA"):
+        image = image.convert("RGBA")
+    fit = fit_size(image.size, size)
+    factor = min(image.width // fit[0], image.height // fit[1])
+    if factor > 1:
+        image = image.reduce(factor)
+    if image.size != fit:
+        image = image.resize(fit, Image.LANCZOS)
+    background = Image.new("RGB", size, (255, 255, 255))
+    position = ((size[0] - fit[0]) // 2, (size[1] - fit[1]) // 2)
+    if image.mode in ("RGBA", "LA"):
+        background.paste(image, position, mask=image.getchannel("A"))
+    else:
+        background.paste(image, position)
+    return background
+
+# draws strokes into the layers of a supersampled rgba LayerStack and keeps them in a journal for undo
+# raster_mode "supersample" draws at scale_factor times the canvas size and downsamples,
+# "analytic" draws antialiased capsules straight at canvas size (needs numpy)
+# history_budget and spill_dir are passed on to the StrokeJournal
+class DrawingEngine:
+    def __init__(self, width, height, scale_factor=4, max_history=128, brush="round", raster_mode="supersample",
+                 tile_size=STORE_TILE_SIZE, history_budget=None, spill_dir=None):
+        if raster_mode == "analytic" and load_numpy() is None:
+            raster_mode = "supersample"
+        self.width = width
+        self.height = height
+        self.raster_mode = raster_mode
+        self.scale_factor = 1 if raster_mode == "analytic" else scale_factor
+        self.brush = brush  # "dab" stamps cached sprites, "round" draws lines and ellipses
+        self.tile_size = tile_size  # tiles of the backing store, none for one dense image
+        self.layers = None
+        self.pyramid = None  # MipmapPyramid for zoomed views, made again on every clear
+        self.background_image = None  # an rgb image at canvas size under the drawing, not part of its history
+        self.stroke_state = None
+        self.journal = StrokeJournal(max_history=max_history, history_budget=history_budget, spill_dir=spill_dir)
+        self.smoother = None
+        self.stroke_width = None
+        self.stroke_color = None
+        self.stroke_layer = None
+        self.stroke_moved = False
+        self.revision = 0  # goes up on every change to the drawing
+        self.flatten_cache = None  # (revision, background, image)
+        self.encode_cache = None  # (revision, format, bytes)
+        self.clear()
+
+    # whether a stroke is in progress
+    @property
+    def in_stroke(self):
+        return self.smoother is not None
+
+    # the layer strokes go to
+    @property
+    def image(self):
+        return self.layers.active_layer
+
+    # drop the drawing, its layers and its history
+    # the first layer is reused when the size did not change
+    def clear(self):
+        size = (self.width * self.scale_factor, self.height * self.scale_factor)
+        if self.layers is not None and self.layers.size == size:
+            self.layers.reset()
+        else:
+            self.layers = LayerStack(size[0], size[1], self.tile_size)
+        self.pyramid = MipmapPyramid(self)
+        self.background_image = None
+        self.journal.clear()
+        self.smoother = None
+        self.revision += 1
+
+    # change the canvas size, this clears the drawing
+    def resize(self, width, height):
+        self.width = width
+        self.height = height
+        self.clear()
+
+    # put an image from load_background under the drawing, or none to remove it
+    # it is not a stroke, so undo leaves it alone and the stroke log does not keep it
+    def set_background(self, image):
+        if image is not None and image.size != (self.width, self.height):
+            raise ValueError(f"background is {image.width}x{image.height}, the canvas is {self.width}x{self.height}")
+        self.background_image = image
+        self.pyramid.set_background(image)
+        self.revision += 1
+
+    # add an empty layer on top and draw on it, returns its index
+    def add_layer(self):
+        return self.layers.add()
+
+    # draw on another layer
+    def select_layer(self, index):
+        self.layers.select(index)
+
+    # start a new stroke at a point given in canvas pixels on the active layer
+    # erase draws with transparency instead of color, which shows the layers under it
+    def begin_stroke(self, x, y, width, color, smoothing_factor, erase=False):
+        self.stroke_width = width
+        self.stroke_color = TRANSPARENT if erase else color
+        self.stroke_layer = self.image
+        self.stroke_moved = False
+        self.stroke_state = None
+        tool = TOOL_ERASER if erase else TOOL_PEN
+        self.journal.begin_stroke(x, y, width, color, smoothing_factor, self.layers.active, tool)
+        self.smoother = StrokeSmoother(x, y, smoothing_factor)
+
+    # add raw samples to the stroke in progress and draw them as one polyline
+    # returns the smoothed polyline that was drawn, starting where the last one ended
+    def add_points(self, points):
+        if self.smoother is None or not points:
+            return []
+        self.stroke_moved = True
+        self.revision += 1
+        polyline = [(self.smoother.last_x, self.smoother.last_y)]
+        for x, y in points:
+            self.journal.add_point(x, y)
+            polyline.append(self.smoother.add(x, y)[2:])
+        self.stroke_state = self.draw_polyline(self.stroke_layer, polyline, self.stroke_color, self.stroke_width, self.stroke_state)
+        return polyline
+
+    # finish the stroke in progress, a stroke that never moved becomes a dot
+    # returns the area the stroke covers in canvas pixels, or none
+    def end_stroke(self):
+        if self.smoother is None:
+            return None
+        if not self.stroke_moved or self.needs_end_dab(self.stroke_state):
+            self.draw_dot(self.stroke_layer, (self.smoother.last_x, self.smoother.last_y), self.stroke_color, self.stroke_width)
+        self.smoother = None
+        self.stroke_state = None  # the analytic coverage is as big as the canvas
+        self.stroke_layer = None
+        self.journal.end_stroke(self.layers)
+        self.revision += 1
+        return self.changed(self.journal.strokes_bbox(self.journal.cursor - 1, self.journal.cursor))
+
+    # mark an area (in canvas pixels, or none) stale in the view pyramid and pass it on
+    def changed(self, bbox):
+        if bbox is not None:
+            self.pyramid.mark_dirty(bbox)
+        return bbox
+
+    # undo the last stroke, returns the changed area in canvas pixels or none
+    def undo(self):
+        bbox = self.journal.undo(self.layers, self.render_stroke)
+        if bbox is not None:
+            self.revision += 1
+        return self.changed(bbox)
+
+    # redo the last undone stroke, returns the changed area in canvas pixels or none
+    def redo(self):
+        bbox = self.journal.redo(self.layers, self.render_stroke)
+        if bbox is not None:
+            self.revision += 1
+        return self.changed(bbox)
+
+    # flood fill the area around a point given in canvas pixels on the active layer, it is undone
+    # like a stroke. returns the changed area in canvas pixels, or none if nothing changed
+    def fill(self, x, y, color, tolerance=FILL_TOLERANCE):
+        if self.smoother is not None:
+            return None
+        box = self.fill_area(self.image, (x, y), color, tolerance)
+        if box is None:
+            return None
+        s = self.scale_factor
+        self.journal.begin_stroke(x, y, 0, color, tolerance, self.layers.active, TOOL_FILL)
+        self.journal.add_point(box[0] / s, box[1] / s)
+        self.journal.add_point(box[2] / s, box[3] / s)
+        self.journal.end_stroke(self.layers)
+        self.revision += 1
+        return self.changed(self.journal.strokes_bbox(self.journal.cursor - 1, self.journal.cursor))
+
+    # draw a stroke from the journal onto its layer
+    def render_stroke(self, stack, index):
+        points, width, color, smoothing_factor, layer, tool = self.journal.stroke(index)
+        image = stack.layers[layer]
+        if tool == TOOL_FILL:
+            self.fill_area(image, points[0], color, smoothing_factor)
+            return
+        color = TRANSPARENT if tool == TOOL_ERASER else color
+        if len(points) == 1:
+            self.draw_dot(image, points[0], color, width)
+            return
+        smoother = StrokeSmoother(points[0][0], points[0][1], smoothing_factor)
+        polyline = [points[0]] + [smoother.add(x, y)[2:] for x, y in points[1:]]
+        state = self.draw_polyline(image, polyline, color, width)
+        if self.needs_end_dab(state):
+            self.draw_dot(image, polyline[-1], color, width)
+
+    # the dab brush closes a stroke with a dab on its last point unless it already got one
+    def needs_end_dab(self, state):
+        return self.raster_mode == "supersample" and self.brush == "dab" and bool(state)
+
+    # draw connected segments given in canvas pixels onto the image
+    # state is carried between the batches of one stroke (none at its start), the new state is returned
+    def draw_polyline(self, image, points, color, pen_width, state=None):
+        if self.raster_mode == "analytic":
+            return self.rasterize_capsules(image, points, color, pen_width, state)
+        scaled = [(int(x * self.scale_factor), int(y * self.scale_factor)) for x, y in points]
+        width = int(pen_width * self.scale_factor)
+        if self.brush == "dab":
+            return self.stamp_dabs(image, scaled, color, width, state)
+        radius = width / 2
+        xs = [p[0] for p in scaled]
+        ys = [p[1] for p in scaled]
+        box = (min(xs) - radius - 1, min(ys) - radius - 1, max(xs) + radius + 2, max(ys) + radius + 2)
+        self.journal.touch(box, image.layer)
+        spans = [
+            (min(a[0], b[0]) - radius - 1, min(a[1], b[1]) - radius - 1, max(a[0], b[0]) + radius + 2, max(a[1], b[1]) + radius + 2)
+            for a, b in zip(scaled, scaled[1:] or scaled)
+        ]
+
+        # the segments that reach a tile are drawn in runs of consecutive ones, a tile far from
+        # most of a long stroke only draws the few segments crossing it
+        def draw(region, ox, oy, indices):
+            target = ImageDraw.Draw(region)
+            for first, last in consecutive_runs(indices):
+                self.draw_line_with_round_ends(
+                    [(x - ox, y - oy) for x, y in scaled[first:last + 2]], fill=color, width=width, draw=target
+                )
+
+        image.edit(box, draw, spans)
+        return state
+
+    # draw a dot given in canvas pixels onto the image
+    def draw_dot(self, image, point, color, pen_width):
+        if self.raster_mode == "analytic":
+            self.rasterize_capsules(image, [point], color, pen_width, None)
+            return
+        x1 = int(point[0] * self.scale_factor)
+        y1 = int(point[1] * self.scale_factor)
+        width = int(pen_width * self.scale_factor)
+        if self.brush == "dab":
+            self.stamp_dabs(image, [(x1, y1)], color, width, None)
+            return
+        radius = width / 2
+        box = (x1 - radius - 1, y1 - radius - 1, x1 + radius + 2, y1 + radius + 2)
+        self.journal.touch(box, image.layer)
+        image.edit(box, lambda region, ox, oy, indices: ImageDraw.Draw(region).ellipse(
+            (x1 - radius - ox, y1 - radius - oy, x1 + radius - ox, y1 + radius - oy), fill=color
+        ), [box])
+
+    # draw a line with round ends on the image
+    # coords is either (x1, y1, x2, y2) or a list of (x, y) points drawn as one polyline
+    def draw_line_with_round_ends(self, coords, fill, width, draw):
+        points = list(zip(coords[0::2], coords[1::2])) if not isinstance(coords[0], (tuple, list)) else coords
+        radius = width / 2
+
+        # every segment is drawn on its own and every joint gets one round cap, which gives
+        # the same pixels no matter how the points were batched
+        draw.line(points, fill=fill, width=width)
+        for x, y in points:
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=fill)
+
+    # stamp cached dab sprites every DAB_SPACING widths along points given in image pixels
+    # carry is the distance walked since the last dab, none puts a dab on the first point
+    def stamp_dabs(self, image, points, color, width, carry):
+        ink, mask = dab_sprite(width, color)
+        offset = ink.width / 2
+        spacing = max(1.0, width * DAB_SPACING)
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        box = (min(xs) - offset - 1, min(ys) - offset - 1, max(xs) + offset + 2, max(ys) + offset + 2)
+        self.journal.touch(box, image.layer)
+
+        # dab positions, the spacing carries over from one segment (and batch) to the next
+        dabs = []
+        if carry is None:
+            dabs.append((xs[0], ys[0]))
+            carry = 0.0
+        for (x1, y1), (x2, y2) in zip(points, points[1:]):
+            length = math.hypot(x2 - x1, y2 - y1)
+            t = spacing - carry
+            while t <= length:
+                f = t / length
+                dabs.append((x1 + (x2 - x1) * f, y1 + (y2 - y1) * f))
+                t += spacing
+            carry = length - (t - spacing)
+
+        corners = [(round(x - offset), round(y - offset)) for x, y in dabs]
+
+        def stamp(region, ox, oy, indices):
+            for index in indices:
+                region.paste(ink, (corners[index][0] - ox, corners[index][1] - oy), mask)
+
+        if dabs:
+            image.edit(box, stamp, [(x, y, x + ink.width, y + ink.height) for x, y in corners])
+        return carry
+
+    # draw a polyline given in canvas pixels as antialiased capsules straight into the image
+    # coverage holds the stroke's coverage so far, so its overlapping segments and batches
+    # don't darken each other, returns the updated coverage
+    def rasterize_capsules(self, image, points, color, pen_width, coverage):
+        if coverage is None:
+            coverage = np.zeros((image.height, image.width), np.float32)
+        radius = pen_width / 2
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        x0 = max(0, int(min(xs) - radius) - 1)
+        y0 = max(0, int(min(ys) - radius) - 1)
+        x1 = min(image.width, int(max(xs) + radius) + 2)
+        y1 = min(image.height, int(max(ys) + radius) + 2)
+        if x0 >= x1 or y0 >= y1:
+            return coverage
+        self.journal.touch((x0, y0, x1, y1), image.layer)
+        old = coverage[y0:y1, x0:x1].copy()
+
+        # coverage of each segment from its distance field, merged with max
+        segments = list(zip(points, points[1:])) or [(points[0], points[0])]
+        for (ax, ay), (bx, by) in segments:
+            sx0 = max(x0, int(min(ax, bx) - radius) - 1)
+            sy0 = max(y0, int(min(ay, by) - radius) - 1)
+            sx1 = min(x1, int(max(ax, bx) + radius) + 2)
+            sy1 = min(y1, int(max(ay, by) + radius) + 2)
+            if sx0 >= sx1 or sy0 >= sy1:
+                continue
+            px = np.arange(sx0, sx1, dtype=np.float32)[None, :] + 0.5 - ax
+            py = np.arange(sy0, sy1, dtype=np.float32)[:, None] + 0.5 - ay
+            dx, dy = bx - ax, by - ay
+            length_sq = dx * dx + dy * dy
+            t = np.clip((px * dx + py * dy) / length_sq, 0, 1) if length_sq else 0.0
+            distance = np.hypot(px - t * dx, py - t * dy)
+            segment_coverage = np.clip(radius + 0.5 - distance, 0, 1)
+            area = coverage[sy0:sy1, sx0:sx1]
+            np.maximum(area, segment_coverage, out=area)
+
+        # composite the ink over the image with just the coverage this call added
+        new = coverage[y0:y1, x0:x1]
+        added = np.where(old < 1, (new - old) / np.maximum(1 - old, 1e-6), 0)[..., None]
+        if not added.any():
+            return coverage
+        region = np.asarray(image.crop((x0, y0, x1, y1)), dtype=np.float32) / 255
+        alpha = region[..., 3:]
+        if color == TRANSPARENT:
+            # the eraser only takes alpha away
+            out = np.concatenate((region[..., :3], alpha * (1 - added)), axis=2)
+        else:
+            ink = np.array(ImageColor.getrgb(color)[:3], np.float32) / 255
+            out_alpha = added + alpha * (1 - added)
+            out_rgb = (ink * added + region[..., :3] * alpha * (1 - added)) / np.maximum(out_alpha, 1e-6)
+            out = np.concatenate((out_rgb, out_alpha), axis=2)
+        image.paste(Image.fromarray(np.round(out * 255).astype(np.uint8), "RGBA"), (x0, y0))
+        return coverage
+
+    # which pixels of an image a fill from (x, y) in image pixels may not cover, as a function
+    # giving a boolean array for a box that is blocked outside the image, which canvas pixels
+    # it may cover everywhere and the alpha of each drawn tile
+    # colors are compared premultiplied, so every transparent pixel counts as the same color
+    def fill_mask(self, image, x, y, tolerance):
+        pixel = image.crop((x, y, x + 1, y + 1)).getpixel((0, 0))
+        seed = [c * pixel[3] // 255 for c in pixel[:3]] + [pixel[3]]
+
+        # whether one color is close enough, for missing tiles (transparent, 0 premultiplied) and one colored ones
+        def similar_color(color):
+            premultiplied = [c * color[3] // 255 for c in color[:3]] + [color[3]]
+            return max(abs(a - b) for a, b in zip(premultiplied, seed)) <= tolerance
+
+        s = self.scale_factor
+        # kept a tile at a time, one value for missing and one colored tiles, so the pixels
+        # nothing is drawn on never need an array
+        missing = not similar_color(TRANSPARENT)
+        tiles = {}
+        cells = np.full((image.height // s, image.width // s), not missing)
+        ts = image.tile_size
+        # the cells are worked out a tile at a time when tiles hold whole cells, from the mask otherwise
+        by_tile = ts % s == 0
+        # the alpha of each drawn tile, one number for one colored tiles
+        alphas = {}
+        for (tx, ty), tile in image.tiles.items():
+            x0, y0 = tx * ts, ty * ts
+            w, h = min(tile.width, image.width - x0), min(tile.height, image.height - y0)
+            if (w, h) != tile.size:
+                tile = tile.crop((0, 0, w, h))
+            colors = tile.getcolors(1)
+            if colors:
+                alphas[tx, ty] = colors[0][1][3]
+                tiles[tx, ty] = not similar_color(colors[0][1])
+                if by_tile:
+                    cells[y0 // s:(y0 + h) // s, x0 // s:(x0 + w) // s] = similar_color(colors[0][1])
+                continue
+            # with a transparent seed alpha decides on its own, premultiplied channels are never above it
+            if seed[3] == 0:
+                alphas[tx, ty] = np.asarray(tile.getchannel("A"))
+                similar = alphas[tx, ty] <= tolerance
+            else:
+                pixels = np.asarray(tile)
+                alphas[tx, ty] = pixels[..., 3]
+                similar = np.abs(pixels[..., 3].astype(np.int16) - seed[3]) <= tolerance
+                alpha = pixels[..., 3].astype(np.uint16)
+                for channel in range(3):
+                    premultiplied = (pixels[..., channel] * alpha // 255).astype(np.int16)
+                    similar &= np.abs(premultiplied - seed[channel]) <= tolerance
+            tiles[tx, ty] = ~similar
+            if by_tile:
+                cells[y0 // s:(y0 + h) // s, x0 // s:(x0 + w) // s] = matching_cells(similar, s)
+
+        def blocked(box):
+            x0, y0, x1, y1 = box
+            pixels = np.ones((y1 - y0, x1 - x0), bool)
+            clipped = image.clip(box)
+            if clipped[0] >= clipped[2] or clipped[1] >= clipped[3]:
+                return pixels
+            for tx, ty, (ix0, iy0, ix1, iy1) in image.tiles_in(clipped):
+                tile = tiles.get((tx, ty), missing)
+                if np.ndim(tile):
+                    tile = tile[iy0 - ty * ts:iy1 - ty * ts, ix0 - tx * ts:ix1 - tx * ts]
+                pixels[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0] = tile
+            return pixels
+
+        if not by_tile:
+            cells = matching_cells(~blocked((0, 0) + image.size), s)
+        return blocked, cells, alphas
+
+    # flood fill an image from a point given in canvas pixels, the area is every pixel connected
+    # to the point within tolerance of its color. the pixels around the area get the fill drawn
+    # under them, so antialiased edges blend into it instead of leaving a fringe
+    # returns the changed box in image pixels, or none
+    def fill_area(self, image, point, color, tolerance):
+        s = self.scale_factor
+        x, y = int(point[0] * s) + s // 2, int(point[1] * s) + s // 2
+        if not (0 <= x < image.width and 0 <= y < image.height):
+            return None
+        rgb = ImageColor.getrgb(color)[:3]
+        if image.crop((x, y, x + 1, y + 1)).getpixel((0, 0)) == rgb + (255,):
+            return None
+
+        if load_numpy() is None:
+            # pillow's fill walks single pixels in python, slow on a big canvas but it needs no numpy
+            area = image.crop((0, 0, image.width, image.height))
+            before = area.copy()
+            ImageDraw.floodfill(area, (x, y), rgb + (255,), thresh=tolerance)
+            box = ImageChops.difference(area, before).getbbox(alpha_only=False)
+            if box is not None:
+                image.paste(area.crop(box), box[:2])
+                self.journal.touch(box, image.layer)
+            return box
+
+        # the area is found a canvas pixel at a time, cells that match everywhere connect like pixels
+        # do and the matching pixels of the cells around them join it. inside holds the cells wholly
+        # in the area and reach the ones it has pixels in, both with a border of one cell
+        blocked, cells, alphas = self.fill_mask(image, x, y, tolerance)
+        inside = np.zeros((cells.shape[0] + 2, cells.shape[1] + 2), bool)
+        if cells[y // s, x // s]:
+            x0, y0, found = flood_region(cells, x // s, y // s)
+            inside[y0 + 1:y0 + found.shape[0] + 1, x0 + 1:x0 + found.shape[1] + 1] = found
+            reach = inside.copy()
+            reach[:, 1:] |= inside[:, :-1]
+            reach[:, :-1] |= inside[:, 1:]
+            wide = reach.copy()
+            reach[1:] |= wide[:-1]
+            reach[:-1] |= wide[1:]
+            x0, y0, x1, y1 = x0 - 1, y0 - 1, x0 + found.shape[1] + 1, y0 + found.shape[0] + 1
+        else:
+            # the point is in something thinner than a canvas pixel, that is filled a pixel at a time
+            x0, y0, found = flood_region(~blocked((0, 0) + image.size), x, y)
+            x1, y1 = x0 + found.shape[1], y0 + found.shape[0]
+            blocked = functools.partial(outside_region, x0, y0, found)
+            x0, y0, x1, y1 = x0 // s, y0 // s, -(-x1 // s), -(-y1 // s)
+            reach = np.zeros_like(inside)
+            reach[y0 + 1:y1 + 1, x0 + 1:x1 + 1] = True
+        # the box also holds the ring of pixels around the area, where antialiased edges are
+        box = image.clip((x0 * s - 1, y0 * s - 1, x1 * s + 1, y1 * s + 1))
+        fill = rgb + (255,)
+
+        # the cells under a box in image pixels and the pixel around it inside the image
+        def cells_around(array, box):
+            x0, y0 = max(0, box[0] - 1) // s + 1, max(0, box[1] - 1) // s + 1
+            x1, y1 = min(image.width - 1, box[2]) // s + 2, min(image.height - 1, box[3]) // s + 2
+            return array[y0:y1, x0:x1]
+
+        # which pixels of a box and the pixel around it are in the area, none outside the image
+        def area_around(box):
+            x0, y0, x1, y1 = box
+            around = ~blocked((x0 - 1, y0 - 1, x1 + 1, y1 + 1))
+            cells = reach[(y0 - 1) // s + 1:y1 // s + 2, (x0 - 1) // s + 1:x1 // s + 2]
+            grown = np.repeat(np.repeat(cells, s, axis=0), s, axis=1)
+            ox, oy = (x0 - 1) % s, (y0 - 1) % s
+            return around & grown[oy:oy + y1 - y0 + 2, ox:ox + x1 - x0 + 2]
+
+        # paint it a tile at a time, so whole tiles are just filled. the masks stay mode 1,
+        # pillow pastes through those a few times faster than through an 8 bit mask
+        self.journal.touch(box, image.layer)
+        for tx, ty, part in image.tiles_in(box):
+            if cells_around(inside, part).all():
+                image.paste(fill, part)
+                continue
+            if not cells_around(reach, part).any():
+                continue
+            w, h = part[2] - part[0], part[3] - part[1]
+            around = area_around(part)
+            filled = around[1:-1, 1:-1]
+            ring = (around[:-2, 1:-1] | around[2:, 1:-1] | around[1:-1, :-2] | around[1:-1, 2:]) & ~filled
+            # opaque pixels stay as they are with the fill under them
+            alpha = alphas.get((tx, ty), 0)
+            if np.ndim(alpha):
+                ox, oy = part[0] - tx * image.tile_size, part[1] - ty * image.tile_size
+                alpha = alpha[oy:oy + h, ox:ox + w]
+            ring &= alpha < 255
+            if ring.any():
+                under = Image.new("RGBA", (w, h), fill)
+                under.alpha_composite(image.crop(part))
+                image.paste(under, part[:2], Image.fromarray(ring))
+            if filled.all():
+                image.paste(fill, part)
+            elif filled.any():
+                image.paste(fill, part, Image.fromarray(filled))
+        return box
+
+    # downsample part of the image to canvas pixels, box is (x0, y0, x1, y1) in canvas pixels
+    # image defaults to the live composite of the layers, or pass a copy from snapshot
+    def render_region(self, box, image=None):
+        image = image or self.layers.view()
+        x0, y0, x1, y1 = box
+        if self.scale_factor == 1:
+            return image.crop(box)
+        s = self.scale_factor
+
+        # only read the tiles under the box plus the reach of the lanczos filter
+        margin = 3 * s + 1
+        source = image.clip((x0 * s - margin, y0 * s - margin, x1 * s + margin, y1 * s + margin))
+        area = image.crop(source)
+        return area.resize(
+            (x1 - x0, y1 - y0), Image.LANCZOS,
+            box=(x0 * s - source[0], y0 * s - source[1], x1 * s - source[0], y1 * s - source[1])
+        )
+
+    # draw a box (in window pixels) of a zoomed and scrolled view of the drawing, see MipmapPyramid.render
+    def render_view(self, box, scroll_x, scroll_y, zoom, draft=False):
+        return self.pyramid.render(box, scroll_x, scroll_y, zoom, draft)
+
+    # the same box of the background image, none if there is none
+    def render_background(self, box, scroll_x, scroll_y, zoom, draft=False):
+        return self.pyramid.render(box, scroll_x, scroll_y, zoom, draft, background=True)
+
+    # copy what exporting needs so another thread can flatten it while drawing goes on
+    # the background image is never modified, only replaced, so it is not copied
+    def snapshot(self):
+        return self.revision, self.layers.view().copy(), self.background_image
+
+    # get the drawing at canvas size on the background image or a solid background, or a snapshot of it
+    # the result is cached until the drawing changes, do not modify it
+    def flatten(self, background=(255, 255, 255), snapshot=None):
+        revision, image, background_image = snapshot or (self.revision, None, self.background_image)
+        cached = self.flatten_cache
+        if cached is not None and cached[:2] == (revision, background):
+            return cached[2]
+        image = image or self.layers.view()
+        s = self.scale_factor
+        resized_image = self.render_region((0, 0, image.width // s, image.height // s), image)
+        if background_image is not None:
+            flattened = background_image.copy()
+        else:
+            flattened = Image.new("RGB", resized_image.size, background)
+        flattened.paste(resized_image, mask=resized_image.split()[3])
+        self.flatten_cache = (revision, background, flattened)
+        return flattened
+
+    # get the flattened drawing encoded as bytes, cached until the drawing changes
+    def encode(self, format="PNG", snapshot=None):
+        revision = snapshot[0] if snapshot else self.revision
+        cached = self.encode_cache
+        if cached is not None and cached[:2] == (revision, format):
+            return cached[2]
+        output = BytesIO()
+        self.flatten(snapshot=snapshot).save(output, format)
+        data = output.getvalue()
+        self.encode_cache = (revision, format, data)
+        return data
+
+    # the encoded bytes if the drawing has not changed since they were made, else none
+    def cached_encoding(self, format="PNG"):
+        cached = self.encode_cache
+        if cached is not None and cached[:2] == (self.revision, format):
+            return cached[2]
+        return None
+
+    # write the flattened drawing to a file name or file object
+    def export(self, fp, format="PNG"):
+        data = self.encode(format)
+        if hasattr(fp, "write"):
+            fp.write(data)
+        else:
+            with open(fp, "wb") as f:
+                f.write(data)
+
+    # replace the drawing with strokes serialized by StrokeJournal.to_bytes and draw them
+    def load_journal(self, data):
+        self.clear()
+        self.journal = StrokeJournal.from_bytes(
+            data, max_history=self.journal.max_history, history_budget=self.journal.history_budget, spill=self.journal.spill
+        )
+        self.layers.ensure(self.journal.layer_count())
+        for index in range(self.journal.cursor):
+            self.render_stroke(self.layers, index)
+        if self.journal.cursor:
+            self.journal.save_keyframe(self.layers)
+            self.journal.update_history_bytes()
+        self.pyramid.invalidate()
+        self.revision += 1
+
+    # compress the drawing, its strokes and the background image so the buffers can be dropped while
+    # the window is hidden. resume brings it back, the undo history comes back from the strokes
+    def hibernate(self):
+        tiles = {
+            (layer.layer, tx, ty): PackedTile(tile) for layer in self.layers.layers
+            for (tx, ty), tile in layer.tiles.items() if tile.getbbox(alpha_only=True)
+        }
+        background = PackedTile(self.background_image) if self.background_image is not None else None
+        return (
+            self.width, self.height, zlib.compress(self.journal.to_bytes(), HISTORY_COMPRESSION_LEVEL), tiles, background
+        )
+
+    # bring back a drawing from hibernate, returns false if its size changed since, then the strokes are
+    # drawn again at the new size and the background is fitted into it like load_background does
+    def resume(self, hibernated):
+        width, height, journal, tiles, background = hibernated
+        if (width, height) != (self.width, self.height):
+            self.load_journal(zlib.decompress(journal))
+            self.layers.select(len(self.layers) - 1)
+            if background is not None:
+                self.set_background(prescale_background(background.image(), (self.width, self.height)))
+            return False
+        self.clear()
+        self.journal = StrokeJournal.from_bytes(
+            zlib.decompress(journal), max_history=self.journal.max_history, history_budget=self.journal.history_budget,
+            spill=self.journal.spill
+        )
+        self.layers.ensure(max([self.journal.layer_count()] + [layer + 1 for layer, tx, ty in tiles]))
+        for (layer, tx, ty), tile in tiles.items():
+            self.layers.layers[layer].tiles[(tx, ty)] = tile.image()
+        self.layers.select(len(self.layers) - 1)
+        self.layers.invalidate()
+        if self.journal.cursor:
+            for layer in range(len(self.layers)):
+                self.journal.touch((0, 0, self.layers.width, self.layers.height), layer)
+            self.journal.save_keyframe(self.layers)
+            self.journal.update_history_bytes()
+        self.pyramid.invalidate()
+        if background is not None:
+            self.set_background(background.image())
+        self.revision += 1
+        return True
+
+    # drop the buffers, caches and the spill file, the engine can not be drawn on afterwards
+    # exports already submitted still finish, they hold their own snapshot
+    def close(self):
+        self.layers = None
+        self.pyramid = None
+        self.background_image = None
+        self.journal.clear()
+        if self.journal.spill is not None:
+            self.journal.spill.close()
+        self.stroke_state = None
+        self.flatten_cache = None
+        self.encode_cache = None
+        # pillow keeps freed image blocks around for reuse
+        Image.core.clear_cache()
+
+    # render the applied strokes into a new engine at another scale factor
+    def render(self, scale_factor):
+        engine = DrawingEngine(
+            self.width, self.height, scale_factor=scale_factor, max_history=self.journal.max_history, brush=self.brush,
+            history_budget=self.journal.history_budget
+        )
+        engine.load_journal(self.journal.to_bytes())
+        engine.set_background(self.background_image)
+        return engine
+
+# record types of the stroke log
+LOG_STROKE = 1
+LOG_UNDO = 2
+LOG_REDO = 3
+LOG_SNAPSHOT = 4  # a whole journal from StrokeJournal.to_bytes, written by compaction
+
+# every record starts with its type, the length of its payload and the crc32 of the payload
+LOG_HEADER = struct.Struct("<BII")
+LOG_STROKE_HEADER = struct.Struct("<fIiBB")
+
+# an append-only file of what happened to a stroke journal, so a drawing survives a crash
+# records are batched in memory and written and fsynced on a background thread, flush sends the
+# batch early. after compact_records records the file is rewritten as a single snapshot.
+# nothing is written until start is called, so an old log can be recovered first
+class StrokeLog:
+    def __init__(self, path, batch_records=16, compact_records=512):
+        self.path = path
+        self.batch_records = batch_records
+        self.compact_records = compact_records
+        self.pending = []  # encoded records not handed to the writer yet
+        self.records = 0  # records since the file was last rewritten
+        self.started = False
+        self.file = None  # only used on the writer thread
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="opicodraw-autosave")
+
+    # whether records are waiting for a flush
+    @property
+    def has_pending(self):
+        return bool(self.pending)
+
+    # start logging, the file is rewritten to hold the journal or emptied if there is none
+    def start(self, journal=None):
+        self.started = True
+        if journal is not None and len(journal):
+            self.compact(journal)
+        else:
+            self.discard()
+
+    # log the stroke that was just added to the journal
+    def record_stroke(self, journal):
+        index = journal.cursor - 1
+        start, end = journal.offsets[index], journal.offsets[index + 1]
+        payload = LOG_STROKE_HEADER.pack(journal.widths[index], journal.colors[index], journal.smoothing[index], journal.layers[index], journal.tools[index])
+        self.append(LOG_STROKE, payload + journal.coords[start * 2:end * 2].tobytes(), journal)
+
+    # log an undo
+    def record_undo(self, journal):
+        self.append(LOG_UNDO, b"", journal)
+
+    # log a redo
+    def record_redo(self, journal):
+        self.append(LOG_REDO, b"", journal)
+
+    # log that the drawing was cleared, which empties the file
+    def record_clear(self):
+        if self.started:
+            self.discard()
+
+    # queue a record, the batch goes to the writer once it is full
+    def append(self, kind, payload, journal):
+        if not self.started:
+            return
+        self.pending.append(LOG_HEADER.pack(kind, len(payload), zlib.crc32(payload)) + payload)
+        self.records += 1
+        if self.records >= self.compact_records:
+            self.compact(journal)
+        elif len(self.pending) >= self.batch_records:
+            self.flush()
+
+    # hand the queued records to the writer
+    def flush(self):
+        if self.pending:
+            data, self.pending = b"".join(self.pending), []
+            self.executor.submit(self.write, data)
+
+    # replace the log with one snapshot of the journal, written in the background
+    def compact(self, journal):
+        payload = journal.to_bytes()
+        self.pending = []
+        self.records = 0
+        self.executor.submit(self.rewrite, LOG_HEADER.pack(LOG_SNAPSHOT, len(payload), zlib.crc32(payload)) + payload)
+
+    # empty the log, the drawing it holds is gone
+    def discard(self):
+        self.pending = []
+        self.records = 0
+        self.executor.submit(self.rewrite, b"")
+
+    # append data and fsync it, runs on the writer thread
+    def write(self, data):
+        try:
+            if self.file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.file = open(self.path, "ab")
+            self.file.write(data)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except OSError as e:
+            print(f"could not write autosave: {e}")
+
+    # atomically replace the file with data, runs on the writer thread
+    def rewrite(self, data):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "wb") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"could not write autosave: {e}")
+
+    # write what is queued and stop the writer, delete drops the file as well
+    def close(self, delete=False):
+        if delete:
+            self.pending = []
+            self.executor.submit(self.remove)
+        else:
+            self.flush()
+        self.executor.shutdown(wait=True)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    # delete the file, runs on the writer thread
+    def remove(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"could not delete autosave: {e}")
+
+    # replay a log into a StrokeJournal, none if there is no log or it holds no strokes
+    # reading stops at the first torn or corrupt record
+    @staticmethod
+    def recover(path, **kwargs):
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+        journal = StrokeJournal(**kwargs)
+        pos = 0
+        while pos + LOG_HEADER.size <= len(data):
+            kind, length, crc = LOG_HEADER.unpack_from(data, pos)
+            payload = data[pos + LOG_HEADER.size:pos + LOG_HEADER.size + length]
+            if len(payload) != length or zlib.crc32(payload) != crc:
+                break
+            pos += LOG_HEADER.size + length
+            if kind == LOG_STROKE:
+                width, color, smoothing_factor, layer, tool = LOG_STROKE_HEADER.unpack_from(payload)
+                journal.append(array('f', payload[LOG_STROKE_HEADER.size:]), width, color, smoothing_factor, layer, tool)
+            elif kind == LOG_UNDO:
+                journal.cursor = max(0, journal.cursor - 1)
+            elif kind == LOG_REDO:
+                journal.cursor = min(len(journal), journal.cursor + 1)
+            elif kind == LOG_SNAPSHOT:
+                journal = StrokeJournal.from_bytes(payload, **kwargs)
+        return journal if len(journal) else None
+
+# flattens and encodes drawings on one background thread so the ui does not wait for them
+class ExportWorker:
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="opicodraw-export")
+
+    # encode the drawing as it is now, returns a future with the bytes
+    # callback(data) runs on the worker thread, or right away if the bytes were cached
+    def submit(self, engine, format="PNG", callback=None):
+        data = engine.cached_encoding(format)
+        if data is not None:
+            future = Future()
+            future.set_result(data)
+        else:
+            future = self.executor.submit(engine.encode, format, engine.snapshot())
+        if callback is not None:
+            future.add_done_callback(lambda done: callback(done.result()))
+        return future
+
+    # replay how the drawing was made into an animated gif, png or webp file, see opicodraw_timelapse
+    # the strokes are copied now so drawing goes on meanwhile, returns a future with the frame count
+    # the replay draws like the engine does and its last frame is the flattened drawing
+    def submit_timelapse(self, path, engine, **options):
+        from opicodraw_timelapse import export_timelapse
+
+        journal = StrokeJournal.from_bytes(engine.journal.to_bytes(), max_history=None)
+        snapshot = engine.snapshot()
+
+        def export():
+            return export_timelapse(
+                path, journal, engine.width, engine.height, background=snapshot[2],
+                final=engine.flatten(snapshot=snapshot), scale_factor=engine.scale_factor, brush=engine.brush,
+                raster_mode=engine.raster_mode, **options
+            )
+
+        return self.executor.submit(export)
+
+    # run callback on the worker thread once every export submitted so far is done
+    def when_idle(self, callback):
+        self.executor.submit(callback)
+
+    # stop taking work, waiting for pending exports to finish if wait is set
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
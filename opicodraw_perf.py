@@ -0,0 +1,352 @@
+# opico draw - performance tools
+# startup profiling and latency tracing, only needs the standard library
+# made by ol1fer
+# github: https://github.com/ol1fer/opicodraw
+
+import bisect
+import builtins
+import collections
+import functools
+import json
+import math
+import os
+import sys
+import time
+
+# times the phases of startup and every module imported while it runs
+# when it is not enabled every method does nothing so the app can always call it
+class StartupProfiler:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.phases = []  # (name, seconds)
+        self.imports = []  # (module name, seconds, phase name)
+        self.current_phase = None
+        self.phase_started = None
+        self.import_depth = 0
+        self.original_import = None
+        if enabled:
+            self.original_import = builtins.__import__
+            builtins.__import__ = self.timed_import
+
+    # import hook that times imports which load new modules
+    # only the outermost import is recorded, its time includes everything it pulls in
+    def timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if self.import_depth:
+            self.import_depth += 1
+            try:
+                return self.original_import(name, globals, locals, fromlist, level)
+            finally:
+                self.import_depth -= 1
+        loaded = len(sys.modules)
+        start = time.perf_counter()
+        self.import_depth += 1
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            self.import_depth -= 1
+            if len(sys.modules) > loaded:
+                label = f"{name} ({', '.join(fromlist)})" if fromlist else name
+                self.imports.append((label, time.perf_counter() - start, self.current_phase))
+
+    # start timing a phase, this ends the one before it
+    def begin(self, name):
+        if not self.enabled:
+            return
+        self.end()
+        self.current_phase = name
+        self.phase_started = time.perf_counter()
+
+    # stop timing the current phase
+    def end(self):
+        if not self.enabled or self.current_phase is None:
+            return
+        self.phases.append((self.current_phase, time.perf_counter() - self.phase_started))
+        self.current_phase = None
+
+    # print the breakdown and stop timing imports
+    def report(self):
+        if not self.enabled:
+            return
+        self.end()
+        if self.original_import is not None:
+            builtins.__import__ = self.original_import
+            self.original_import = None
+        print(f"startup took {(time.perf_counter() - self.started) * 1000:.1f} ms")
+        print("phases:")
+        for name, seconds in self.phases:
+            print(f"  {name:<32} {seconds * 1000:8.1f} ms")
+        print("imports, slowest first:")
+        for name, seconds, phase in sorted(self.imports, key=lambda entry: -entry[1]):
+            print(f"  {name:<32} {seconds * 1000:8.1f} ms  ({phase or 'outside a phase'})")
+        self.enabled = False
+
+# get the value below which a fraction of the sorted samples fall (nearest rank)
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_samples)))
+    return sorted_samples[rank - 1]
+
+# count, p50, p95 and p99 of every span name in {name: [milliseconds]}
+def summarize(samples):
+    summary = {}
+    for name, values in samples.items():
+        values = sorted(values)
+        summary[name] = {
+            "count": len(values),
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+        }
+    return summary
+
+# print a summary made by summarize
+def print_summary(summary):
+    for name, stats in summary.items():
+        print(
+            f"  {name:<24} n={stats['count']:<6} p50={stats['p50']:7.1f} ms  "
+            f"p95={stats['p95']:7.1f} ms  p99={stats['p99']:7.1f} ms"
+        )
+
+# times user flows as named spans and appends them to a rolling json lines file
+# a span is started and finished by name, only one span of each name runs at a time
+class SpanTracer:
+    def __init__(self, path=None, max_bytes=1024 * 1024, flush_every=64, keep_samples=1000):
+        self.path = path  # none keeps spans in memory only
+        self.max_bytes = max_bytes  # the file is moved to a .1 backup once it gets this big
+        self.flush_every = flush_every
+        self.keep_samples = keep_samples
+        self.running = {}  # name -> perf_counter start time
+        self.samples = {}  # name -> deque of the latest durations in ms
+        self.pending = []  # json lines not written yet
+
+    # start a span, restart false keeps the start time of one that is already running
+    def start(self, name, restart=True):
+        if restart or name not in self.running:
+            self.running[name] = time.perf_counter()
+
+    # whether a span is running
+    def is_running(self, name):
+        return name in self.running
+
+    # drop a running span without recording it
+    def cancel(self, name):
+        self.running.pop(name, None)
+
+    # finish a span and record it with any extra fields, returns its duration in ms
+    # finishing a span that is not running does nothing and returns none
+    def finish(self, name, **fields):
+        started = self.running.pop(name, None)
+        if started is None:
+            return None
+        duration = (time.perf_counter() - started) * 1000
+        self.samples.setdefault(name, collections.deque(maxlen=self.keep_samples)).append(duration)
+        if self.path is not None:
+            record = {"span": name, "ms": round(duration, 3), "time": round(time.time(), 3)}
+            record.update(fields)
+            self.pending.append(json.dumps(record))
+            if len(self.pending) >= self.flush_every:
+                self.flush()
+        return duration
+
+    # p50, p95 and p99 of the spans recorded since startup
+    def summary(self):
+        return summarize(self.samples)
+
+    # append pending spans to the trace file, moving a full file to the backup first
+    def flush(self):
+        if not self.pending or self.path is None:
+            return
+        lines, self.pending = self.pending, []
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                root, ext = os.path.splitext(self.path)
+                os.replace(self.path, f"{root}.1{ext}")
+            with open(self.path, "a") as file:
+                file.write("\n".join(lines) + "\n")
+        except OSError as e:
+            print(f"could not write trace file: {e}")
+
+# upper bounds in ms of the handler timing histogram buckets, the last bucket takes everything slower
+HISTOGRAM_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 33, 66, 133, 266, 533, 1000)
+
+# call count, total and worst time and a histogram of one handler
+class HandlerTiming:
+    __slots__ = ("count", "total_ms", "max_ms", "buckets")
+
+    def __init__(self):
+        self.reset()
+
+    # forget every call recorded so far
+    def reset(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+
+    # upper bound of the bucket the given fraction of calls fall in, none past the last bound
+    def quantile_bound(self, fraction):
+        needed = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= needed:
+                return HISTOGRAM_BOUNDS_MS[index] if index < len(HISTOGRAM_BOUNDS_MS) else None
+        return None
+
+# times event handlers with a decorator, cheap enough to leave on for every call
+class HandlerStats:
+    def __init__(self):
+        self.handlers = {}  # name -> HandlerTiming
+
+    # decorator that counts and times every call of a function
+    def timed(self, fn):
+        timing = self.handlers.setdefault(fn.__name__, HandlerTiming())
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                ms = (time.perf_counter() - start) * 1000
+                timing.count += 1
+                timing.total_ms += ms
+                if ms > timing.max_ms:
+                    timing.max_ms = ms
+                timing.buckets[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, ms)] += 1
+        return wrapper
+
+    # forget every call recorded so far, the decorated functions keep their timing objects
+    def reset(self):
+        for timing in self.handlers.values():
+            timing.reset()
+
+    # the timings of every handler that was called, as plain data that can be saved as json
+    def summary(self):
+        summary = {}
+        for name, timing in self.handlers.items():
+            if not timing.count:
+                continue
+            labels = [f"<={bound}" for bound in HISTOGRAM_BOUNDS_MS] + [f">{HISTOGRAM_BOUNDS_MS[-1]}"]
+            summary[name] = {
+                "count": timing.count,
+                "mean_ms": timing.total_ms / timing.count,
+                "max_ms": timing.max_ms,
+                "p50_ms_at_most": timing.quantile_bound(0.50),
+                "p99_ms_at_most": timing.quantile_bound(0.99),
+                "histogram_ms": {label: count for label, count in zip(labels, timing.buckets) if count},
+            }
+        return summary
+
+    # print the call count and timings of every handler that was called
+    def print_summary(self):
+        for name, stats in self.summary().items():
+            p99 = stats["p99_ms_at_most"]
+            print(
+                f"  {name:<24} n={stats['count']:<6} mean={stats['mean_ms']:7.2f} ms  "
+                f"max={stats['max_ms']:7.1f} ms  p99<={p99 if p99 is not None else 'inf'} ms"
+            )
+
+# a cprofile session that can be started and stopped while the app runs
+# only code on the thread that started it is profiled, which for the app is the tk thread
+class ProfileSession:
+    def __init__(self, directory):
+        self.directory = directory  # where .pstats files are written
+        self.profile = None
+
+    # whether a session is running
+    @property
+    def running(self):
+        return self.profile is not None
+
+    # start profiling
+    def start(self):
+        import cProfile
+
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    # stop profiling and write the .pstats file, extra is saved next to it as json
+    # returns the path of the .pstats file, or none if nothing was running
+    def stop(self, extra=None):
+        if self.profile is None:
+            return None
+        self.profile.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, time.strftime("profile-%Y%m%d-%H%M%S.pstats"))
+        self.profile.dump_stats(path)
+        self.profile = None
+        if extra is not None:
+            with open(os.path.splitext(path)[0] + ".json", "w") as file:
+                json.dump(extra, file, indent=2)
+        return path
+
+# resident memory of this process in bytes (the working set on windows), none where it can not be read
+def resident_memory_bytes():
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                    "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage"
+                )
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        get_info = ctypes.windll.psapi.GetProcessMemoryInfo
+        get_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+        if get_info(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return None
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+# hand freed memory back to the os: collect garbage, then trim the working set on windows
+# or the c heap on linux
+def release_memory():
+    import ctypes
+    import gc
+
+    gc.collect()
+    if sys.platform == "win32":
+        from ctypes import wintypes
+
+        kernel32 = ctypes.windll.kernel32
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        kernel32.SetProcessWorkingSetSize.argtypes = [wintypes.HANDLE, ctypes.c_size_t, ctypes.c_size_t]
+        kernel32.SetProcessWorkingSetSize(kernel32.GetCurrentProcess(), ctypes.c_size_t(-1).value, ctypes.c_size_t(-1).value)
+    elif sys.platform.startswith("linux"):
+        try:
+            ctypes.CDLL("libc.so.6").malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+
+# read spans from trace files into {name: [milliseconds]}, bad lines are skipped
+def read_trace(paths):
+    samples = {}
+    for path in paths:
+        with open(path) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                    samples.setdefault(record["span"], []).append(float(record["ms"]))
+                except (ValueError, KeyError, TypeError):
+                    continue
+    return samples
+
+# summarize trace files: python opicodraw_perf.py trace.jsonl [trace.1.jsonl]
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python opicodraw_perf.py trace.jsonl [more trace files]")
+        sys.exit(1)
+    print_summary(summarize(read_trace(sys.argv[1:])))
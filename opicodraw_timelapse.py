@@ -0,0 +1,404 @@
+# opico draw - timelapse export
+# replays the strokes of a drawing into an animated gif, png (apng) or webp, only needs pillow so
+# timelapses can be made headless in batch. frames come from a generator and only the part of the
+# canvas that changed is encoded and written, so memory stays at about one frame however long the
+# drawing is. usage: python opicodraw_timelapse.py autosave.journal timelapse.gif [--frames 150]
+# made by ol1fer
+# github: https://github.com/ol1fer/opicodraw
+
+from PIL import Image, ImageChops
+from io import BytesIO
+import math
+import os
+import struct
+import sys
+import zlib
+
+from opicodraw_engine import TOOL_ERASER, TOOL_FILL, TRANSPARENT, DrawingEngine, StrokeJournal, StrokeLog, StrokeSmoother
+
+# frames in a timelapse unless asked otherwise, the first shows the empty canvas
+TIMELAPSE_FRAMES = 150
+
+# how long each frame shows, and the finished drawing before the animation loops
+TIMELAPSE_FRAME_MS = 40
+TIMELAPSE_HOLD_MS = 2000
+
+# formats by file extension
+TIMELAPSE_FORMATS = {".gif": "GIF", ".png": "PNG", ".apng": "PNG", ".webp": "WEBP"}
+
+# raised by write_timelapse when the file grows past max_bytes, with how far it got
+class TimelapseTooLarge(Exception):
+    def __init__(self, written, progress):
+        super().__init__(f"{written} bytes after {progress:.0%} of the frames")
+        self.written = written
+        self.progress = progress
+
+# replay the applied strokes of a journal on a canvas of width x height and yield frames times
+# either (patch, (x, y)), the rgb part of the canvas that changed since the last frame and where it
+# goes, or none when nothing changed. the first frame is the whole empty canvas (or background, an
+# rgb image at canvas size). frames are spaced by points drawn, so a long stroke is cut over several
+# of them and short strokes share one. align rounds the patch position down to a multiple of it
+# engine_options (scale_factor, brush, raster_mode) should be the ones the drawing was made with,
+# final is the finished drawing as flatten gives it, the last frame shows it wherever the replay differs
+def timelapse_frames(journal, width, height, frames=TIMELAPSE_FRAMES, background=None, final=None, align=1,
+                     **engine_options):
+    # the journal of the replay is unused
+    replay = DrawingEngine(width, height, **engine_options)
+    replay.layers.ensure(journal.layer_count())
+    s = replay.scale_factor
+    dirty = None
+
+    # the changed area flattened like an export, grown by the reach of the lanczos filter
+    # or cut out of source, an rgb image at canvas size
+    def patch(box, source=None):
+        x0 = max(0, math.floor(box[0]) - 3) // align * align
+        y0 = max(0, math.floor(box[1]) - 3) // align * align
+        x1, y1 = min(width, math.ceil(box[2]) + 3), min(height, math.ceil(box[3]) + 3)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        if source is not None:
+            return source.crop((x0, y0, x1, y1)), (x0, y0)
+        region = replay.render_region((x0, y0, x1, y1))
+        if background is not None:
+            flattened = background.crop((x0, y0, x1, y1))
+        else:
+            flattened = Image.new("RGB", region.size, (255, 255, 255))
+        flattened.paste(region, mask=region.getchannel("A"))
+        return flattened, (x0, y0)
+
+    def grow(box):
+        nonlocal dirty
+        if box is not None:
+            dirty = box if dirty is None else (
+                min(dirty[0], box[0]), min(dirty[1], box[1]), max(dirty[2], box[2]), max(dirty[3], box[3])
+            )
+
+    # points drawn so far and when the next frame is due, a fill or a dot counts as one
+    offsets = journal.offsets
+    total = sum(max(1, offsets[index + 1] - offsets[index] - 1) for index in range(journal.cursor))
+    step = total / max(1, frames - 1)
+    done, due = 0, step
+    yield patch((0, 0, width, height))
+    emitted = 1
+
+    # yield every frame that is due, the first with the changes and the rest empty
+    def due_frames():
+        nonlocal dirty, due, emitted
+        while done >= due - 1e-9 and emitted < frames:
+            yield patch(dirty) if dirty is not None else None
+            dirty = None
+            due += step
+            emitted += 1
+
+    for index in range(journal.cursor):
+        points, pen_width, color, smoothing_factor, layer, tool = journal.stroke(index)
+        image = replay.layers.layers[layer]
+        if tool == TOOL_FILL:
+            box = replay.fill_area(image, points[0], color, smoothing_factor)
+            grow(box and [c / s for c in box])
+            done += 1
+            yield from due_frames()
+            continue
+        color = TRANSPARENT if tool == TOOL_ERASER else color
+        radius = pen_width / 2 + 1
+        if len(points) == 1:
+            replay.draw_dot(image, points[0], color, pen_width)
+            x, y = points[0]
+            grow((x - radius, y - radius, x + radius, y + radius))
+            done += 1
+            yield from due_frames()
+            continue
+        smoother = StrokeSmoother(points[0][0], points[0][1], smoothing_factor)
+        polyline = [points[0]] + [smoother.add(x, y)[2:] for x, y in points[1:]]
+        start = 0
+        state = None
+        while start < len(polyline) - 1:
+            # draw up to the point the next frame is due at, every piece shares a point with the one
+            # before and carries the brush state on like the batches of a live stroke do
+            count = min(len(polyline) - 1 - start, max(1, math.ceil(due - done)))
+            piece = polyline[start:start + count + 1]
+            state = replay.draw_polyline(image, piece, color, pen_width, state)
+            xs, ys = [p[0] for p in piece], [p[1] for p in piece]
+            grow((min(xs) - radius, min(ys) - radius, max(xs) + radius, max(ys) + radius))
+            start += count
+            done += count
+            if start == len(polyline) - 1 and replay.needs_end_dab(state):
+                replay.draw_dot(image, polyline[-1], color, pen_width)
+            yield from due_frames()
+
+    # the finished drawing is always the last frame, whatever rounding left over
+    while emitted < frames:
+        yield patch(dirty) if dirty is not None else None
+        dirty = None
+        emitted += 1
+    if dirty is not None:
+        yield patch(dirty)
+    if final is not None:
+        difference = ImageChops.difference(patch((0, 0, width, height))[0], final).getbbox()
+        if difference is not None:
+            yield patch(difference, final)
+    replay.close()
+
+# a gif written a frame at a time, every frame is a patch with its own palette over the ones before
+class GifWriter:
+    align = 1
+
+    def __init__(self, fp, size, loop=0):
+        self.fp = fp
+        fp.write(b"GIF89a" + struct.pack("<HHBBB", size[0], size[1], 0, 0, 0))
+        fp.write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", loop) + b"\x00")
+
+    # pillow encodes the patch as a gif of its own, its palette becomes the local one of the frame
+    def add(self, patch, position, duration):
+        output = BytesIO()
+        patch.quantize(256).save(output, "GIF")
+        data = output.getvalue()
+        flags = data[10]
+        pos = 13
+        table = b""
+        if flags & 0x80:
+            table = data[pos:pos + (3 << ((flags & 7) + 1))]
+            pos += len(table)
+        # skip the extensions pillow wrote, up to the image descriptor
+        while data[pos] == 0x21:
+            pos += 2
+            while data[pos]:
+                pos += data[pos] + 1
+            pos += 1
+        w, h, packed = struct.unpack_from("<HHB", data, pos + 5)
+        image = data[pos + 10:data.rindex(b";")]
+        if not packed & 0x80:
+            # the global palette goes in front of the image data as the local one
+            packed = (packed & 0x40) | 0x80 | (flags & 7)
+            image = table + image
+        # keep what was drawn before, delay in hundredths of a second
+        self.fp.write(b"!\xf9\x04\x04" + struct.pack("<H", min(0xffff, round(duration / 10))) + b"\x00\x00")
+        self.fp.write(b"," + struct.pack("<HHHHB", position[0], position[1], w, h, packed) + image)
+
+    def close(self):
+        self.fp.write(b";")
+
+# an animated png written a frame at a time, the frame count is filled in when it is closed
+# so the file has to be seekable
+class ApngWriter:
+    align = 1
+
+    def __init__(self, fp, size, loop=0):
+        self.fp = fp
+        self.size = size
+        self.loop = loop
+        self.frames = 0
+        self.sequence = 0
+        self.actl_position = None
+        fp.write(b"\x89PNG\r\n\x1a\n")
+
+    def chunk(self, kind, data):
+        self.fp.write(struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data)))
+
+    # pillow encodes the patch as a png of its own, its image data becomes the frame
+    def add(self, patch, position, duration):
+        output = BytesIO()
+        patch.save(output, "PNG")
+        data = output.getvalue()
+        chunks = []
+        pos = 8
+        while pos < len(data):
+            length, kind = struct.unpack_from(">I4s", data, pos)
+            chunks.append((kind, data[pos + 8:pos + 8 + length]))
+            pos += length + 12
+        if self.actl_position is None:
+            # the first frame is the whole canvas and doubles as the still image
+            self.chunk(b"IHDR", dict(chunks)[b"IHDR"])
+            self.actl_position = self.fp.tell()
+            self.chunk(b"acTL", struct.pack(">II", 0, self.loop))
+        self.chunk(b"fcTL", struct.pack(
+            ">IIIIIHHBB", self.sequence, patch.width, patch.height, position[0], position[1],
+            min(0xffff, duration), 1000, 0, 0
+        ))
+        self.sequence += 1
+        for kind, payload in chunks:
+            if kind != b"IDAT":
+                continue
+            if self.frames:
+                self.chunk(b"fdAT", struct.pack(">I", self.sequence) + payload)
+                self.sequence += 1
+            else:
+                self.chunk(b"IDAT", payload)
+        self.frames += 1
+
+    def close(self):
+        self.chunk(b"IEND", b"")
+        end = self.fp.tell()
+        self.fp.seek(self.actl_position)
+        self.chunk(b"acTL", struct.pack(">II", self.frames, self.loop))
+        self.fp.seek(end)
+
+# an animated webp written a frame at a time, the riff size is filled in when it is closed so
+# the file has to be seekable. frames can only start at even positions
+class WebpWriter:
+    align = 2
+
+    def __init__(self, fp, size, loop=0):
+        self.fp = fp
+        self.start = fp.tell()
+        fp.write(b"RIFF\0\0\0\0WEBP")
+        self.chunk(b"VP8X", b"\x02\0\0\0" + (size[0] - 1).to_bytes(3, "little") + (size[1] - 1).to_bytes(3, "little"))
+        self.chunk(b"ANIM", b"\xff\xff\xff\xff" + struct.pack("<H", loop))
+
+    def chunk(self, kind, data):
+        self.fp.write(kind + struct.pack("<I", len(data)) + data + b"\0" * (len(data) & 1))
+
+    # pillow encodes the patch as a lossless webp of its own, its bitstream becomes the frame
+    def add(self, patch, position, duration):
+        output = BytesIO()
+        patch.save(output, "WEBP", lossless=True)
+        data = output.getvalue()
+        frame = b""
+        pos = 12
+        while pos < len(data):
+            kind, length = struct.unpack_from("<4sI", data, pos)
+            end = pos + 8 + length + (length & 1)
+            if kind == b"ANMF":
+                # newer pillow writes even a single frame as an animation, take what is inside it
+                frame = data[pos + 24:end]
+            elif kind in (b"ALPH", b"VP8 ", b"VP8L"):
+                frame += data[pos:end]
+            pos = end
+        header = b"".join(value.to_bytes(3, "little") for value in (
+            position[0] // 2, position[1] // 2, patch.width - 1, patch.height - 1, min(0xffffff, duration)
+        ))
+        # the frames are opaque, they replace what is under them without blending
+        self.chunk(b"ANMF", header + b"\x02" + frame)
+
+    def close(self):
+        end = self.fp.tell()
+        self.fp.seek(self.start + 4)
+        self.fp.write(struct.pack("<I", end - self.start - 8))
+        self.fp.seek(end)
+
+TIMELAPSE_WRITERS = {"GIF": GifWriter, "PNG": ApngWriter, "WEBP": WebpWriter}
+
+# write a timelapse of a journal to a seekable file object, returns the number of frames written
+# frames where nothing changed are merged into the one before by making it show longer, raises
+# TimelapseTooLarge as soon as the file grows past max_bytes
+def write_timelapse(fp, journal, width, height, format="GIF", frames=TIMELAPSE_FRAMES, max_bytes=None,
+                    background=None, frame_ms=TIMELAPSE_FRAME_MS, hold_ms=TIMELAPSE_HOLD_MS, **replay_options):
+    writer_class = TIMELAPSE_WRITERS[format.upper()]
+    start = fp.tell()
+    writer = writer_class(fp, (width, height))
+    pending = None
+    written = 0
+    replay = timelapse_frames(journal, width, height, frames, background, align=writer_class.align, **replay_options)
+    for index, frame in enumerate(replay):
+        if frame is None:
+            pending[2] += frame_ms
+            continue
+        if pending is not None:
+            writer.add(*pending)
+            written += 1
+            if max_bytes is not None and fp.tell() - start > max_bytes:
+                raise TimelapseTooLarge(fp.tell() - start, index / frames)
+        pending = [frame[0], frame[1], frame_ms]
+    pending[2] += hold_ms - frame_ms
+    writer.add(*pending)
+    writer.close()
+    if max_bytes is not None and fp.tell() - start > max_bytes:
+        raise TimelapseTooLarge(fp.tell() - start, 1)
+    return written + 1
+
+# write a timelapse to a file name or seekable file object, the format defaults to the file extension
+# with max_bytes it is encoded again with fewer frames until it has the most frames that fit,
+# raises ValueError if not even two do
+def export_timelapse(fp, journal, width, height, format=None, frames=TIMELAPSE_FRAMES, max_bytes=None, **options):
+    if format is None:
+        name = str(getattr(fp, "name", "")) if hasattr(fp, "write") else os.fspath(fp)
+        format = TIMELAPSE_FORMATS.get(os.path.splitext(name)[1].lower(), "GIF")
+    frames = max(2, frames)
+    file = fp if hasattr(fp, "write") else open(fp, "wb")
+    start = file.tell()
+
+    # encode with count frames, returns the frames written or none if it did not fit
+    def encode(count):
+        nonlocal guess
+        file.seek(start)
+        file.truncate()
+        try:
+            return write_timelapse(file, journal, width, height, format, count, max_bytes, **options)
+        except TimelapseTooLarge as error:
+            # the whole size from how far it got, the frames scale it down about in proportion
+            size = error.written / max(error.progress, 1 / count)
+            guess = int(count * max_bytes / size)
+            return None
+
+    try:
+        guess = None
+        written = encode(frames)
+        if written is not None:
+            return written
+        # the most frames that fit is at least fits and less than too_many, the first guess
+        # narrows that down and halving it does the rest
+        fits, too_many = 1, frames
+        count = max(2, min(frames - 1, guess))
+        while True:
+            written = encode(count)
+            if written is not None:
+                fits, best = count, written
+            else:
+                too_many = count
+            if too_many - fits <= 1:
+                break
+            count = (fits + too_many) // 2
+        if fits < 2:
+            raise ValueError(f"the timelapse does not fit in {max_bytes} bytes, even with 2 frames")
+        return best if count == fits else encode(fits)
+    finally:
+        if file is not fp:
+            file.close()
+
+# read strokes from a stroke log (autosave.journal) or a file written with StrokeJournal.to_bytes
+def read_journal(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    if data.startswith(b"OPJ"):
+        return StrokeJournal.from_bytes(data, max_history=None)
+    journal = StrokeLog.recover(path, max_history=None)
+    if journal is None:
+        raise ValueError(f"no strokes in {path}")
+    return journal
+
+def size_arg(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+# make a timelapse from the command line, the canvas size defaults to just fit the strokes
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="replay an opico draw drawing into an animated gif, png or webp")
+    parser.add_argument("journal", help="autosave.journal from the config folder, or a saved stroke journal")
+    parser.add_argument("output", help="the file to write, .gif, .png, .apng or .webp")
+    parser.add_argument("--size", type=size_arg, help="canvas size as WIDTHxHEIGHT")
+    parser.add_argument("--frames", type=int, default=TIMELAPSE_FRAMES)
+    parser.add_argument("--max-size", type=int, help="largest file size in kb, frames are merged to fit")
+    parser.add_argument("--frame-ms", type=int, default=TIMELAPSE_FRAME_MS)
+    parser.add_argument("--hold-ms", type=int, default=TIMELAPSE_HOLD_MS)
+    parser.add_argument("--brush", choices=["round", "dab"], default="round", help="the brush setting it was drawn with")
+    parser.add_argument(
+        "--raster-mode", choices=["supersample", "analytic"], default="supersample", help="the raster_mode it was drawn with"
+    )
+    args = parser.parse_args()
+    try:
+        journal = read_journal(args.journal)
+        size = args.size
+        if size is None:
+            box = journal.strokes_bbox(0, journal.cursor) or (0, 0, 1, 1)
+            size = (max(1, math.ceil(box[2])), max(1, math.ceil(box[3])))
+        count = export_timelapse(
+            args.output, journal, size[0], size[1], frames=args.frames,
+            max_bytes=args.max_size * 1024 if args.max_size else None, frame_ms=args.frame_ms, hold_ms=args.hold_ms,
+            brush=args.brush, raster_mode=args.raster_mode
+        )
+    except (OSError, ValueError) as error:
+        print(f"error: {error}")
+        sys.exit(1)
+    print(f"{args.output}: {count} frames, {size[0]}x{size[1]}, {os.path.getsize(args.output) / 1024:.0f} kb")
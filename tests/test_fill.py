@@ -0,0 +1,86 @@
+# opico draw - flood fill tests
+# usage: python -m pytest tests
+
+import math
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PIL import ImageChops
+
+from opicodraw_engine import DrawingEngine
+
+WIDTH, HEIGHT = 300, 200
+RING = "#203080"
+FILL = "#f0d020"
+CENTER, RADIUS = (150, 100), 60
+
+# a closed ring of a few pixels width around CENTER
+def draw_ring(**options):
+    engine = DrawingEngine(WIDTH, HEIGHT, **options)
+    points = [
+        (CENTER[0] + RADIUS * math.cos(step * math.pi / 32), CENTER[1] + RADIUS * math.sin(step * math.pi / 32))
+        for step in range(65)
+    ]
+    engine.begin_stroke(points[0][0], points[0][1], 4, RING, 0)
+    engine.add_points(points[1:])
+    engine.end_stroke()
+    return engine
+
+def same(first, second):
+    return ImageChops.difference(first, second).getbbox() is None
+
+def near(pixel, expected, tolerance=8):
+    return all(abs(a - b) <= tolerance for a, b in zip(pixel, expected))
+
+def rgb(color):
+    return tuple(int(color[index:index + 2], 16) for index in (1, 3, 5))
+
+@pytest.mark.parametrize("options", [{}, {"scale_factor": 1}, {"raster_mode": "analytic"}])
+def test_fill_inside(options):
+    engine = draw_ring(**options)
+    box = engine.fill(*CENTER, FILL)
+    assert box is not None
+    # the fill stays inside the ring, it may reach under its antialiased edge
+    assert CENTER[0] - RADIUS - 2 <= box[0] and box[2] <= CENTER[0] + RADIUS + 2
+    image = engine.flatten()
+    assert image.getpixel(CENTER) == rgb(FILL)
+    assert image.getpixel((CENTER[0] + RADIUS - 8, CENTER[1])) == rgb(FILL)
+    assert image.getpixel((5, 5)) == (255, 255, 255)
+    assert near(image.getpixel((CENTER[0] + RADIUS, CENTER[1])), rgb(RING))
+
+@pytest.mark.parametrize("options", [{}, {"scale_factor": 1}, {"raster_mode": "analytic"}])
+def test_fill_outside(options):
+    engine = draw_ring(**options)
+    assert engine.fill(5, 5, FILL) is not None
+    image = engine.flatten()
+    assert image.getpixel((5, 5)) == rgb(FILL)
+    assert image.getpixel((WIDTH - 1, HEIGHT - 1)) == rgb(FILL)
+    assert image.getpixel(CENTER) == (255, 255, 255)
+    assert near(image.getpixel((CENTER[0] + RADIUS, CENTER[1])), rgb(RING))
+
+def test_fill_same_color_changes_nothing():
+    engine = draw_ring()
+    engine.fill(*CENTER, FILL)
+    assert engine.fill(*CENTER, FILL) is None
+
+def test_fill_undo_redo():
+    engine = draw_ring()
+    before = engine.flatten()
+    engine.fill(*CENTER, FILL)
+    filled = engine.flatten()
+    engine.undo()
+    assert same(engine.flatten(), before)
+    engine.redo()
+    assert same(engine.flatten(), filled)
+
+def test_fill_replay():
+    engine = draw_ring()
+    engine.fill(*CENTER, FILL)
+    engine.fill(5, 5, "#c02020")
+    replay = DrawingEngine(WIDTH, HEIGHT)
+    replay.load_journal(engine.journal.to_bytes())
+    assert same(replay.flatten(), engine.flatten())
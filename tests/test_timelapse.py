@@ -0,0 +1,97 @@
+# opico draw - timelapse export tests
+# every format is written and read back with pillow, the muxers patch sizes and splice chunks by hand
+# usage: python -m pytest tests
+
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PIL import Image, ImageChops
+
+from opicodraw_engine import DrawingEngine
+from opicodraw_timelapse import export_timelapse, write_timelapse
+
+WIDTH, HEIGHT = 160, 100
+
+# a few strokes, a fill and some erasing with the given engine settings
+def make_drawing(**options):
+    engine = DrawingEngine(WIDTH, HEIGHT, **options)
+    strokes = [
+        ([(20, 20), (60, 30), (100, 25), (140, 60)], 6, "#203080"),
+        ([(30, 80), (70, 50), (120, 85)], 3, "#c02020"),
+        ([(80, 10)], 9, "#10a010"),
+    ]
+    for points, width, color in strokes:
+        engine.begin_stroke(points[0][0], points[0][1], width, color, 2)
+        engine.add_points(points[1:])
+        engine.end_stroke()
+    engine.fill(5, 95, "#f0d020")
+    engine.begin_stroke(60, 20, 8, "#000000", 2, erase=True)
+    engine.add_points([(70, 60)])
+    engine.end_stroke()
+    return engine
+
+def export_options(engine):
+    return dict(scale_factor=engine.scale_factor, brush=engine.brush, raster_mode=engine.raster_mode)
+
+# the frames of an animation as rgb images with their durations in milliseconds
+def read_frames(data):
+    image = Image.open(io.BytesIO(data))
+    frames = []
+    for index in range(getattr(image, "n_frames", 1)):
+        image.seek(index)
+        frames.append((image.convert("RGB"), image.info.get("duration")))
+    return frames
+
+@pytest.mark.parametrize("format", ["GIF", "PNG", "WEBP"])
+def test_formats_decode(format):
+    engine = make_drawing()
+    output = io.BytesIO()
+    count = export_timelapse(output, engine.journal, WIDTH, HEIGHT, format=format, frames=12,
+                             frame_ms=40, hold_ms=1000, **export_options(engine))
+    frames = read_frames(output.getvalue())
+    assert len(frames) == count
+    durations = [duration for _, duration in frames]
+    # frames where nothing changed are merged into the one before them
+    assert all(duration > 0 and duration % 40 == 0 for duration in durations[:-1])
+    assert durations[-1] >= 1000 and (durations[-1] - 1000) % 40 == 0
+    # gif frames have a palette of their own, the others are lossless
+    extrema = ImageChops.difference(frames[-1][0], engine.flatten()).getextrema()
+    assert max(high for _, high in extrema) <= (32 if format == "GIF" else 0)
+
+@pytest.mark.parametrize("options", [{"brush": "dab"}, {"raster_mode": "analytic"}, {"scale_factor": 3}])
+def test_last_frame_is_the_drawing(options):
+    engine = make_drawing(**options)
+    output = io.BytesIO()
+    export_timelapse(output, engine.journal, WIDTH, HEIGHT, format="PNG", frames=8, **export_options(engine))
+    assert ImageChops.difference(read_frames(output.getvalue())[-1][0], engine.flatten()).getbbox() is None
+
+def test_final_frame_covers_a_different_replay():
+    engine = make_drawing(brush="dab")
+    output = io.BytesIO()
+    # replayed with the round brush the strokes come out different, final puts the drawing back
+    export_timelapse(output, engine.journal, WIDTH, HEIGHT, format="PNG", frames=8, brush="round",
+                     final=engine.flatten())
+    assert ImageChops.difference(read_frames(output.getvalue())[-1][0], engine.flatten()).getbbox() is None
+
+def test_max_bytes_keeps_the_most_frames_that_fit():
+    engine = make_drawing()
+    sizes = {}
+    for frames in range(2, 25):
+        output = io.BytesIO()
+        write_timelapse(output, engine.journal, WIDTH, HEIGHT, "GIF", frames)
+        sizes[frames] = output.getvalue()
+    max_bytes = (len(sizes[6]) + len(sizes[7])) // 2
+    fitting = max(frames for frames, data in sizes.items() if len(data) <= max_bytes)
+    output = io.BytesIO()
+    export_timelapse(output, engine.journal, WIDTH, HEIGHT, format="GIF", frames=24, max_bytes=max_bytes)
+    assert output.getvalue() == sizes[fitting]
+
+def test_max_bytes_too_small():
+    engine = make_drawing()
+    with pytest.raises(ValueError):
+        export_timelapse(io.BytesIO(), engine.journal, WIDTH, HEIGHT, format="GIF", max_bytes=100)